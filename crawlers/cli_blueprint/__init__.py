@@ -3,10 +3,12 @@ CLI tool for crawler interactions.
 """
 
 import os
+import json
 import logging
 import click
 import uuid
 import base64
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from typing import List
 from urllib.parse import urljoin
 from flask import Blueprint, current_app
@@ -14,7 +16,10 @@ from dotenv import load_dotenv
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from crawlers.constants import CRAWLER_IS_RUNNING_ENV_KEY
-from crawlers.lib.crawl import process_block_url
+from crawlers.lib.crawl import dead_ids_max_age, process_block_url, run_block_loops_async
+from crawlers.lib.dead_ids import DeadIdIndex, dead_ids_path
+from crawlers.lib.platforms.github import GitHubV4Crawler
+from crawlers.lib.pipeline import BlockPipeline
 
 load_dotenv()
 
@@ -23,14 +28,14 @@ logger = logging.getLogger(__name__)
 cli_bp = Blueprint("cli", __name__)
 
 
-def get_requests_session():
+def get_requests_session(pool_size: int = 10):
     import requests
 
     session = requests.session()
     retries = Retry(
         total=3, backoff_factor=10, status_forcelist=[429, 500, 502, 503, 504]
     )
-    session.mount("https://", HTTPAdapter(max_retries=retries))
+    session.mount("https://", HTTPAdapter(max_retries=retries, pool_maxsize=pool_size))
     crawler_uuid = uuid.uuid4().hex
     session.headers.update({
         "User-Agent": current_app.config["USER_AGENT"],
@@ -46,25 +51,109 @@ def get_requests_session():
     return session
 
 
+def is_running() -> bool:
+    return os.environ.get(CRAWLER_IS_RUNNING_ENV_KEY, "0") == "1"
+
+
+def stop_running():
+    """ Make block loops stop, after finishing their current block. """
+    os.environ[CRAWLER_IS_RUNNING_ENV_KEY] = "0"
+
+
+def run_block_urls(session, block_urls: List[str], pipeline: bool = False, workers: int = 1,
+                   use_async: bool = False):
+    """
+    Crawl blocks from block_urls (taking turns) until stopped.
+
+    With multiple workers, each runs its own block loop on a thread (or as a task on one event loop, when async),
+    sharing the indexer session and the per-hoster sessions and rate-limits.
+    When a worker fails, the others stop after their current block, and its exception is raised.
+    """
+    os.environ[CRAWLER_IS_RUNNING_ENV_KEY] = "1"
+    if use_async:
+        if pipeline:
+            logger.warning("--pipeline is not supported by the async crawlers, ignoring it")
+        if current_app.config["CALLBACK_STREAMING"]:
+            logger.warning("callback streaming is not supported by the async crawlers - they upload whole blocks")
+        run_block_loops_async(session, block_urls, is_running=is_running, workers=workers)
+    elif workers > 1:
+        app = current_app._get_current_object()
+
+        def worker(worker_index: int):
+            # start each worker at a different hoster
+            offset = worker_index % len(block_urls)
+            with app.app_context():
+                _run_block_loop(session, block_urls[offset:] + block_urls[:offset], pipeline)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crawl-worker") as executor:
+            futures = [executor.submit(worker, worker_index) for worker_index in range(workers)]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = [future for future in done if future.exception() is not None]
+            if failed:
+                error = failed[0].exception()
+                logger.error(f"crawl worker {futures.index(failed[0])} failed - stopping the others", exc_info=error)
+                stop_running()
+                raise error
+    else:
+        _run_block_loop(session, block_urls, pipeline)
+
+
+def _run_block_loop(session, block_urls: List[str], pipeline: bool):
+    if pipeline:
+        BlockPipeline(
+            session,
+            block_urls,
+            is_running=is_running,
+            prefetch_depth=current_app.config["CRAWLER_PREFETCH_BLOCKS"],
+            upload_depth=current_app.config["CRAWLER_UPLOAD_QUEUE_SIZE"],
+        ).run()
+    else:
+        while is_running():
+            for url in block_urls:
+                process_block_url(session, url)
+
+
+pipeline_option = click.option(
+    "--pipeline", is_flag=True, default=False,
+    help="Lease the next block and upload results in the background, while crawling."
+)
+async_option = click.option(
+    "--async", "use_async", is_flag=True, default=False,
+    help="Crawl with the asyncio crawlers, all workers sharing one event loop."
+)
+workers_option = click.option(
+    "--workers", type=click.IntRange(min=1), default=1,
+    help="Number of block loops to run in parallel threads of this process."
+)
+
+
+def workers_pool_size(workers: int) -> int:
+    """ Connections needed to the indexer - a pipelined worker fetches, crawls and uploads at once. """
+    return max(10, workers * 3)
+
+
 # todo: make list command
 
 
 @cli_bp.cli.command(help="Start automatic crawler against a specific block_url.")
 @click.argument("block_url")
-def crawl_block_url(block_url: str):
+@pipeline_option
+@async_option
+def crawl_block_url(block_url: str, pipeline: bool, use_async: bool):
     session = get_requests_session()
-
-    os.environ[CRAWLER_IS_RUNNING_ENV_KEY] = "1"
-    while os.environ[CRAWLER_IS_RUNNING_ENV_KEY]:
-        process_block_url(session, block_url)
+    run_block_urls(session, [block_url], pipeline=pipeline, use_async=use_async)
 
 
 @cli_bp.cli.command(help="Start automatic crawler against specific hosters.")
 @click.argument("hoster_api_domains", nargs=-1)
-def crawl_hoster(hoster_api_domains: List[str] = None):
+@pipeline_option
+@workers_option
+@async_option
+def crawl_hoster(hoster_api_domains: List[str] = None, pipeline: bool = False, workers: int = 1,
+                 use_async: bool = False):
     hoster_api_domains = list(hoster_api_domains)
     indexer_url = current_app.config["INDEXER_URL"]
-    session = get_requests_session()
+    session = get_requests_session(pool_size=workers_pool_size(workers))
     block_urls = []
 
     # gets a list of all hosters from the indexer
@@ -87,27 +176,46 @@ def crawl_hoster(hoster_api_domains: List[str] = None):
     else:
         raise KeyError("specify at least one hoster api url!")
 
-    os.environ[CRAWLER_IS_RUNNING_ENV_KEY] = "1"
-    while os.environ[CRAWLER_IS_RUNNING_ENV_KEY]:
-        for url in block_urls:
-            process_block_url(session, url)
+    run_block_urls(session, block_urls, pipeline=pipeline, workers=workers, use_async=use_async)
 
 
 @cli_bp.cli.command(help="Start automatic crawler with a hoster type (such as github)")
 @click.argument("platform-type")
-def crawl_type(platform_type: str):
+@pipeline_option
+@workers_option
+@async_option
+def crawl_type(platform_type: str, pipeline: bool, workers: int, use_async: bool):
     indexer_url = current_app.config["INDEXER_URL"]
-    session = get_requests_session()
+    session = get_requests_session(pool_size=workers_pool_size(workers))
 
     block_url = urljoin(
         indexer_url, f"api/v1/hosters/{platform_type}/loadbalanced_block"
     )
+    run_block_urls(session, [block_url], pipeline=pipeline, workers=workers, use_async=use_async)
 
-    os.environ[CRAWLER_IS_RUNNING_ENV_KEY] = "1"
-    while os.environ[CRAWLER_IS_RUNNING_ENV_KEY]:
-        process_block_url(session, block_url)
+
+@cli_bp.cli.command(help="Export the repository ids of a hoster, that were found not to exist (as JSON ranges).")
+@click.argument("hoster_api_url")
+@click.option("--output", type=click.File("w"), default="-", help="File to write to (default: stdout).")
+def export_dead_ids(hoster_api_url: str, output):
+    store_path = current_app.config["DEAD_IDS_STORE_PATH"]
+    if not store_path:
+        raise click.UsageError("no dead ids are kept - set HUBGREP_CRAWLERS_DEAD_IDS_STORE")
+    dead_ids = DeadIdIndex(dead_ids_path(store_path, hoster_api_url), max_age=dead_ids_max_age(current_app.config))
+    json.dump(dict(api_url=hoster_api_url, **dead_ids.export()), output)
+    output.write("\n")
+
+
+@cli_bp.cli.command(help="Find the highest existing repository id of a GitHub api, e.g. to allocate blocks up to it.")
+@click.argument("hoster_api_url")
+@click.option("--api-key", envvar="HUBGREP_CRAWLERS_GITHUB_API_KEY", required=True, help="GitHub token to query with.")
+@click.option("--from-id", type=int, default=0, help="Lowest id to search from, e.g. the last known frontier.")
+def probe_github_frontier(hoster_api_url: str, api_key: str, from_id: int):
+    crawler = GitHubV4Crawler(base_url=hoster_api_url, api_key=api_key, user_agent=current_app.config["USER_AGENT"])
+    frontier = crawler.probe_frontier(from_id)
+    click.echo(json.dumps(dict(api_url=hoster_api_url, frontier=frontier)))
 
 
 @cli_bp.cli.command(help="Stop automatic crawlers, after finishing the current block.")
 def crawl_stop():
-    os.environ[CRAWLER_IS_RUNNING_ENV_KEY] = "0"
+    stop_running()
@@ -3,6 +3,14 @@ HubGrep environment configurations.
 """
 import os
 
+from crawlers.constants import CALLBACK_FORMAT_JSON, CALLBACK_ENCODING_AUTO
+
+
+def _optional_int(key: str, default: int = None):
+    """ An int from the environment - None when set empty, default when not set. """
+    value = os.environ.get(key, None if default is None else str(default))
+    return int(value) if value else None
+
 
 class Config:
     """ Base configuration. """
@@ -13,12 +21,75 @@ class Config:
 
     CRAWLER_SLEEP_NO_BLOCK = 5
 
+    # stream results to the indexer while crawling, instead of uploading the whole block at the end
+    CALLBACK_STREAMING = False
+    CALLBACK_STREAM_FORMAT = CALLBACK_FORMAT_JSON
+    # only ask hosters for, and pass on to the indexer, the fields crawlers declare (see crawlers.lib.projection)
+    # - off until the declared fields are checked against what the indexer reads
+    CALLBACK_PROJECTION = False
+    # Content-Encoding of callback uploads - gzip, zstd, auto (as the indexer announces per block) or empty for none
+    CALLBACK_ENCODING = CALLBACK_ENCODING_AUTO
+
+    # pipelined crawling (--pipeline) - blocks leased ahead of the current one, and crawled blocks waiting for upload
+    CRAWLER_PREFETCH_BLOCKS = 1
+    CRAWLER_UPLOAD_QUEUE_SIZE = 1
+
+    # split page/id ranges of a block into this many sub-ranges, crawled concurrently (where crawlers support it)
+    # - each sub-range buffers a few pages while waiting for the ones before it
+    CRAWLER_BLOCK_PARTITIONS = 1
+
+    # directory to share rate-limit budgets with all crawler processes on this machine (None: per process)
+    RATELIMIT_STORE_PATH = None
+    # spread requests evenly until the rate-limit resets, leaving a part of the budget unused
+    RATELIMIT_PACING = True
+    RATELIMIT_PACING_MARGIN = 0.05
+
+    # directory to keep the repository ids found not to exist, per hoster (None: don't keep them)
+    DEAD_IDS_STORE_PATH = None
+    # forget them after this many days, to check them again (None: never)
+    DEAD_IDS_MAX_AGE_DAYS = 30
+    # remember this many repository fingerprints per hoster, to refresh only repositories that changed (0: don't)
+    REFRESH_FINGERPRINTS_MAX = 0
+    # upload unchanged repositories of such a refresh, as minimal repositories marked "unchanged": true
+    # (see GitHubV4Crawler.skip_unchanged_ids) - only for indexers that know these, others don't get them at all
+    GITHUB_UPLOAD_UNCHANGED = False
+
+    # GitHub topics cost extra, so we only get them for repositories that match any of these (None: don't check),
+    # spending up to this share of our remaining points on them (0: no topics)
+    GITHUB_TOPICS_BUDGET_SHARE = 0
+    GITHUB_TOPICS_MIN_STARS = None
+    GITHUB_TOPICS_MIN_FORKS = None
+    GITHUB_TOPICS_PUSHED_WITHIN_DAYS = None
+
+    # GitLab hosts (of api urls) to walk with keyset pagination - others use page numbers
+    GITLAB_KEYSET_HOSTS = []
+
 
 class _EnvironmentConfig(Config):
     USER_AGENT = f'HobGrebbit v{Config.VERSION} {os.environ.get("HUBGREP_CRAWLERS_USER_AGENT_SUFFIX")}'
     MACHINE_ID = os.environ.get("HUBGREP_CRAWLERS_MACHINE_ID")
     INDEXER_URL = os.environ.get("HUBGREP_INDEXER_URL")
     INDEXER_API_KEY = os.environ.get("HUBGREP_INDEXER_API_KEY")
+    CALLBACK_STREAMING = os.environ.get("HUBGREP_CRAWLERS_CALLBACK_STREAMING", "").lower() in ("1", "true")
+    CALLBACK_STREAM_FORMAT = os.environ.get("HUBGREP_CRAWLERS_CALLBACK_STREAM_FORMAT", CALLBACK_FORMAT_JSON)
+    CALLBACK_PROJECTION = os.environ.get("HUBGREP_CRAWLERS_CALLBACK_PROJECTION", "").lower() in ("1", "true")
+    CALLBACK_ENCODING = os.environ.get("HUBGREP_CRAWLERS_CALLBACK_ENCODING", CALLBACK_ENCODING_AUTO)
+    CRAWLER_PREFETCH_BLOCKS = int(os.environ.get("HUBGREP_CRAWLERS_PREFETCH_BLOCKS", 1))
+    CRAWLER_UPLOAD_QUEUE_SIZE = int(os.environ.get("HUBGREP_CRAWLERS_UPLOAD_QUEUE_SIZE", 1))
+    CRAWLER_BLOCK_PARTITIONS = int(os.environ.get("HUBGREP_CRAWLERS_BLOCK_PARTITIONS", 1))
+    RATELIMIT_STORE_PATH = os.environ.get("HUBGREP_CRAWLERS_RATELIMIT_STORE") or None
+    RATELIMIT_PACING = os.environ.get("HUBGREP_CRAWLERS_RATELIMIT_PACING", "true").lower() in ("1", "true")
+    RATELIMIT_PACING_MARGIN = float(os.environ.get("HUBGREP_CRAWLERS_RATELIMIT_PACING_MARGIN", 0.05))
+    DEAD_IDS_STORE_PATH = os.environ.get("HUBGREP_CRAWLERS_DEAD_IDS_STORE") or None
+    DEAD_IDS_MAX_AGE_DAYS = _optional_int("HUBGREP_CRAWLERS_DEAD_IDS_MAX_AGE_DAYS", 30)
+    REFRESH_FINGERPRINTS_MAX = int(os.environ.get("HUBGREP_CRAWLERS_REFRESH_FINGERPRINTS_MAX", 0))
+    GITHUB_UPLOAD_UNCHANGED = os.environ.get("HUBGREP_CRAWLERS_GITHUB_UPLOAD_UNCHANGED", "").lower() in ("1", "true")
+    GITHUB_TOPICS_BUDGET_SHARE = float(os.environ.get("HUBGREP_CRAWLERS_GITHUB_TOPICS_BUDGET_SHARE", 0))
+    GITHUB_TOPICS_MIN_STARS = _optional_int("HUBGREP_CRAWLERS_GITHUB_TOPICS_MIN_STARS")
+    GITHUB_TOPICS_MIN_FORKS = _optional_int("HUBGREP_CRAWLERS_GITHUB_TOPICS_MIN_FORKS")
+    GITHUB_TOPICS_PUSHED_WITHIN_DAYS = _optional_int("HUBGREP_CRAWLERS_GITHUB_TOPICS_PUSHED_WITHIN_DAYS")
+    GITLAB_KEYSET_HOSTS = [
+        host for host in os.environ.get("HUBGREP_CRAWLERS_GITLAB_KEYSET_HOSTS", "").split(",") if host]
 
 
 class ProductionConfig(_EnvironmentConfig):
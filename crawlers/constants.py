@@ -9,19 +9,78 @@ APP_ENV_TESTING = "testing"
 # crawler generic
 CRAWLER_IS_RUNNING_ENV_KEY = "crawler_is_running"
 CRAWLER_DEFAULT_THROTTLE = 0.1  # (seconds) unless an API has other means of throttling, we self-throttle for this
+CRAWLER_RETRY_MAX = 5  # retries for throttled requests
+CRAWLER_THROTTLE_STATUSES = [429, 500, 502, 503, 504]  # a hoster telling us to slow down
+CRAWLER_PARTITION_MIN_PAGES = 5  # don't split block ranges into sub-ranges of fewer pages
+CRAWLER_PARTITION_BUFFER = 2  # crawled pages a sub-range holds, waiting for those before it (see crawl_partitioned)
+CRAWLER_PARTITION_PUT_TIMEOUT = 1  # (seconds) how often a waiting sub-range checks if it should stop
+DEAD_IDS_MISS_INTERVAL = 60 * 60  # (seconds) an id not found again, at least this long after, is dead
+ASYNC_CONNECTION_LIMIT = 200  # open connections for all async crawlers of a process
+ASYNC_CONNECTION_LIMIT_PER_HOST = 20
+
+# callback uploads (to hubgrep-indexer)
+CALLBACK_FORMAT_JSON = "json"  # a single JSON array of repos
+CALLBACK_FORMAT_NDJSON = "ndjson"  # one JSON repo per line
+CALLBACK_CONTENT_TYPES = {
+    CALLBACK_FORMAT_JSON: "application/json",
+    CALLBACK_FORMAT_NDJSON: "application/x-ndjson",
+}
+CALLBACK_ENCODING_GZIP = "gzip"
+CALLBACK_ENCODING_ZSTD = "zstd"  # needs the zstandard package
+CALLBACK_ENCODING_AUTO = "auto"  # what the indexer accepts for a block (see BLOCK_KEY_CALLBACK_ENCODINGS)
+CALLBACK_GZIP_LEVEL = 6
+CALLBACK_UPLOAD_CHUNK = 1000  # repos encoded (and compressed) at a time, for uploads of a whole block
+
+TOKEN_POOL_LOG_EVERY = 1000  # log per token usage every n requests of a token pool
+
+# AIMD - adaptive request rate and concurrency per hoster
+AIMD_INITIAL_RATE = 1 / CRAWLER_DEFAULT_THROTTLE  # (requests/s)
+AIMD_MIN_RATE = 0.05
+AIMD_MAX_RATE = 50
+AIMD_RATE_INCREASE = 1  # (requests/s, per second of successes)
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_MAX_CONCURRENCY = 8
+AIMD_DECREASE_COOLDOWN = 1  # (seconds) throttle signals within this time count as one
+AIMD_LOG_EVERY = 1000  # log the setpoint every n successful requests
+
+# hoster contexts - what crawlers of a hoster/credential share across blocks
+HOSTER_CONTEXTS_MAX = 100  # least recently used contexts are dropped beyond this
+HOSTER_POOL_SIZE = AIMD_MAX_CONCURRENCY + 2  # connections kept per hoster - in flight requests, and token requests
 
 # GitHub v4
 GITHUB_QUERY_MAX = 100
 GITHUB_RATELIMIT_SLEEP = 60
 GITHUT_RATELIMIT_ERROR_TYPE = "RATE_LIMITED"
-GITHUB_API_ABUSE_SLEEP = 5
 GITHUB_ABUSE_RETRY_MAX = 10
+GITHUB_MAX_QUERIES_IN_FLIGHT = 4  # concurrent queries per crawler
+GITHUB_MAX_ALIASES = 5  # batches of GITHUB_QUERY_MAX ids per query
+GITHUB_BATCH_POINTS_HEADROOM = 100  # keep this many batch costs of ratelimit per batch on the way
+GITHUB_SLOW_QUERY_SECONDS = 10  # we pack less batches into a query when it takes longer than this
+GITHUB_OVERLOAD_STATUSES = [502, 504]  # too much for GitHub to answer in time
+GITHUB_REST_USERS_IN_FLIGHT = 8  # users of a /users page whose repos we fetch concurrently
+GITHUB_ALIAS_PROBE_AFTER = 50  # successful queries before we try more batches per query again, after a failure
+GITHUB_HYBRID_QUEUED_IDS = 10 * GITHUB_QUERY_MAX  # listed repository ids waiting for their GraphQL query
+GITHUB_FRONTIER_SAMPLE_STRIDE = 10  # frontier probes ask for every n-th id, GITHUB_QUERY_MAX of them
+GITHUB_FRONTIER_STEP = 1000000  # first step of the exponential frontier search, without a known frontier
+GITHUB_FRONTIER_MAX_AGE = 15 * 60  # (seconds) probe the frontier again, when ours is older
+# ids past the probed frontier we still crawl - the probe only sees sampled ids, so the highest one can be a bit above
+GITHUB_FRONTIER_SLACK = GITHUB_QUERY_MAX * GITHUB_FRONTIER_SAMPLE_STRIDE
+GITHUB_CHECK_ALIASES = 10  # batches per query when checking which known ids changed (few fields, so more of them)
+
+# Bitbucket
+BITBUCKET_PER_PAGE_MAX = 100
+BITBUCKET_TOKEN_URL = "https://bitbucket.org/site/oauth2/access_token"
+BITBUCKET_TOKEN_REFRESH_MARGIN = 300  # (seconds) refresh access tokens this long before they expire
+BITBUCKET_TIMELINE_START = "2008-01-01T00:00:00+00:00"  # before any repository was created on Bitbucket
 
 # Gitea
 GITEA_PER_PAGE_MAX = 50
 
 # GitLab
 GITLAB_PER_PAGE_MAX = 100
+GITLAB_PAGINATION_KEYSET = "keyset"  # walk projects by id, following Link headers - fast for deep pages too
+GITLAB_PAGINATION_OFFSET = "offset"  # page numbers, derived from block ids
+GITLAB_DEFAULT_PAGINATION = GITLAB_PAGINATION_OFFSET  # keyset only for hosters configured to (older ones ignore it)
 
 # keys expected in block data (requested from hubgrep-indexer)
 BLOCK_KEY_UID = "uid"
@@ -30,7 +89,12 @@ BLOCK_KEY_ATTEMPTS_AT = "attempts_at"
 BLOCK_KEY_FROM_ID = "from_id"
 BLOCK_KEY_TO_ID = "to_id"
 BLOCK_KEY_IDS = "ids"
+BLOCK_KEY_FINGERPRINTS = "fingerprints"
 BLOCK_KEY_CALLBACK_URL = "callback_url"
+BLOCK_KEY_CALLBACK_ENCODINGS = "callback_encodings"  # Content-Encodings the indexer accepts for the callback
+
+# keys we add to repositories in block results
+REPOSITORY_KEY_UNCHANGED = "unchanged"  # refreshed repository that didn't change - only with its check fields
 
 DEFAULT_REQUEST_TIMEOUT = 60
 
@@ -0,0 +1,121 @@
+"""
+Adaptive request rate and concurrency per hoster.
+
+Instead of hand-tuned sleeps, an AIMD (additive-increase/multiplicative-decrease) controller
+probes upwards while requests succeed, and backs off by a factor when the hoster signals
+that we are too fast (abuse detection 403s, 429s, 5xx).
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+from crawlers.constants import (
+    AIMD_INITIAL_RATE, AIMD_MIN_RATE, AIMD_MAX_RATE, AIMD_RATE_INCREASE, AIMD_DECREASE_FACTOR,
+    AIMD_MAX_CONCURRENCY, AIMD_DECREASE_COOLDOWN, AIMD_LOG_EVERY
+)
+
+logger = logging.getLogger(__name__)
+
+concurrency_poll_interval = 0.05  # (seconds) how often we check for a free slot, when all are taken
+
+
+class AIMDController:
+    """
+    Owns the request rate (requests/s) and concurrency (requests in flight) towards one hoster.
+
+    - each success adds AIMD_RATE_INCREASE / rate, so the rate grows by about AIMD_RATE_INCREASE per second,
+      and concurrency by about one per round of requests
+    - each throttle signal multiplies both by AIMD_DECREASE_FACTOR (at most once per AIMD_DECREASE_COOLDOWN,
+      so a burst of failing requests in flight counts as one signal)
+    """
+
+    def __init__(self, name: str = "",
+                 rate: float = AIMD_INITIAL_RATE,
+                 min_rate: float = AIMD_MIN_RATE,
+                 max_rate: float = AIMD_MAX_RATE,
+                 max_concurrency: int = AIMD_MAX_CONCURRENCY):
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency = 1.0
+        self.max_concurrency = max_concurrency
+
+        self.in_flight = 0
+        self.successes = 0
+        self.throttles = 0
+        self._next_at = 0
+        self._last_decrease_at = 0
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return f"<aimd {self.name}: {self.rate:.2f} req/s, concurrency {int(self.concurrency)}>"
+
+    def stats(self) -> dict:
+        """ Current setpoint and counters, for logs/metrics. """
+        with self._lock:
+            return dict(
+                rate=round(self.rate, 3),
+                concurrency=int(self.concurrency),
+                in_flight=self.in_flight,
+                successes=self.successes,
+                throttles=self.throttles,
+            )
+
+    def try_acquire(self) -> float:
+        """
+        Take a request slot, if one is free and it's our turn.
+
+        :return: 0 when acquired, otherwise seconds to wait before trying again
+        """
+        with self._lock:
+            now = time.time()
+            if self._next_at > now:
+                return self._next_at - now
+            if self.in_flight >= int(self.concurrency):
+                return concurrency_poll_interval
+            self.in_flight += 1
+            self._next_at = max(now, self._next_at) + 1 / self.rate
+            return 0
+
+    def acquire(self) -> None:
+        sleep_s = self.try_acquire()
+        while sleep_s > 0:
+            time.sleep(sleep_s)
+            sleep_s = self.try_acquire()
+
+    def release(self, throttled: bool = False, retry_after: Optional[float] = None) -> None:
+        """
+        Give back a request slot, with the outcome of the request.
+
+        :param throttled: the hoster told us to slow down
+        :param retry_after: seconds the hoster asked us to wait, if it did
+        """
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if throttled:
+                self._decrease(retry_after)
+            else:
+                self._increase()
+
+    def _increase(self):
+        self.successes += 1
+        self.rate = min(self.max_rate, self.rate + AIMD_RATE_INCREASE / self.rate)
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+        if self.successes % AIMD_LOG_EVERY == 0:
+            logger.info(f"{self} - probing upwards after {self.successes} successes")
+
+    def _decrease(self, retry_after: Optional[float]):
+        self.throttles += 1
+        now = time.time()
+        if retry_after:
+            self._next_at = max(self._next_at, now + retry_after)
+        if now - self._last_decrease_at < AIMD_DECREASE_COOLDOWN:
+            return
+        self._last_decrease_at = now
+        self.rate = max(self.min_rate, self.rate * AIMD_DECREASE_FACTOR)
+        self.concurrency = max(1.0, self.concurrency * AIMD_DECREASE_FACTOR)
+        # the slowed down rate applies from now on, not after already scheduled requests
+        self._next_at = max(self._next_at, now + 1 / self.rate)
+        logger.warning(f"{self} - backing off ({self.throttles} throttle signals)")
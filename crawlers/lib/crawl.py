@@ -1,27 +1,45 @@
 """
 Main crawler processing.
 """
+import asyncio
 import logging
 import time
 import uuid
-from typing import List, Generator
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import AsyncGenerator, Callable, List, Generator, Optional
+import aiohttp
+import requests
 from flask import current_app
 
-from crawlers.constants import BLOCK_KEY_CALLBACK_URL
+from crawlers.constants import (
+    BLOCK_KEY_CALLBACK_URL, CALLBACK_FORMAT_JSON, CALLBACK_FORMAT_NDJSON, CALLBACK_CONTENT_TYPES,
+    ASYNC_CONNECTION_LIMIT, ASYNC_CONNECTION_LIMIT_PER_HOST, BLOCK_KEY_CALLBACK_ENCODINGS, CALLBACK_UPLOAD_CHUNK
+)
 
+from crawlers.lib.hoster_context import get_hoster_context
 from crawlers.lib.platforms.i_crawler import ICrawler
 from crawlers.lib.platforms import platforms
+from crawlers.lib.platforms.aio import IAsyncCrawler, async_platforms
+from crawlers.lib.util.compression import choose_encoding, iter_compressed
+from crawlers.lib.util.stream_array import iter_json_array, iter_ndjson
+from crawlers.lib.util.json_codec import response_json
 
 logger = logging.getLogger(__name__)
 
 default_error_sleep = 10
 max_errors = 5
 
+stream_encoders = {
+    CALLBACK_FORMAT_JSON: iter_json_array,
+    CALLBACK_FORMAT_NDJSON: iter_ndjson,
+}
+
 
 def _hoster_session_request(method, session, url, error_count=0, *args, **kwargs):
     try:
-        session.headers.update({"X-Request-ID": uuid.uuid4().hex})
-        response = session.request(method, url, *args, **kwargs)
+        # per request, so threads sharing a session don't overwrite each others ids
+        headers = {**kwargs.get("headers", {}), "X-Request-ID": uuid.uuid4().hex}
+        response = session.request(method, url, *args, **{**kwargs, "headers": headers})
     except Exception as e:
         error_count += 1
         if error_count > max_errors:
@@ -37,27 +55,109 @@ def _hoster_session_request(method, session, url, error_count=0, *args, **kwargs
     return response
 
 
-def process_block_url(session, block_url) -> None:
+def fetch_block(session, block_url) -> Optional[dict]:
+    """
+    Lease the next block from the indexer.
+
+    :return: block data, or None when there is nothing to crawl right now
+    """
     response = _hoster_session_request("get", session, block_url)
 
-    block_data = response.json()
+    block_data = response_json(response)
 
     if block_data.get("status") == "sleep":
         retry_time = block_data["retry_at"]
         sleep_time = retry_time - time.time()
         logger.info(f"sleeping {sleep_time}...")
         time.sleep(sleep_time)
-        return
+        return None
 
     if BLOCK_KEY_CALLBACK_URL not in block_data:
         logger.error(
             f"skip crawl - no callback_url found! - key: {BLOCK_KEY_CALLBACK_URL}, block_data: {block_data}"
         )
+        return None
+    return block_data
+
+
+def callback_encoding(block_data: dict) -> Optional[str]:
+    """ Content-Encoding for the results of a block, by our config and what the indexer accepts. """
+    return choose_encoding(current_app.config["CALLBACK_ENCODING"], block_data.get(BLOCK_KEY_CALLBACK_ENCODINGS))
+
+
+def log_upload_response(response: requests.Response, block_data: dict) -> bool:
+    """ :return: if the indexer took the results of a block - logging why not, if it didn't """
+    if response.ok:
+        return True
+    logger.warning(f"uploading results to {block_data[BLOCK_KEY_CALLBACK_URL]} failed, status: {response.status_code}")
+    logger.warning(f"indexer response: {response.text[:1000]}")
+    return False
+
+
+def upload_results(session, block_data: dict, repos: list, encoding: str = None) -> None:
+    """
+    :param repos: dicts, or records (see ICrawler.project)
+    :param encoding: Content-Encoding to compress the body with (see callback_encoding), None for none
+    """
+    chunks = (repos[i:i + CALLBACK_UPLOAD_CHUNK] for i in range(0, len(repos), CALLBACK_UPLOAD_CHUNK))
+    body = iter_json_array(chunks)
+    headers = {"Content-Type": CALLBACK_CONTENT_TYPES[CALLBACK_FORMAT_JSON]}
+    if encoding:
+        body = iter_compressed(body, encoding)
+        headers["Content-Encoding"] = encoding
+    # encoded (and compressed) chunk by chunk, but joined - so it can be sent again, when the indexer isn't reachable
+    response = _hoster_session_request(
+        "PUT", session, url=block_data[BLOCK_KEY_CALLBACK_URL], data=b"".join(body), headers=headers
+    )
+    log_upload_response(response, block_data)
+
+
+def process_block_url(session, block_url) -> None:
+    block_data = fetch_block(session, block_url)
+    if block_data is None:
+        return
+    process_block(session, block_data)
+
+
+def process_block(session, block_data: dict) -> None:
+    """ Crawl a leased block, and upload its results. """
+    if current_app.config["CALLBACK_STREAMING"]:
+        stream_block(session, block_data)
     else:
         repos = run_block(block_data)
-        _hoster_session_request(
-            "PUT", session, url=block_data[BLOCK_KEY_CALLBACK_URL], json=repos
-        )
+        upload_results(session, block_data, repos, callback_encoding(block_data))
+
+
+def stream_block(session, block_data: dict) -> None:
+    """
+    Crawl a block while uploading its results to the callback_url.
+
+    The body is sent with chunked transfer encoding as chunks are crawled,
+    so a block is never held in memory as a whole.
+    A streamed body can't be replayed, so a failed upload is not retried - the indexer hands out the block again.
+    That's why it is sent with a session of its own, taking over the headers of the indexer session, but not
+    its retrying adapters (which would send a truncated body again).
+    """
+    stream_format = current_app.config["CALLBACK_STREAM_FORMAT"]
+    body = stream_encoders[stream_format](iter_block(block_data))
+    headers = {
+        "Content-Type": CALLBACK_CONTENT_TYPES[stream_format],
+        "X-Request-ID": uuid.uuid4().hex,
+    }
+    encoding = callback_encoding(block_data)
+    if encoding:
+        body = iter_compressed(body, encoding)
+        headers["Content-Encoding"] = encoding
+    with requests.Session() as upload_session:
+        upload_session.headers.update(session.headers)
+        try:
+            response = upload_session.put(block_data[BLOCK_KEY_CALLBACK_URL], data=body, headers=headers)
+        except Exception as e:
+            logger.error(e)
+            logger.warning("streaming block results to indexer failed - skipping block")
+            return
+    if not log_upload_response(response, block_data):
+        logger.warning("streaming block results to indexer failed - skipping block")
 
 
 def crawl(platform: ICrawler) -> Generator[List[dict], None, None]:
@@ -68,11 +168,11 @@ def crawl(platform: ICrawler) -> Generator[List[dict], None, None]:
     :param platform: which platform to crawl, with what credentials
     """
     logger.debug(f"START block: {platform.type} - initial state: {platform.state}")
-    for success, block_chunk, state in platform.crawl():
+    for success, block_chunk, state in platform.crawl_partitioned():
         if success:
             logger.info(f"got {len(block_chunk)} results from {platform} "
                         f"- first repo id: {next(iter(block_chunk), {}).get('id', None)}")
-            yield block_chunk
+            yield platform.project(block_chunk)
         else:
             # right now we dont want to emit failures (via yield) because that will send empty results back
             # to the indexer, which can trigger a state reset (i.e. reached end, start over).
@@ -81,24 +181,138 @@ def crawl(platform: ICrawler) -> Generator[List[dict], None, None]:
     logger.debug(f"END block: {platform.type} - final state: {platform.state}")
 
 
-def run_block(block_data: dict) -> List[dict]:
+def dead_ids_max_age(config) -> Optional[float]:
+    """ (seconds) DEAD_IDS_MAX_AGE_DAYS """
+    days = config["DEAD_IDS_MAX_AGE_DAYS"]
+    return days * 24 * 60 * 60 if days is not None else None
+
+
+def get_platform(block_data: dict, crawler_types: dict = platforms, **kwargs) -> ICrawler:
     platform_data = block_data["hosting_service"]
     platform_type = platform_data["type"]
     api_url = platform_data["api_url"]
     api_key = platform_data.get("api_key", None)
     crawler_request_headers = platform_data["crawler_request_headers"]
-    platform = platforms[platform_type](
+    platform = crawler_types[platform_type](
         base_url=api_url,
-        state=platforms[platform_type].state_from_block_data(block_data),
+        state=crawler_types[platform_type].state_from_block_data(block_data),
         api_key=api_key,
         user_agent=current_app.config["USER_AGENT"],
-        extra_headers=crawler_request_headers
+        extra_headers=crawler_request_headers,
+        partitions=current_app.config["CRAWLER_BLOCK_PARTITIONS"],
+        projection=current_app.config["CALLBACK_PROJECTION"],
+        **crawler_types[platform_type].options_from_config(current_app.config),
+        context=get_hoster_context(platform_type, api_url, api_key,
+                                   ratelimit_store=current_app.config["RATELIMIT_STORE_PATH"],
+                                   ratelimit_pacing=current_app.config["RATELIMIT_PACING"],
+                                   ratelimit_pacing_margin=current_app.config["RATELIMIT_PACING_MARGIN"],
+                                   dead_ids_store=current_app.config["DEAD_IDS_STORE_PATH"],
+                                   dead_ids_max_age=dead_ids_max_age(current_app.config),
+                                   fingerprints_max=current_app.config["REFRESH_FINGERPRINTS_MAX"]),
+        **kwargs
     )
-    repos = []
+    return platform
+
+
+def iter_block(block_data: dict) -> Generator[List[dict], None, None]:
+    """ Crawl a block, yielding its results chunk by chunk. """
+    platform = get_platform(block_data)
+    result_count = 0
     started_at = time.time()
     for block_chunk in crawl(platform):
+        result_count += len(block_chunk)
+        yield block_chunk
+    logger.info(f"{platform.type} - block yielded {result_count} results total, "
+                f"and took {time.time() - started_at}s - {platform.controller.stats()}")
+    if platform.token_pool is not None:
+        platform.token_pool.log_stats()
+
+
+def run_block(block_data: dict) -> List[dict]:
+    repos = []
+    for block_chunk in iter_block(block_data):
         repos += block_chunk
-    logger.info(
-        f"{platform_type} - block yielded {len(repos)} results total, and took {time.time() - started_at}s"
-    )
     return repos
+
+
+async def crawl_async(platform: IAsyncCrawler) -> AsyncGenerator[List[dict], None]:
+    """ Async version of crawl. """
+    logger.debug(f"START block: {platform.type} - initial state: {platform.state}")
+    async for success, block_chunk, state in platform.crawl_partitioned():
+        if success:
+            logger.info(f"got {len(block_chunk)} results from {platform} "
+                        f"- first repo id: {next(iter(block_chunk), {}).get('id', None)}")
+            yield platform.project(block_chunk)
+    logger.debug(f"END block: {platform.type} - final state: {platform.state}")
+
+
+async def run_block_async(block_data: dict, session: aiohttp.ClientSession) -> List[dict]:
+    platform = get_platform(block_data, crawler_types=async_platforms, session=session)
+    repos = []
+    started_at = time.time()
+    async for block_chunk in crawl_async(platform):
+        repos += block_chunk
+    logger.info(f"{platform.type} - block yielded {len(repos)} results total, "
+                f"and took {time.time() - started_at}s - {platform.controller.stats()}")
+    if platform.token_pool is not None:
+        await platform.run_ratelimit(platform.token_pool.log_stats)
+    return repos
+
+
+async def process_block_url_async(indexer_session, block_url, session: aiohttp.ClientSession,
+                                  executor: Executor = None) -> None:
+    """
+    Async version of process_block_url.
+
+    Talking to the indexer stays on the (sync) indexer session, in executor threads.
+    Blocks of crawler types without an async port are crawled by their sync crawler, in an executor thread too.
+    """
+    loop = asyncio.get_running_loop()
+    block_data = await loop.run_in_executor(executor, fetch_block, indexer_session, block_url)
+    if block_data is None:
+        return
+    if block_data["hosting_service"]["type"] not in async_platforms:
+        app = current_app._get_current_object()
+
+        def process():
+            with app.app_context():
+                process_block(indexer_session, block_data)
+
+        await loop.run_in_executor(executor, process)
+        return
+    repos = await run_block_async(block_data, session)
+    await loop.run_in_executor(executor, upload_results, indexer_session, block_data, repos,
+                               callback_encoding(block_data))
+
+
+def run_block_loops_async(indexer_session, block_urls: List[str], is_running: Callable[[], bool],
+                          workers: int = 1) -> None:
+    """
+    Run block loops as tasks on a single event loop, until is_running() turns false.
+
+    All loops share one aiohttp session, so requests across hosters run concurrently
+    (bound by ASYNC_CONNECTION_LIMIT).
+    """
+
+    async def run():
+        executor = ThreadPoolExecutor(max_workers=workers * 2, thread_name_prefix="indexer")
+        connector = aiohttp.TCPConnector(limit=ASYNC_CONNECTION_LIMIT,
+                                         limit_per_host=ASYNC_CONNECTION_LIMIT_PER_HOST)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            async def block_loop(worker_index: int):
+                offset = worker_index % len(block_urls)
+                urls = block_urls[offset:] + block_urls[:offset]
+                while is_running():
+                    for url in urls:
+                        try:
+                            await process_block_url_async(indexer_session, url, session, executor)
+                        except Exception:
+                            # a failing block must not take the other loops down with it (see gather below)
+                            logger.exception(f"crawling a block of {url} crashed - skipping block")
+
+            try:
+                await asyncio.gather(*[block_loop(i) for i in range(workers)])
+            finally:
+                executor.shutdown(wait=False)
+
+    asyncio.run(run())
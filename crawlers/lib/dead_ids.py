@@ -0,0 +1,257 @@
+"""
+Repository IDs known not to exist (deleted, private, never used), per hoster.
+
+Kept as run-length sets - sorted, disjoint [start, end) ranges - so long dead stretches cost a few numbers.
+Crawlers exploring IDs skip these, and fill their batches with IDs that are more likely to exist instead.
+
+A hoster can answer "not found" for a moment (or for a repository that turns public later), so:
+- an ID is only dead after it was missed again, at least DEAD_IDS_MISS_INTERVAL after the first miss
+- dead IDs (and single misses) expire after max_age, so we check them again every now and then
+
+An index is stored as a JSON file, merged with what other processes stored whenever we save.
+"""
+import bisect
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from crawlers.constants import DEAD_IDS_MISS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class _RangeSet:
+    """
+    Sorted, disjoint [start, end) ranges, each with the time it was marked at.
+
+    Not thread-safe, DeadIdIndex locks around it.
+
+    :param merge_marked: marked time of ranges merged into one (min: the oldest, max: the newest)
+    """
+
+    def __init__(self, merge_marked: Callable[[float, float], float]):
+        self.merge_marked = merge_marked
+        self.starts: List[int] = []
+        self.ends: List[int] = []  # exclusive, matching starts
+        self.marked: List[float] = []
+        self.oldest = None  # no range was marked before this
+
+    def __len__(self):
+        return sum(end - start for start, end in zip(self.starts, self.ends))
+
+    def add(self, start: int, end: int, marked: float) -> bool:
+        """ :return: if anything was new """
+        # first range that could touch [start, end), and first one after it
+        i = bisect.bisect_left(self.ends, start)
+        j = bisect.bisect_right(self.starts, end)
+        if i < j and self.starts[i] <= start and self.ends[i] >= end:
+            return False  # already covered
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+            for merged in self.marked[i:j]:
+                marked = self.merge_marked(marked, merged)
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+        self.marked[i:j] = [marked]
+        self.oldest = marked if self.oldest is None else min(self.oldest, marked)
+        return True
+
+    def expire(self, before: float) -> bool:
+        """ Drop ranges marked before the given time - :return: if any were dropped """
+        if self.oldest is None or self.oldest >= before:
+            return False
+        kept = [i for i, marked in enumerate(self.marked) if marked >= before]
+        dropped = len(kept) < len(self.marked)
+        self.starts = [self.starts[i] for i in kept]
+        self.ends = [self.ends[i] for i in kept]
+        self.marked = [self.marked[i] for i in kept]
+        self.oldest = min(self.marked, default=None)
+        return dropped
+
+    def contains(self, index: int) -> bool:
+        i = bisect.bisect_right(self.starts, index) - 1
+        return i >= 0 and index < self.ends[i]
+
+    def covered(self, start: int, end: int, marked_before: float = None) -> List[List[int]]:
+        """ The parts of [start, end) we have - only of ranges marked before marked_before, if given. """
+        parts = []
+        i = max(0, bisect.bisect_right(self.starts, start) - 1)
+        while i < len(self.starts) and self.starts[i] < end:
+            if self.ends[i] > start and (marked_before is None or self.marked[i] < marked_before):
+                parts.append([max(start, self.starts[i]), min(end, self.ends[i])])
+            i += 1
+        return parts
+
+    def live_ids(self, start: int, count: int, stop: Optional[int] = None) -> List[int]:
+        """ Up to count IDs from start on (and before stop), that are not in a range. """
+        ids = []
+        current = start
+        i = bisect.bisect_right(self.starts, current) - 1
+        if i < 0 or current >= self.ends[i]:
+            i += 1  # not inside a range, i is the next one
+        else:
+            current = self.ends[i]
+            i += 1
+        while len(ids) < count and (stop is None or current < stop):
+            if i < len(self.starts) and current == self.starts[i]:
+                current = self.ends[i]
+                i += 1
+                continue
+            run_end = self.starts[i] if i < len(self.starts) else current + count
+            if stop is not None:
+                run_end = min(run_end, stop)
+            take = min(count - len(ids), run_end - current)
+            ids.extend(range(current, current + take))
+            current += take
+        return ids
+
+    def items(self) -> List[list]:
+        """ [start, end, marked] of all ranges - marked in whole seconds """
+        return [[start, end, int(marked)] for start, end, marked in zip(self.starts, self.ends, self.marked)]
+
+    def merge(self, items: Iterable[list], default_marked: float) -> None:
+        """ Add ranges as from items() - ranges without marked time (stored by older versions) get default_marked. """
+        for start, end, *marked in items:
+            self.add(start, end, marked[0] if marked else default_marked)
+
+
+class DeadIdIndex:
+    """
+    Thread-safe index of integer IDs found not to exist, optionally persisted to a file.
+
+    :param path: JSON file to load from and save to - None keeps the index in memory only
+    :param max_age: (seconds) after which dead IDs (and single misses) are forgotten, None to keep them
+    """
+
+    def __init__(self, path: str = None, max_age: float = None):
+        self.path = path
+        self.max_age = max_age
+        # expiring oldest first, so we check them again soon - newest first for misses, not to make them dead too soon
+        self._dead = _RangeSet(merge_marked=min)
+        self._missed = _RangeSet(merge_marked=max)
+        self._lock = threading.Lock()
+        self.dirty = False
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._merge(self._read(f))
+
+    def __len__(self):
+        """ :return: how many IDs are known to be dead """
+        with self._lock:
+            self._expire()
+            return len(self._dead)
+
+    def __str__(self):
+        return f"<dead ids {self.path}: {len(self._dead.starts)} ranges, {len(self._missed.starts)} missed>"
+
+    @staticmethod
+    def _read(f) -> dict:
+        f.seek(0)
+        content = f.read()
+        if not content:
+            return {}
+        try:
+            return json.loads(content)
+        except ValueError:
+            logger.warning(f"broken dead id index {f.name}, starting over")
+            return {}
+
+    def _merge(self, data: dict) -> None:
+        """ call while locked """
+        now = time.time()
+        self._dead.merge(data.get("ranges", []), default_marked=now)
+        self._missed.merge(data.get("missed", []), default_marked=now)
+
+    def _expire(self) -> None:
+        """ call while locked """
+        if self.max_age is not None:
+            before = time.time() - self.max_age
+            expired = self._dead.expire(before)
+            self.dirty = self._missed.expire(before) or expired or self.dirty
+
+    def add_range(self, start: int, end: int, now: float = None) -> None:
+        """
+        Record that IDs in [start, end) were not found.
+
+        IDs missed before (at least DEAD_IDS_MISS_INTERVAL ago) are dead from now on, the rest is missed once.
+        """
+        if end <= start:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire()
+            changed = False
+            for dead_start, dead_end in self._missed.covered(start, end, marked_before=now - DEAD_IDS_MISS_INTERVAL):
+                changed = self._dead.add(dead_start, dead_end, now) or changed
+            changed = self._missed.add(start, end, now) or changed
+            self.dirty = changed or self.dirty
+
+    def add_all(self, ids: Iterable[int], now: float = None) -> None:
+        for dead_id in sorted(ids):
+            self.add_range(dead_id, dead_id + 1, now)
+
+    def contains(self, dead_id: int) -> bool:
+        with self._lock:
+            self._expire()
+            return self._dead.contains(dead_id)
+
+    def live_ids(self, start: int, count: int, stop: Optional[int] = None) -> List[int]:
+        """ Up to count IDs from start on (and before stop), that are not known to be dead. """
+        with self._lock:
+            self._expire()
+            return self._dead.live_ids(start, count, stop)
+
+    def ranges(self) -> List[List[int]]:
+        """ [start, end) of dead IDs """
+        with self._lock:
+            self._expire()
+            return [[start, end] for start, end, _ in self._dead.items()]
+
+    def export(self) -> dict:
+        """ The index as JSON-able data, e.g. to hand it to the indexer. """
+        ranges = self.ranges()
+        return dict(ranges=ranges, count=sum(end - start for start, end in ranges))
+
+    def save(self) -> None:
+        """ Merge with what is on disk (other processes may have saved meanwhile) and write it back. """
+        if not self.path or not self.dirty:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                with self._lock:
+                    self._merge(self._read(f))
+                    self._expire()
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(dict(ranges=self._dead.items(), missed=self._missed.items()), f)
+                    f.flush()
+                    self.dirty = False
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        logger.debug(f"saved {self}")
+
+
+def dead_ids_path(store_path: str, api_url: str) -> str:
+    file_name = hashlib.sha256(api_url.encode()).hexdigest()[:32]
+    return os.path.join(store_path, f"{file_name}.json")
+
+
+_indexes: Dict[str, DeadIdIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_dead_id_index(store_path: str, api_url: str, max_age: float = None) -> DeadIdIndex:
+    """ The index of a hoster, shared by all its crawlers in this process. """
+    path = dead_ids_path(store_path, api_url)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = DeadIdIndex(path, max_age=max_age)
+        return _indexes[path]
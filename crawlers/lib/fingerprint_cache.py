@@ -0,0 +1,39 @@
+"""
+What repositories looked like when we last fetched them.
+
+With a fingerprint per repository (e.g. its update timestamps), a refresh can check cheaply which ones changed,
+and fetch only those in full - see GitHubV4Crawler.skip_unchanged_ids.
+"""
+import collections
+import threading
+from typing import Hashable, Optional
+
+
+class FingerprintCache:
+    """
+    Thread-safe fingerprints by repository id, dropping the least recently used beyond max_size.
+
+    :param max_size: how many fingerprints to keep
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._fingerprints: "collections.OrderedDict[Hashable, str]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            fingerprint = self._fingerprints.get(key)
+            if fingerprint is not None:
+                self._fingerprints.move_to_end(key)
+            return fingerprint
+
+    def set(self, key: Hashable, fingerprint: str) -> None:
+        with self._lock:
+            self._fingerprints[key] = fingerprint
+            self._fingerprints.move_to_end(key)
+            while len(self._fingerprints) > self.max_size:
+                self._fingerprints.popitem(last=False)
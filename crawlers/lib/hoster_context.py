@@ -0,0 +1,123 @@
+"""
+Long-lived resources for crawling one hoster with one credential.
+
+Crawlers are created per block, but their http session (connection pool), rate-limit view,
+AIMD controller and other learned tuning live here, shared between blocks and worker threads of the same process.
+So the first requests of a block reuse warm connections, and are sent at the pace the last block ended with.
+"""
+import collections
+import hashlib
+import json
+import logging
+import threading
+from typing import Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from crawlers.constants import HOSTER_CONTEXTS_MAX, HOSTER_POOL_SIZE
+from crawlers.lib.aimd import AIMDController
+from crawlers.lib.dead_ids import DeadIdIndex, get_dead_id_index
+from crawlers.lib.fingerprint_cache import FingerprintCache
+from crawlers.lib.ratelimit import RateLimit, FileRateLimit
+from crawlers.lib.token_pool import TokenPool
+
+logger = logging.getLogger(__name__)
+
+
+def new_session(pool_size: int = HOSTER_POOL_SIZE) -> requests.Session:
+    session = requests.session()
+    # only for connection problems - throttling responses are retried by the crawlers, paced by their AIMDController
+    retries = Retry(total=3,
+                    backoff_factor=1)
+    adapter = HTTPAdapter(max_retries=retries, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def credential_key(api_key) -> str:
+    """ Identify a credential without keeping it around in plain text. """
+    return hashlib.sha256(json.dumps(api_key, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class HosterContext:
+    """
+    What all crawlers of one (type, api_url, credential) share.
+
+    A list of credentials becomes a TokenPool, with a rate-limit budget per token.
+
+    :param ratelimit_store: directory to share the rate-limit budget with other processes through
+    :param ratelimit_pacing: spread the rate-limit budget evenly until reset
+    :param ratelimit_pacing_margin: part of the budget to leave unused when pacing
+    :param dead_ids_store: directory to keep repository ids of the hoster in, that were found not to exist
+    :param dead_ids_max_age: (seconds) after which to check dead ids again (None: never)
+    :param fingerprints_max: how many repository fingerprints to remember (0: none)
+    """
+
+    def __init__(self, platform_type: str, api_url: str, api_key=None, ratelimit_store: str = None,
+                 ratelimit_pacing: bool = False, ratelimit_pacing_margin: float = 0, dead_ids_store: str = None,
+                 dead_ids_max_age: float = None, fingerprints_max: int = 0):
+        self.platform_type = platform_type
+        self.api_url = api_url
+        self.credential = credential_key(api_key)
+        self.session = new_session()
+        self.ratelimit_store = ratelimit_store
+        self.ratelimit_pacing = dict(pacing=ratelimit_pacing, pacing_margin=ratelimit_pacing_margin)
+        ratelimit_name = f"{platform_type}@{api_url}#{self.credential}"
+        self.ratelimit = self.new_ratelimit(ratelimit_name)
+        self.controller = AIMDController(name=ratelimit_name)
+        self.scoped_ratelimits = {}  # more budgets of the same credential, see get_ratelimit
+        self._lock = threading.Lock()
+        self.tuning = {}  # what crawlers learned about the hoster, for the next block (see ICrawler.save_tuning)
+        # per hoster, not credential - so shared with the contexts of other credentials
+        self.dead_ids: Optional[DeadIdIndex] = (
+            get_dead_id_index(dead_ids_store, api_url, max_age=dead_ids_max_age) if dead_ids_store else None)
+        self.fingerprints: Optional[FingerprintCache] = FingerprintCache(fingerprints_max) if fingerprints_max else None
+        self.token_pool = None
+        if isinstance(api_key, list):
+            # tokens share their budget with every other use of the same token
+            self.token_pool = TokenPool(
+                api_key, new_ratelimit=lambda key: self.new_ratelimit(f"{platform_type}@{api_url}#{key}"))
+
+    def new_ratelimit(self, name: str) -> RateLimit:
+        if self.ratelimit_store:
+            return FileRateLimit(name=name, store_path=self.ratelimit_store, **self.ratelimit_pacing)
+        return RateLimit(name=name, **self.ratelimit_pacing)
+
+    def get_ratelimit(self, scope: str) -> RateLimit:
+        """ A separate budget of the same credential - e.g. when a hoster has several APIs, limited separately. """
+        with self._lock:
+            if scope not in self.scoped_ratelimits:
+                name = f"{self.platform_type}@{self.api_url}#{self.credential}/{scope}"
+                self.scoped_ratelimits[scope] = self.new_ratelimit(name)
+            return self.scoped_ratelimits[scope]
+
+    def __str__(self):
+        return f"<context {self.platform_type}@{self.api_url}#{self.credential}>"
+
+
+_contexts: "collections.OrderedDict[Tuple[str, str, str], HosterContext]" = collections.OrderedDict()
+_contexts_lock = threading.Lock()
+
+
+def get_hoster_context(platform_type: str, api_url: str, api_key=None, max_contexts: int = HOSTER_CONTEXTS_MAX,
+                       **kwargs) -> HosterContext:
+    """
+    The context of (platform_type, api_url, credential) - kept until it is the least recently used
+    of more than max_contexts.
+
+    :param kwargs: HosterContext options, used when the context is created
+    """
+    key = (platform_type, api_url, credential_key(api_key))
+    with _contexts_lock:
+        if key in _contexts:
+            _contexts.move_to_end(key)
+        else:
+            _contexts[key] = HosterContext(platform_type, api_url, api_key, **kwargs)
+            logger.debug(f"new hoster context: {_contexts[key]}")
+            while len(_contexts) > max_contexts:
+                # crawlers still using it keep it alive, its connections close when they are done
+                _, evicted = _contexts.popitem(last=False)
+                logger.debug(f"dropped least recently used hoster context: {evicted}")
+        return _contexts[key]
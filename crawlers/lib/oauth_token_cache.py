@@ -0,0 +1,91 @@
+"""
+OAuth access tokens shared by all crawlers of a process.
+
+Crawlers are created per block, so without a cache each block would ask for a new token.
+Here, tokens live per client_id across blocks and threads, are refreshed (with their refresh token)
+shortly before they expire, and concurrent refreshes of the same client_id result in a single request.
+"""
+import logging
+import threading
+import time
+from typing import Dict
+import requests
+
+from crawlers.constants import DEFAULT_REQUEST_TIMEOUT
+from crawlers.lib.util.json_codec import response_json
+
+logger = logging.getLogger(__name__)
+
+
+class OAuthTokenCache:
+    """
+    Client credentials grant tokens of one token endpoint, by client_id.
+
+    :param token_url: where to get and refresh tokens
+    :param refresh_margin: (seconds) refresh tokens this long before they expire
+    """
+
+    def __init__(self, token_url: str, refresh_margin: float):
+        self.token_url = token_url
+        self.refresh_margin = refresh_margin
+        self._tokens: Dict[str, dict] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _client_lock(self, client_id: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(client_id, threading.Lock())
+
+    def _valid_token(self, client_id: str):
+        token = self._tokens.get(client_id)
+        if token and token["expires_at"] - self.refresh_margin > time.time():
+            return token["access_token"]
+        return None
+
+    def get_token(self, session: requests.Session, client_id: str, client_secret: str) -> str:
+        """ An access token for client_id - cached, or refreshed/requested with session. """
+        access_token = self._valid_token(client_id)
+        if access_token:
+            return access_token
+        with self._client_lock(client_id):
+            # while we waited for the lock, another thread might have refreshed it already
+            access_token = self._valid_token(client_id)
+            if access_token:
+                return access_token
+            token = self._tokens.get(client_id)
+            data = None
+            if token and token.get("refresh_token") and token["expires_at"] > time.time():
+                data = self._request_token(session, client_id, client_secret,
+                                           dict(grant_type="refresh_token", refresh_token=token["refresh_token"]))
+            if data is None:
+                data = self._request_token(session, client_id, client_secret, dict(grant_type="client_credentials"))
+            if data is None:
+                raise RuntimeError(f"could not get an access token for client_id {client_id} from {self.token_url}")
+            self._tokens[client_id] = dict(
+                access_token=data["access_token"],
+                refresh_token=data.get("refresh_token"),
+                expires_at=time.time() + int(data["expires_in"]),
+            )
+            logger.info(f"new access token for client_id {client_id}, expires in {data['expires_in']}s")
+            return data["access_token"]
+
+    def _request_token(self, session: requests.Session, client_id: str, client_secret: str, grant: dict):
+        """ :return: token response data, or None when it failed """
+        try:
+            response = session.post(self.token_url, data=grant, auth=(client_id, client_secret),
+                                    timeout=DEFAULT_REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return response_json(response)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"{grant['grant_type']} grant for client_id {client_id} failed: {e}")
+            return None
+
+    def invalidate(self, client_id: str, access_token: str = None) -> None:
+        """
+        Forget the token of client_id, e.g. when the hoster didn't accept it -
+        only if it still is access_token (when given), not one another thread got since.
+        """
+        with self._client_lock(client_id):
+            token = self._tokens.get(client_id)
+            if token and (access_token is None or token["access_token"] == access_token):
+                del self._tokens[client_id]
@@ -0,0 +1,121 @@
+"""
+Pipelined block processing.
+
+Instead of GET block -> crawl -> PUT results -> GET next block, the indexer round-trips run
+on background threads, so the hoster is crawled while blocks are leased and results uploaded.
+"""
+import itertools
+import logging
+import queue
+import threading
+from typing import Callable, List
+from flask import current_app
+
+from crawlers.lib.crawl import callback_encoding, fetch_block, run_block, stream_block, upload_results
+
+logger = logging.getLogger(__name__)
+
+queue_poll_timeout = 1  # (seconds) how often waiting threads check if they should stop
+
+
+class BlockPipeline:
+    """
+    Crawl blocks from one or more block urls with prefetching and background uploads.
+
+    - a fetcher thread leases up to `prefetch_depth` blocks ahead of the one being crawled
+    - the calling thread crawls
+    - an uploader thread sends up to `upload_depth` finished blocks back to the indexer
+
+    Both depths are hard bounds, so at most 1 + upload_depth crawled blocks are held in memory.
+    """
+
+    def __init__(self, session, block_urls: List[str], is_running: Callable[[], bool],
+                 prefetch_depth: int = 1, upload_depth: int = 1):
+        self.session = session
+        self.block_urls = block_urls
+        self.is_running = is_running
+        self.app = current_app._get_current_object()
+
+        self.lease_slots = threading.Semaphore(max(prefetch_depth, 1))
+        self.blocks = queue.Queue()
+        self.uploads = queue.Queue(maxsize=max(upload_depth, 1))
+        self.stopped = threading.Event()
+        self.error = None
+
+    def _thread(self, target: Callable, name: str) -> threading.Thread:
+        def run():
+            with self.app.app_context():
+                try:
+                    target()
+                except BaseException as e:  # includes SystemExit from giving up on the indexer
+                    logger.exception(f"{name} thread crashed")
+                    self.error = e
+                    self.stopped.set()
+
+        thread = threading.Thread(target=run, name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def _fetch(self):
+        for block_url in itertools.cycle(self.block_urls):
+            while not self.lease_slots.acquire(timeout=queue_poll_timeout):
+                if self.stopped.is_set():
+                    return
+            if self.stopped.is_set():
+                return
+            block_data = fetch_block(self.session, block_url)
+            if block_data is None:
+                self.lease_slots.release()
+            else:
+                self.blocks.put(block_data)
+
+    def _upload(self):
+        while True:
+            try:
+                block_data, repos = self.uploads.get(timeout=queue_poll_timeout)
+            except queue.Empty:
+                if self.stopped.is_set():
+                    return
+                continue
+            upload_results(self.session, block_data, repos, callback_encoding(block_data))
+            self.uploads.task_done()
+
+    def _next_block(self):
+        while self.is_running() and not self.stopped.is_set():
+            try:
+                block_data = self.blocks.get(timeout=queue_poll_timeout)
+            except queue.Empty:
+                continue
+            self.lease_slots.release()
+            return block_data
+        return None
+
+    def run(self) -> None:
+        """ Crawl until is_running() turns false, then flush pending uploads. """
+        fetcher = self._thread(self._fetch, "block-fetcher")
+        uploader = self._thread(self._upload, "block-uploader")
+        try:
+            while True:
+                block_data = self._next_block()
+                if block_data is None:
+                    break
+                if self.app.config["CALLBACK_STREAMING"]:
+                    # crawling happens while the body is sent, nothing to hand off
+                    stream_block(self.session, block_data)
+                else:
+                    repos = run_block(block_data)
+                    while not self.stopped.is_set():
+                        try:
+                            self.uploads.put((block_data, repos), timeout=queue_poll_timeout)
+                            break
+                        except queue.Full:
+                            continue
+        finally:
+            self.stopped.set()
+            fetcher.join()
+            uploader.join()
+            if not self.blocks.empty():
+                logger.warning(f"stopped with {self.blocks.qsize()} leased blocks left uncrawled")
+
+        if self.error is not None:
+            raise self.error
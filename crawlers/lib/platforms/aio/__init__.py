@@ -0,0 +1,13 @@
+from typing import Dict, Type
+from crawlers.lib.platforms.aio.i_async_crawler import IAsyncCrawler
+from crawlers.lib.platforms.aio.gitea import AsyncGiteaCrawler
+from crawlers.lib.platforms.aio.gitlab import AsyncGitLabCrawler
+from crawlers.lib.platforms.aio.bitbucket import AsyncBitBucketCrawler
+from crawlers.lib.platforms.aio.github_v4 import AsyncGitHubV4Crawler
+
+async_platforms: Dict[str, Type[IAsyncCrawler]] = {
+    AsyncGiteaCrawler.type: AsyncGiteaCrawler,
+    AsyncGitLabCrawler.type: AsyncGitLabCrawler,
+    AsyncGitHubV4Crawler.type: AsyncGitHubV4Crawler,
+    AsyncBitBucketCrawler.type: AsyncBitBucketCrawler,
+}
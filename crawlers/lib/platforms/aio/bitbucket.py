@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from typing import AsyncGenerator, List, Tuple
+from urllib.parse import urljoin
+import aiohttp
+
+from crawlers.lib.platforms.bitbucket import BitBucketCrawler, token_cache
+from crawlers.lib.platforms.aio.i_async_crawler import IAsyncCrawler
+from crawlers.lib.util.json_codec import response_json_async
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBitBucketCrawler(IAsyncCrawler, BitBucketCrawler):
+
+    async def request_async(self, url: str) -> aiohttp.ClientResponse:
+        # tokens are shared with the sync crawlers, mostly cached - when not, the token request runs on a thread
+        access_token = await asyncio.get_running_loop().run_in_executor(None, self.get_access_token)
+        response = await self.request("GET", url, headers={"Authorization": f"Bearer {access_token}"})
+        if response.status == 401:
+            # revoked before it expired? - retry once, with a new one
+            logger.warning(f"{self} access token not accepted, retrying with a new one")
+            response.release()
+            token_cache.invalidate(self.client_id, access_token)
+            access_token = await asyncio.get_running_loop().run_in_executor(None, self.get_access_token)
+            response = await self.request("GET", url, headers={"Authorization": f"Bearer {access_token}"})
+        return response
+
+    async def crawl(self, state: dict = None) -> AsyncGenerator[Tuple[bool, List[dict], dict], None]:
+        """ :return: success, repos, state - see BitBucketCrawler.crawl """
+        is_window = bool(state) and 'after' in state
+        url = False
+        if state:
+            url = state.get('url', False)
+            if not url and not is_window:
+                logger.warning('{self} broken state, defaulting to start')
+
+        if not url:
+            url = self.get_window_url(state if is_window else {})
+
+        while url:
+            async with await self.request_async(urljoin(self.base_url, url)) as response:
+                if response.status >= 400:
+                    logger.error(f"{self} response not ok, status: {response.status}")
+                    logger.error(response.reason)
+                    logger.error(await response.text())
+                    return
+                page = await response_json_async(response)
+
+            repos = page['values']
+            if is_window:
+                state['url'] = url
+            else:
+                state = {'url': url}
+            yield True, repos, state
+
+            url = page.get('next', False)
+            if not url and is_window:
+                state['is_done'] = True
+                yield True, [], state
+            elif not url:
+                # not hit rate limit, and we dont have a next url - finished!
+                # reset state
+                yield True, [], None
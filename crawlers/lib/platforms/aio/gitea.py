@@ -0,0 +1,36 @@
+import logging
+from typing import AsyncGenerator, List, Tuple
+
+from crawlers.lib.platforms.gitea import GiteaCrawler
+from crawlers.lib.platforms.aio.i_async_crawler import IAsyncCrawler
+from crawlers.lib.util.json_codec import response_json_async
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGiteaCrawler(IAsyncCrawler, GiteaCrawler):
+
+    async def crawl(self, state: dict = None) -> AsyncGenerator[Tuple[bool, List[dict], dict], None]:
+        state = state or self.state
+        while self.has_next_crawl(state):
+            params = dict(
+                sort='created',
+                limit=state['per_page'],
+                page=state["page"]
+            )
+            try:
+                async with await self.request("GET", self.crawl_url, params=params) as response:
+                    if response.status >= 400:
+                        logger.warning(f"(skipping block chunk) gitea - {self.base_url} " +
+                                       f"- response not ok, status: {response.status}")
+                        return  # nr.1 - we skip rest of this block, hope we get it next time
+                    result = await response_json_async(response)
+            except Exception as e:
+                logger.exception(f"(skipping block chunk) gitea crawler crashed")
+                return  # nr.2 - we skip rest of this block, hope we get it next time
+
+            state['is_done'] = len(result['data']) != state['per_page']  # finish early, we reached the end
+
+            yield True, result['data'], state
+            await self.handle_ratelimit_async()
+            state = self.set_state(state)
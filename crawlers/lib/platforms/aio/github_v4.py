@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from typing import AsyncGenerator, List, Tuple
+
+from crawlers.lib.platforms.github.github_v4 import GitHubV4Crawler, build_batch_query
+from crawlers.lib.platforms.aio.i_async_crawler import IAsyncCrawler
+from crawlers.lib.util.json_codec import response_json_async
+from crawlers.constants import (
+    BLOCK_KEY_TO_ID, BLOCK_KEY_IDS, GITHUB_ABUSE_RETRY_MAX, GITHUB_RATELIMIT_SLEEP, GITHUT_RATELIMIT_ERROR_TYPE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGitHubV4Crawler(IAsyncCrawler, GitHubV4Crawler):
+    """
+    GitHubV4Crawler on an event loop - with one batch per query, and one query at a time:
+    unlike the sync crawler, it doesn't pack batches into aliases, nor keep several queries in flight
+    (concurrency comes from the other blocks, and sub-ranges, on the same event loop).
+    """
+
+    async def get_response_ratelimit_async(self, response):
+        try:
+            return self.remember_ratelimit(self.get_ratelimit(await response_json_async(response)))
+        except ValueError:
+            return None
+
+    async def send_query(self, variables: dict) -> Tuple[int, dict]:
+        """ :return: status, json """
+        query = build_batch_query(self.fields, len(variables))
+        response = await self.request("POST", self.crawl_url, cost=max(1, self.batch_cost * len(variables)),
+                                      retries=GITHUB_ABUSE_RETRY_MAX, json=dict(query=query, variables=variables))
+        async with response:
+            return response.status, await response_json_async(response)
+
+    async def crawl(self, state: dict = None) -> AsyncGenerator[Tuple[bool, List[dict], dict], None]:
+        """
+        Run GraphQL queries against GitHubs V4 API - see GitHubV4Crawler.crawl.
+
+        :return: success, repos, state
+        """
+        state = state or self.state
+        refresh = len(state[BLOCK_KEY_IDS]) > 0
+        self.skip_dead_ids(state)
+        # like probing, the (cheap) check of known ids is done with our sync session
+        unchanged = await asyncio.get_running_loop().run_in_executor(None, self.skip_unchanged_ids, state)
+        if unchanged and self.upload_unchanged:
+            yield True, unchanged, state
+        if refresh and not state[BLOCK_KEY_IDS]:
+            return  # none of the known ids left to fetch - don't explore from from_id instead
+        if state[BLOCK_KEY_TO_ID] == -1 and not state[BLOCK_KEY_IDS]:
+            # probing is done with our sync session
+            state['frontier'] = await asyncio.get_running_loop().run_in_executor(
+                None, self.get_frontier, state['current'])
+
+        while self.has_next_crawl(state):
+            ids = self.get_ids(state)
+            variables = self.get_graphql_variables([ids])
+            try:
+                # 403s ("hidden" abuse detection) are retried by request, backing off
+                status, json = await self.send_query(variables)
+
+                if status < 400:
+                    error_types = self.get_query_error_types(json.get("errors", []), exclude="NOT_FOUND")
+                    if GITHUT_RATELIMIT_ERROR_TYPE in error_types:
+                        logger.debug(
+                            f"{error_types} - ratelimit was reached elsewhere - retry in {GITHUB_RATELIMIT_SLEEP}s")
+                        await asyncio.sleep(GITHUB_RATELIMIT_SLEEP)
+                        status, json = await self.send_query(variables)
+                    elif len(error_types) > 0:
+                        logger.warning(f"got unknown query errors - json:\n{json}")
+
+                    self.record_dead_ids([ids], json)
+                    repos = self.get_nodes(json, 1)[0]
+                    if len(repos) == 0:
+                        state['empty_page_cnt'] += 1
+                    self.remember_fingerprints(state)
+                    if self.wants_topics():
+                        await asyncio.get_running_loop().run_in_executor(None, self.enrich_topics, [repos])
+                    yield True, repos, state
+                else:
+                    logger.warning(f"(skipping block chunk) github response not ok, status: {status}")
+                    logger.warning(f"json: {json}")
+                    yield False, [], state
+
+            except Exception as e:
+                logger.exception(f"(skipping block chunk) github crawler crashed")
+                yield False, [], state
+
+            await self.handle_ratelimit_async()
+
+            state = self.set_state(state)  # update state for next round
+
+        if self.dead_ids is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.dead_ids.save)
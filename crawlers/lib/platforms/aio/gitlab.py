@@ -0,0 +1,43 @@
+import logging
+from typing import AsyncGenerator, List, Tuple
+
+from crawlers.lib.platforms.gitlab import GitLabCrawler
+from crawlers.lib.platforms.aio.i_async_crawler import IAsyncCrawler
+from crawlers.lib.util.json_codec import response_json_async
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGitLabCrawler(IAsyncCrawler, GitLabCrawler):
+
+    async def crawl(self, state: dict = None) -> AsyncGenerator[Tuple[bool, List[dict], dict], None]:
+        """ :return: success, repos, state """
+        state = state or self.state
+        while self.has_next_crawl(state):
+            url, params = self.get_request(state)
+            try:
+                async with await self.request("GET", url, params=params) as response:
+                    if response.status >= 400:
+                        logger.warning(f"(skipping block chunk) gitlab - {self.base_url} " +
+                                       f"- response not ok, status: {response.status}")
+                        logger.warning(dict(response.headers))
+                        return  # nr.1 - we skip rest of this block, hope we get it next time
+                    repos = await response_json_async(response)
+                    rate_limit = self.get_response_ratelimit(response)
+                    next_link = response.links.get('next', {}).get('url')
+                    keyset_response = self.is_keyset_response(state, response.headers)
+            except Exception as e:
+                logger.exception(f"(skipping block chunk) gitlab crawler crashed")
+                return  # nr.2 - we skip rest of this block, hope we get it next time
+
+            if not keyset_response:
+                state = self.fall_back_to_offset(state)
+                continue
+
+            state = self.update_page_state(state, repos, str(next_link) if next_link else None)
+
+            yield True, repos, state
+            if rate_limit is None:
+                logger.warning("no ratelimit found in gitlab response headers")
+            await self.handle_ratelimit_async()
+            state = self.set_state(state)
@@ -0,0 +1,163 @@
+"""
+Async counterpart of the ICrawler interface.
+
+Async crawlers subclass their synchronous crawler, so state handling (set_state, has_next_crawl, ...)
+and request headers stay the same, but they send requests through a shared aiohttp session
+and crawl() is an async generator - a single event loop can run many of them at once.
+"""
+import abc
+import asyncio
+import logging
+from typing import AsyncGenerator, Callable, List, Tuple
+import aiohttp
+
+from crawlers.constants import CRAWLER_PARTITION_BUFFER, CRAWLER_RETRY_MAX, DEFAULT_REQUEST_TIMEOUT
+from crawlers.lib.platforms.i_crawler import ICrawler, get_retry_after
+
+logger = logging.getLogger(__name__)
+
+request_timeout = aiohttp.ClientTimeout(total=DEFAULT_REQUEST_TIMEOUT)
+
+
+class IAsyncCrawler(abc.ABC):
+    """ Mixin to put in front of a ICrawler subclass. """
+
+    def __init__(self, *args, session: aiohttp.ClientSession, **kwargs):
+        super().__init__(*args, **kwargs)
+        assert isinstance(self, ICrawler), f"{self.__class__.__name__} needs to be mixed into a ICrawler"
+        # the sync init prepared auth etc. on a requests session, we only take over its headers
+        self.headers = {
+            key: value for key, value in self.requests.headers.items()
+            if key.lower() not in ("connection", "accept-encoding")
+        }
+        self.session = session
+
+    async def request(self, method: str, url: str, cost: float = 1, retries: int = CRAWLER_RETRY_MAX,
+                      **kwargs) -> aiohttp.ClientResponse:
+        """
+        Async ICrawler.send - throttled requests make our controller back off, and are retried.
+
+        :param cost: ratelimit budget to reserve for this request
+        """
+        headers = {**self.headers, **kwargs.pop("headers", {})}
+        attempt = 0
+        while True:
+            token = reservation = None
+            if cost and self.token_pool is not None:
+                token, reservation = await self.acquire_token_async(cost)
+                headers.update(self.auth_headers(token))
+            elif cost:
+                reservation = await self.reserve_ratelimit_async(cost)
+            await self.acquire_controller_async()
+            try:
+                response = await self.session.request(method, url, headers=headers, timeout=request_timeout,
+                                                      **kwargs)
+            except Exception:
+                self.controller.release(throttled=True)
+                await self.run_ratelimit(self.settle_ratelimit, token, reservation, None)
+                raise
+            if reservation is not None:
+                rate_limit = await self.get_response_ratelimit_async(response)
+                await self.run_ratelimit(self.settle_ratelimit, token, reservation, rate_limit)
+            throttled = response.status in self.throttle_statuses
+            self.controller.release(throttled=throttled, retry_after=get_retry_after(response.headers))
+            if not throttled:
+                return response
+            if attempt >= retries:
+                logger.warning(f"{self} status {response.status} - giving up after {retries} retries")
+                return response
+            response.release()
+            attempt += 1
+            logger.warning(f"{self} status {response.status} - retry {attempt}/{retries}, {self.controller}")
+
+    async def run_ratelimit(self, function: Callable, *args):
+        """
+        Call a method of our ratelimit or token_pool - on a thread, when it might block the event loop
+        (e.g. FileRateLimit waiting for other processes, see RateLimit.blocking).
+        """
+        budget = self.token_pool if self.token_pool is not None else self.ratelimit
+        if budget.blocking:
+            return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+        return function(*args)
+
+    async def acquire_controller_async(self):
+        """ Async AIMDController.acquire. """
+        sleep_s = self.controller.try_acquire()
+        while sleep_s > 0:
+            await asyncio.sleep(sleep_s)
+            sleep_s = self.controller.try_acquire()
+
+    async def acquire_token_async(self, cost: float = 1):
+        """ Async TokenPool.acquire - :return: token, reservation """
+        while True:
+            token, reservation, sleep_s = await self.run_ratelimit(self.token_pool.try_acquire, cost)
+            if sleep_s > 0:
+                if token is None:
+                    logger.warning(f"{self} rate limiting: all tokens used up, sleeping {sleep_s}s")
+                await asyncio.sleep(sleep_s)
+            if token is not None:
+                return token, reservation
+
+    async def get_response_ratelimit_async(self, response: aiohttp.ClientResponse):
+        """ Async get_response_ratelimit - crawlers reading it from the headers only can leave this as it is. """
+        return self.get_response_ratelimit(response)
+
+    async def reserve_ratelimit_async(self, cost: float = 1) -> str:
+        """ Async reserve_ratelimit. """
+        while True:
+            reservation, sleep_s = await self.run_ratelimit(self.ratelimit.reserve, cost)
+            if sleep_s > 0:
+                if reservation is None:
+                    logger.warning(f"{self} rate limiting: budget used up, sleeping {sleep_s}s")
+                await asyncio.sleep(sleep_s)
+            if reservation is not None:
+                return reservation
+
+    async def handle_ratelimit_async(self):
+        """
+        Async handle_ratelimit - our budget was updated with each response already (see request).
+        """
+        if self.token_pool is not None:
+            return  # budgets are kept per token, as responses come in
+        sleep_s = await self.run_ratelimit(self.ratelimit.wait_seconds)
+        if sleep_s > 0:
+            logger.warning(f"{self} rate limiting: 0 requests remaining, sleeping {sleep_s}s")
+            await asyncio.sleep(sleep_s)
+
+    @abc.abstractmethod
+    def crawl(self, state: dict = None) -> AsyncGenerator[Tuple[bool, List[dict], dict], None]:
+        """ An async generator - :return: success, repos, state """
+
+    async def crawl_partitioned(self, state: dict = None) -> AsyncGenerator[Tuple[bool, List[dict], dict], None]:
+        """ Async ICrawler.crawl_partitioned - sub-ranges run as tasks. """
+        states = self.partition_state(state or self.state, self.partitions)
+        if len(states) == 1:
+            async for result in self.crawl(states[0]):
+                yield result
+            return
+
+        logger.debug(f"{self} crawling block in {len(states)} sub-ranges")
+        results = [asyncio.Queue(maxsize=CRAWLER_PARTITION_BUFFER) for _ in states]
+
+        async def crawl_range(sub_state: dict, results: asyncio.Queue):
+            # waits in put() until the ranges before ours are yielded - cancelled when nobody waits for us anymore
+            try:
+                async for result in self.crawl(sub_state):
+                    await results.put(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"{self} crawling sub-range crashed - state: {sub_state}")
+                await results.put((False, [], sub_state))
+            await results.put(None)
+
+        tasks = [asyncio.ensure_future(crawl_range(s, r)) for s, r in zip(states, results)]
+        try:
+            for sub_results in results:
+                result = await sub_results.get()
+                while result is not None:
+                    yield result
+                    result = await sub_results.get()
+        finally:
+            for task in tasks:
+                task.cancel()
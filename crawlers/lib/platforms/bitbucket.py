@@ -1,18 +1,36 @@
+import datetime
 import logging
-import time
+import math
 import requests
 from typing import List, Tuple
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlencode
+from iso8601 import iso8601
 
+from crawlers.lib.oauth_token_cache import OAuthTokenCache
 from crawlers.lib.platforms.i_crawler import ICrawler
+from crawlers.lib.util.json_codec import response_json
 
-from crawlers.constants import DEFAULT_REQUEST_TIMEOUT
+from crawlers.constants import (
+    BITBUCKET_PER_PAGE_MAX, BITBUCKET_TIMELINE_START, BITBUCKET_TOKEN_URL, BITBUCKET_TOKEN_REFRESH_MARGIN
+)
 
 logger = logging.getLogger(__name__)
 
+# access tokens, shared by all crawlers (and blocks) of this process
+token_cache = OAuthTokenCache(BITBUCKET_TOKEN_URL, refresh_margin=BITBUCKET_TOKEN_REFRESH_MARGIN)
+
 
 class BitBucketCrawler(ICrawler):
     type: str = 'bitbucket'
+    # when projecting, partial responses leave out the ~15 links of each repository, and most of owner,
+    # project and workspace
+    # https://developer.atlassian.com/cloud/bitbucket/rest/intro/#partial-response
+    response_fields = (
+        "uuid", "name", "full_name", "slug", "description", "website", "language", "scm", "size",
+        "is_private", "has_issues", "has_wiki", "fork_policy", "created_on", "updated_on",
+        "mainbranch.name", "parent.full_name", "links.html.href",
+        "owner.uuid", "owner.type", "owner.nickname", "owner.display_name",
+    )
 
     # https://developer.atlassian.com/bitbucket/api/2/reference/resource/repositories
 
@@ -24,38 +42,84 @@ class BitBucketCrawler(ICrawler):
             api_key=api_key,
             **kwargs
         )
-        self.access_token = None
-        self.token_expites_at = 0
-        self.refresh_token = None
         self.client_id = api_key.get('client_id')
         self.client_secret = api_key.get('client_secret')
 
+    def get_access_token(self) -> str:
+        return token_cache.get_token(self.requests, self.client_id, self.client_secret)
+
     def request(self, url):
-        if not self.access_token or self.token_expites_at < time.time():
-            response = self.requests.post(
-                urljoin('https://bitbucket.org', 'site/oauth2/access_token'),
-                data=dict(grant_type='client_credentials'),
-                auth=(self.client_id, self.client_secret),
-                timeout=DEFAULT_REQUEST_TIMEOUT
-            )
-            data = response.json()
-            self.access_token = data['access_token']
-            self.token_expites_at = time.time() + int(data['expires_in'])
-            self.refresh_token = data['refresh_token']
-            self.requests.headers["Authorization"] = f"Bearer {self.access_token}"
-
-        return self.requests.get(url, timeout=DEFAULT_REQUEST_TIMEOUT)
+        access_token = self.get_access_token()
+        response = self.send("GET", url, headers={"Authorization": f"Bearer {access_token}"})
+        if response.status_code == 401:
+            # revoked before it expired? - retry once, with a new one
+            logger.warning(f"{self} access token not accepted, retrying with a new one")
+            token_cache.invalidate(self.client_id, access_token)
+            response = self.send("GET", url, headers={"Authorization": f"Bearer {self.get_access_token()}"})
+        return response
+
+    @staticmethod
+    def split_timeline(parts: int, now: datetime.datetime = None) -> List[dict]:
+        """
+        Split the created_on timeline into windows, newest first - like the repositories are sorted.
+
+        Far more repositories were created recently, so instead of equal lengths, window boundaries
+        are spaced for equal counts at a linearly growing creation rate (cumulative count ~ time^2).
+        The outer windows are open ended, so nothing created before or during the crawl is left out.
+
+        :return: window states - "after" (inclusive) and "before" (exclusive) iso timestamps, or None
+        """
+        start = iso8601.parse_date(BITBUCKET_TIMELINE_START)
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        bounds = [start + (now - start) * math.sqrt(k / parts) for k in range(1, parts)]
+        edges = [None] + [bound.isoformat() for bound in bounds] + [None]
+        windows = [dict(after=after, before=before, url=None, is_done=False)
+                   for after, before in zip(edges[:-1], edges[1:])]
+        return list(reversed(windows))
+
+    def get_window_url(self, window: dict) -> str:
+        """ First page of a window - next links keep its params (so the fields) as well. """
+        params = dict(pagelen=BITBUCKET_PER_PAGE_MAX, sort='-created_on')
+        if self.projection:
+            params['fields'] = ",".join(["next"] + [f"values.{field}" for field in self.response_fields])
+        if window.get('after'):
+            params['after'] = window['after']
+        if window.get('before'):
+            params['q'] = f"created_on < {window['before']}"
+        return f'/2.0/repositories/?{urlencode(params)}'
+
+    def partition_state(self, state: dict, parts: int) -> List[dict]:
+        """
+        Split the timeline into windows (see split_timeline), which have their own cursors, kept in state["windows"].
+
+        Windows only live as long as the block state in this process - they are not uploaded or stored,
+        so a crawl that is interrupted starts over with fresh windows.
+        """
+        if state is None:
+            state = {}
+        pending = [window for window in state.get('windows', []) if not window['is_done']]
+        if pending:
+            return pending
+        if parts < 2 or state.get('url'):
+            return [state]  # a single cursor chain, maybe already started
+        state['windows'] = self.split_timeline(parts)
+        return state['windows']
 
     def crawl(self, state: dict = None) -> Tuple[bool, List[dict], dict]:
-        """ :return: success, repos, state """
+        """
+        Follow the next links, either through all repositories, or through one created_on window.
+
+        :return: success, repos, state
+        """
+        is_window = bool(state) and 'after' in state
         url = False
         if state:
             url = state.get('url', False)
-            if not url:
+            if not url and not is_window:
                 logger.warning('{self} broken state, defaulting to start')
 
         if not url:
-            url = '/2.0/repositories/?pagelen=100&sort=-created_on'
+            url = self.get_window_url(state if is_window else {})
 
         while url:
             try:
@@ -67,18 +131,23 @@ class BitBucketCrawler(ICrawler):
                 logger.error(e.response.text)
                 return False, [], {}
 
-            response_json = response.json()
-            repos = response_json['values']
-            state = {'url': url}
+            page = response_json(response)
+            repos = page['values']
+            if is_window:
+                state['url'] = url  # the window is kept in the block state, with its cursor
+            else:
+                state = {'url': url}
             yield True, repos, state
 
             # https://stackoverflow.com/questions/32312758/python-requests-link-headers
-            url = response_json.get('next', False)
-            if not url:
+            url = page.get('next', False)
+            if not url and is_window:
+                state['is_done'] = True
+                yield True, [], state
+            elif not url:
                 # not hit rate limit, and we dont have a next url - finished!
                 # reset state
                 yield True, [], None
-            time.sleep(.1)
 
         """ expected Bitbucket result
         {
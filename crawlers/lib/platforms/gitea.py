@@ -1,14 +1,22 @@
 import logging
 from typing import List, Tuple
 
-from crawlers.constants import GITEA_PER_PAGE_MAX, DEFAULT_REQUEST_TIMEOUT
+from crawlers.constants import GITEA_PER_PAGE_MAX
 from crawlers.lib.platforms.i_crawler import ICrawler
+from crawlers.lib.util.json_codec import response_json
 
 logger = logging.getLogger(__name__)
 
 
 class GiteaCrawler(ICrawler):
     type: str = 'gitea'
+    # Gitea always sends all of them, and more (permissions, owner details)
+    response_fields = (
+        "id", "name", "full_name", "description", "empty", "private", "fork", "mirror", "archived", "template",
+        "size", "html_url", "ssh_url", "clone_url", "website", "language", "stars_count", "forks_count",
+        "watchers_count", "open_issues_count", "default_branch", "created_at", "updated_at",
+        "parent.id", "parent.full_name", "owner.id", "owner.login", "owner.username", "owner.full_name",
+    )
 
     def __init__(self, base_url, state=None, api_key=None, **kwargs):
         super().__init__(
@@ -34,12 +42,12 @@ class GiteaCrawler(ICrawler):
                 page=state["page"]
             )
             try:
-                response = self.requests.get(self.crawl_url, params=params, timeout=DEFAULT_REQUEST_TIMEOUT)
+                response = self.send("GET", self.crawl_url, params=params)
                 if not response.ok:
                     logger.warning(f"(skipping block chunk) gitea - {self.base_url} " +
                                    f"- response not ok, status: {response.status_code}")
                     return False, [], state  # nr.1 - we skip rest of this block, hope we get it next time
-                result = response.json()
+                result = response_json(response)
             except Exception as e:
                 logger.exception(f"(skipping block chunk) gitea crawler crashed")
                 return False, [], state  # nr.2 - we skip rest of this block, hope we get it next time
@@ -1,2 +1,3 @@
 from .github_v4 import GitHubV4Crawler
 from .github_rest import GitHubRESTCrawler
+from .github_hybrid import GitHubHybridCrawler
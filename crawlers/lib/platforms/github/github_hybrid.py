@@ -0,0 +1,183 @@
+"""
+This crawler combines GitHubs REST and GraphQL APIs.
+
+The REST listing (/repositories?since=) tells us which repository IDs actually exist,
+and we only ask GraphQL for those - in full batches, instead of guessing consecutive IDs
+and spending points on deleted ranges.
+"""
+import collections
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generator, List, Optional, Tuple
+from urllib.parse import urljoin
+
+from crawlers.constants import BLOCK_KEY_FROM_ID, BLOCK_KEY_TO_ID, GITHUB_QUERY_MAX, GITHUB_HYBRID_QUEUED_IDS
+from crawlers.lib.platforms.github.github_rest import GitHubRESTCrawler
+from crawlers.lib.platforms.github.github_v4 import GitHubV4Crawler
+from crawlers.lib.ratelimit import RateLimit
+from crawlers.lib.util.json_codec import response_json
+
+logger = logging.getLogger(__name__)
+
+queue_poll_timeout = 1  # (seconds) how often the listing thread checks if it should stop
+
+
+class GitHubHybridCrawler(GitHubV4Crawler):
+    """
+    Enumerate repositories via REST, enrich them via GraphQL - both running concurrently.
+
+    A listing thread pages through /repositories?since= and queues (id, node_id) pairs,
+    while full batches of GITHUB_QUERY_MAX node IDs are queried like in GitHubV4Crawler.
+    """
+
+    type: str = 'github_hybrid'
+
+    def __init__(self, base_url, state=None, api_key=None, **kwargs):
+        super().__init__(base_url=base_url, state=state, api_key=api_key, **kwargs)
+        # REST requests count against a separate budget
+        if self.context is not None:
+            self.rest_ratelimit = self.context.get_ratelimit("rest")
+        else:
+            self.rest_ratelimit = RateLimit(name=f"{self.type}@{self.base_url}/rest")
+        self.listing_failed = False
+
+    @classmethod
+    def set_state(cls, state: dict = None) -> dict:
+        """ :return: state - with "current", the highest REST listing ID we have yielded results up to """
+        if not state:
+            state = {}
+        state[BLOCK_KEY_FROM_ID] = state.get(BLOCK_KEY_FROM_ID, 0)
+        state[BLOCK_KEY_TO_ID] = state.get(BLOCK_KEY_TO_ID, -1)
+        state['current'] = state.get('current', state[BLOCK_KEY_FROM_ID] - 1)
+        return state
+
+    def get_response_ratelimit(self, response) -> Optional[Tuple[int, float]]:
+        if response.request.method == "GET":
+            return None  # a REST response, not our GraphQL budget
+        return super().get_response_ratelimit(response)
+
+    def handle_rest_ratelimit(self, response, reservation: str):
+        rate_limit = GitHubRESTCrawler.get_response_ratelimit(response)
+        if rate_limit:
+            self.rest_ratelimit.update(*rate_limit, reservation=reservation)
+        else:
+            self.rest_ratelimit.release(reservation)
+        self.rest_ratelimit.wait()
+
+    def list_repository_ids(self, state: dict, ids: queue.Queue, stopped: threading.Event):
+        """
+        Queue (id, node_id) of repositories in (current, to_id) - then None, when done.
+
+        Ids between listed repositories are not marked dead - most are private repositories, which can become public.
+        """
+        to_id = state[BLOCK_KEY_TO_ID]
+        url = urljoin(self.base_url, f"/repositories?since={state['current']}")
+        # only paced by rest_ratelimit - with a token pool, listing always uses its first token, so that's its budget
+        headers = self.auth_headers(self.token_pool.tokens[0]) if self.token_pool is not None else {}
+        try:
+            while url and not stopped.is_set():
+                reservation = self.rest_ratelimit.acquire()
+                try:
+                    response = self.send("GET", url, cost=0, headers=headers)
+                except Exception:
+                    self.rest_ratelimit.release(reservation)
+                    raise
+                self.handle_rest_ratelimit(response, reservation)
+                if not response.ok:
+                    logger.warning(f"(skipping rest of block) github listing not ok, status: {response.status_code}")
+                    self.listing_failed = True
+                    return
+                repos = response_json(response)
+                url = response.links.get('next', {}).get('url') if repos else None
+                for repo in repos:
+                    if to_id != -1 and repo['id'] >= to_id:
+                        url = None
+                        break
+                    self.put_until_stopped(ids, (repo['id'], repo['node_id']), stopped)
+        except Exception:
+            logger.exception(f"(skipping rest of block) github listing crashed")
+            self.listing_failed = True
+        finally:
+            self.put_until_stopped(ids, None, stopped)
+
+    @staticmethod
+    def put_until_stopped(ids: queue.Queue, item, stopped: threading.Event):
+        """ Wait for room in the queue - unless nobody is taking items anymore. """
+        while not stopped.is_set():
+            try:
+                ids.put(item, timeout=queue_poll_timeout)
+                return
+            except queue.Full:
+                continue
+
+    @staticmethod
+    def iter_id_batches(ids: queue.Queue) -> Generator[List[Tuple[int, str]], None, None]:
+        """ Full batches of queued (id, node_id) - only the last one may be smaller. """
+        batch = []
+        for item in iter(ids.get, None):
+            batch.append(item)
+            if len(batch) == GITHUB_QUERY_MAX:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def crawl(self, state: dict = None) -> Tuple[bool, List[dict], dict]:
+        """
+        Query listed repositories, up to queries_in_flight() queries of `self.aliases` batches at once.
+
+        Results are yielded per batch, in listing order.
+
+        :return: success, repos, state
+        """
+        state = state or self.state
+        ids = queue.Queue(maxsize=GITHUB_HYBRID_QUEUED_IDS)
+        stopped = threading.Event()
+        self.listing_failed = False
+        lister = threading.Thread(target=self.list_repository_ids, args=(state, ids, stopped),
+                                  name="github-listing", daemon=True)
+        lister.start()
+        batches = self.iter_id_batches(ids)
+        pending = collections.deque()  # (batches, future) in listing order
+        listed_all = False
+
+        executor = ThreadPoolExecutor(max_workers=self.max_queries_in_flight, thread_name_prefix="github-query")
+        try:
+            while True:
+                aliases = max(1, min(self.aliases, self.affordable_batches()))
+                while not listed_all and len(pending) < self.queries_in_flight(aliases):
+                    query_batches = []
+                    for batch in batches:
+                        query_batches.append(batch)
+                        if len(query_batches) == aliases:
+                            break
+                    else:
+                        listed_all = True
+                    if query_batches:
+                        ids_batches = [[node_id for _, node_id in batch] for batch in query_batches]
+                        pending.append((query_batches, executor.submit(self.query_batches, ids_batches)))
+                if not pending:
+                    break
+
+                query_batches, future = pending.popleft()
+                results, response = future.result()
+                for batch, (success, repos) in zip(query_batches, results):
+                    state['current'] = batch[-1][0]
+                    yield success, repos, state
+                if response is not None and response.ok:
+                    self.handle_ratelimit(response)
+                else:
+                    self.handle_ratelimit()
+
+            if self.listing_failed:
+                yield False, [], state
+        finally:
+            stopped.set()
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+            self.save_tuning()
+            if self.dead_ids is not None:
+                self.dead_ids.save()
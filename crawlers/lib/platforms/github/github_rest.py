@@ -2,13 +2,16 @@
 Crawl through GitHub via their REST API.
 Gets repositories connected to users.
 """
+import base64
 import logging
 import time
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 from urllib.parse import urljoin
 
+from crawlers.constants import GITHUB_REST_USERS_IN_FLIGHT
 from crawlers.lib.platforms.i_crawler import ICrawler
-from crawlers.constants import DEFAULT_REQUEST_TIMEOUT
+from crawlers.lib.util.json_codec import response_json
 
 logger = logging.getLogger(__name__)
 
@@ -43,8 +46,17 @@ class GitHubRESTCrawler(ICrawler):
     """
 
     type: str = 'github_rest'
+    # without the ~40 *_url templates of repositories and owners
+    response_fields = (
+        "id", "node_id", "name", "full_name", "private", "html_url", "description", "fork", "clone_url", "ssh_url",
+        "homepage", "language", "forks_count", "stargazers_count", "watchers_count", "size", "default_branch",
+        "open_issues_count", "is_template", "topics", "has_issues", "has_projects", "has_wiki", "has_pages",
+        "has_downloads", "archived", "disabled", "visibility", "pushed_at", "created_at", "updated_at",
+        "owner.login", "owner.id", "owner.node_id", "owner.html_url", "owner.type",
+        "license.key", "license.name", "license.spdx_id",
+    )
 
-    def __init__(self, base_url, state=None, api_key=None, **kwargs):
+    def __init__(self, base_url, state=None, api_key=None, users_in_flight=GITHUB_REST_USERS_IN_FLIGHT, **kwargs):
         super().__init__(
             base_url=base_url,
             path='',
@@ -52,16 +64,31 @@ class GitHubRESTCrawler(ICrawler):
             api_key=api_key,
             **kwargs
         )
-        if api_key:
+        self.users_in_flight = users_in_flight
+        if isinstance(api_key, list):
+            pass  # a token pool - we authenticate each request with the credentials it picked
+        elif api_key:
             self.requests.auth = (
                 api_key['client_id'],
                 api_key['client_secret'])
 
+    def auth_headers(self, token) -> dict:
+        credentials = f"{token['client_id']}:{token['client_secret']}".encode()
+        return {"Authorization": f"Basic {base64.b64encode(credentials).decode()}"}
+
+    @staticmethod
+    def get_response_ratelimit(response) -> Optional[Tuple[int, float]]:
+        remaining = response.headers.get('X-Ratelimit-Remaining')
+        reset_at = response.headers.get('X-Ratelimit-Reset')
+        if remaining is None or reset_at is None:
+            return None
+        return int(remaining), int(reset_at)
+
     def request(self, url, params=None):
         response = False
         while not response:
             try:
-                response = self.requests.get(url, params=params, timeout=DEFAULT_REQUEST_TIMEOUT)
+                response = self.send("GET", url, params=params)
                 response.raise_for_status()
             except Exception as e:
                 logger.error(e)
@@ -74,6 +101,8 @@ class GitHubRESTCrawler(ICrawler):
         return response
 
     def handle_ratelimit(self, response):
+        if self.token_pool is not None:
+            return  # budgets are kept per token, as responses come in (see ICrawler.send)
         h = response.headers
         ratelimit_remaining = int(h.get('X-Ratelimit-Remaining'))
         ratelimit_reset_timestamp = int(h.get('X-Ratelimit-Reset'))
@@ -81,15 +110,12 @@ class GitHubRESTCrawler(ICrawler):
 
         logger.info(
             f'{self} {ratelimit_remaining} requests remaining, reset in {reset_in}s')
-        if ratelimit_remaining < 1:
-            logger.warning(
-                f'{self} rate limiting: {ratelimit_remaining} requests remaining, sleeping {reset_in}s')
-            time.sleep(reset_in)
+        self.ratelimit.wait()  # updated with the response already, see ICrawler.send
 
     def get_user_repos(self, user_repos_url):
         while user_repos_url:
             response = self.request(user_repos_url, params=dict(per_page=100))
-            results = response.json()
+            results = response_json(response)
 
             yield results
 
@@ -97,8 +123,18 @@ class GitHubRESTCrawler(ICrawler):
             header_next = response.links.get('next', {})
             user_repos_url = header_next.get('url', False)
 
+    def get_all_user_repos(self, user_repos_url) -> List[dict]:
+        return [repo for repo_page in self.get_user_repos(user_repos_url) for repo in repo_page]
+
     def crawl(self, state=None) -> Tuple[bool, List[dict], dict]:
-        """ :return: success, repos, state """
+        """
+        Go through pages of users, fetching repos of up to `users_in_flight` users of a page concurrently.
+
+        Repos are yielded per user, in the order of the page, and we only move the state
+        on to the next page when all users of a page are done.
+
+        :return: success, repos, state
+        """
         user_url = False
         if state:
             user_url = state.get('user_url', False)
@@ -108,27 +144,34 @@ class GitHubRESTCrawler(ICrawler):
         if not user_url:
             user_url = '/users'
 
-        while user_url:
-            user_response = self.request(urljoin(self.base_url, user_url))
-            self.handle_ratelimit(user_response)
-
-            users_page = user_response.json()
-            for user in users_page:
-                user_repos = []
-                for repo_page in self.get_user_repos(user['repos_url']):
-                    logger.debug(f'{self} {len(repo_page)} repos in page')
-                    user_repos += repo_page
-                state = {'user_url': user_url}
-                yield True, user_repos, state
-
-            # https://stackoverflow.com/questions/32312758/python-requests-link-headers
-            user_header_next = user_response.links.get('next', {})
-            user_url = user_header_next.get('url', False)
-            if not user_url:
-                # not hit rate limit, and we dont have a next url - finished!
-                # reset state
-                yield True, [], None
-            time.sleep(.01)
+        executor = ThreadPoolExecutor(max_workers=self.users_in_flight, thread_name_prefix="github-users")
+        user_repos_futures = []
+        try:
+            while user_url:
+                user_response = self.request(urljoin(self.base_url, user_url))
+                self.handle_ratelimit(user_response)
+
+                users_page = response_json(user_response)
+                # results in page order, while up to users_in_flight users are fetched at a time
+                user_repos_futures = [executor.submit(self.get_all_user_repos, user['repos_url'])
+                                      for user in users_page]
+                for user_repos_future in user_repos_futures:
+                    user_repos = user_repos_future.result()
+                    logger.debug(f'{self} {len(user_repos)} repos of user')
+                    state = {'user_url': user_url}
+                    yield True, user_repos, state
+
+                # https://stackoverflow.com/questions/32312758/python-requests-link-headers
+                user_header_next = user_response.links.get('next', {})
+                user_url = user_header_next.get('url', False)
+                if not user_url:
+                    # not hit rate limit, and we dont have a next url - finished!
+                    # reset state
+                    yield True, [], None
+        finally:
+            for user_repos_future in user_repos_futures:
+                user_repos_future.cancel()
+            executor.shutdown(wait=False)
 
         """ expected GitHub result
         {
@@ -7,36 +7,103 @@ import pathlib
 import logging
 import time
 import base64
-from typing import List, Tuple
+import collections
+import functools
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple, Optional
+import requests
 from iso8601 import iso8601
 from requests import Response
 
 from crawlers.lib.platforms.i_crawler import ICrawler
+from crawlers.lib.util.json_codec import response_json
 from crawlers.constants import (
     GITHUB_QUERY_MAX, BLOCK_KEY_FROM_ID, BLOCK_KEY_TO_ID, BLOCK_KEY_IDS,
-    GITHUB_API_ABUSE_SLEEP, GITHUB_ABUSE_RETRY_MAX, GITHUB_RATELIMIT_SLEEP, GITHUT_RATELIMIT_ERROR_TYPE,
-    DEFAULT_REQUEST_TIMEOUT
+    GITHUB_ABUSE_RETRY_MAX, GITHUB_RATELIMIT_SLEEP, GITHUT_RATELIMIT_ERROR_TYPE,
+    GITHUB_MAX_QUERIES_IN_FLIGHT, GITHUB_BATCH_POINTS_HEADROOM, GITHUB_MAX_ALIASES, GITHUB_SLOW_QUERY_SECONDS,
+    GITHUB_OVERLOAD_STATUSES, GITHUB_ALIAS_PROBE_AFTER, GITHUB_FRONTIER_SAMPLE_STRIDE, GITHUB_FRONTIER_STEP,
+    GITHUB_FRONTIER_MAX_AGE, GITHUB_FRONTIER_SLACK, GITHUB_CHECK_ALIASES, BLOCK_KEY_FINGERPRINTS,
+    REPOSITORY_KEY_UNCHANGED
 )
 
 logger = logging.getLogger(__name__)
 
 
-def get_query():
+def get_fragment(filename: str) -> str:
     current_folder_path = pathlib.Path(__file__).parent.absolute()
-    with open(current_folder_path.joinpath("query_repos_batch.graphql")) as f:
-        query = f.read()
-    return query
-
-
-query_repos_batch = get_query()
+    with open(current_folder_path.joinpath(filename)) as f:
+        fragment = f.read()
+    return fragment
+
+
+repository_fields = get_fragment("repository_fields.graphql")
+repository_fields_with_topics = get_fragment("repository_fields_with_topics.graphql")
+repository_probe_fields = get_fragment("repository_probe_fields.graphql")
+repository_check_fields = get_fragment("repository_check_fields.graphql")
+repository_topics_fields = get_fragment("repository_topics_fields.graphql")
+
+
+@functools.lru_cache()
+def build_batch_query(fragment: str, aliases: int = 1) -> str:
+    """
+    Build a query for a number of node ID batches, given as $ids0, $ids1, ... and answered as a0, a1, ...
+
+    :param fragment: GraphQL fragment selecting the fields we want per repository
+    :param aliases: how many batches (nodes selections) the query has
+    """
+    fragment_name = re.search(r"fragment\s+(\w+)\s+on", fragment).group(1)
+    variables = ", ".join(f"$ids{a}: [ID!]!" for a in range(aliases))
+    selections = "".join(f"  a{a}: nodes(ids: $ids{a}) {{\n    ...{fragment_name}\n  }}\n" for a in range(aliases))
+    return (f"query inputArray({variables}) {{\n"
+            "  rateLimit {\n    cost\n    remaining\n    resetAt\n  }\n"
+            f"{selections}"
+            "}\n"
+            f"{fragment}")
+
+
+def topics_predicate(min_stars: int = None, min_forks: int = None,
+                     pushed_within_days: int = None) -> Optional[Callable[[dict], bool]]:
+    """
+    Select repositories worth the extra cost of their topics - those matching any of the given criteria.
+
+    :return: predicate for repositories (as in repository_fields), None without criteria
+    """
+    if min_stars is None and min_forks is None and pushed_within_days is None:
+        return None
+
+    def wants_topics(repo: dict) -> bool:
+        if min_stars is not None and repo['stargazerCount'] >= min_stars:
+            return True
+        if min_forks is not None and repo['forkCount'] >= min_forks:
+            return True
+        if pushed_within_days is not None and repo['pushedAt']:
+            pushed_ago = time.time() - iso8601.parse_date(repo['pushedAt']).timestamp()
+            return pushed_ago <= pushed_within_days * 24 * 60 * 60
+        return False
+
+    return wants_topics
 
 
 class GitHubV4Crawler(ICrawler):
     """ Crawler retrieving data from GitHubs GraphQL API. """
 
     type: str = 'github'
-
-    def __init__(self, base_url, state=None, api_key=None, query=query_repos_batch, **kwargs):
+    # 403 is abuse detection, 502/504 mean a query was too big (see query_batches)
+    throttle_statuses: List[int] = [403, 429, 500, 503]
+    tuned_attributes = ("batch_cost", "aliases", "alias_ceiling", "alias_successes", "frontier", "frontier_probed_at",
+                        "last_rate_limit", "topics_points_spent")
+
+    def __init__(self, base_url, state=None, api_key=None, fields=repository_fields,
+                 max_queries_in_flight=GITHUB_MAX_QUERIES_IN_FLIGHT, max_aliases=GITHUB_MAX_ALIASES,
+                 topics_predicate: Callable[[dict], bool] = None, topics_budget_share: float = 0,
+                 upload_unchanged: bool = False, **kwargs):
+        """
+        :param topics_predicate: which repositories to get topics for, in a follow-up query (see enrich_topics)
+        :param topics_budget_share: up to which share of our remaining ratelimit points to spend on topics
+        :param upload_unchanged: keep unchanged repositories of a refresh in the results (see skip_unchanged_ids)
+        """
         super().__init__(
             base_url=base_url,
             path='graphql',
@@ -44,16 +111,48 @@ class GitHubV4Crawler(ICrawler):
             api_key=api_key,
             **kwargs
         )
-        self.query = query
-        if api_key:
+        self.fields = fields
+        self.batch_cost = 1  # ratelimit points per batch (of GITHUB_QUERY_MAX ids), as reported by the last response
+        self.max_queries_in_flight = max_queries_in_flight
+        self.aliases = 1  # batches per query, adapted to how well GitHub copes with them
+        self.max_aliases = max_aliases
+        self.alias_ceiling = max_aliases  # lowered when GitHub failed a query, raised again after a while
+        self.alias_successes = 0
+        # queries run on several threads (see crawl) - guards the attributes above, and the points we spent
+        self.tuning_lock = threading.Lock()
+        self.frontier = None  # highest existing repository id, as last probed (see get_frontier)
+        self.frontier_probed_at = 0
+        self.last_rate_limit = None  # remaining, reset timestamp - as reported by the last query response
+        self.topics_points_spent = {}  # by reset timestamp of the ratelimit window they were spent in
+        self.load_tuning()
+        self.dead_ids = self.context.dead_ids if self.context is not None else None
+        self.fingerprints = self.context.fingerprints if self.context is not None else None
+        self.changed_fingerprints = {}  # of known ids we fetch in full, remembered once we got them
+        self.topics_predicate = topics_predicate
+        self.topics_budget_share = topics_budget_share
+        self.upload_unchanged = upload_unchanged
+        if isinstance(api_key, list):
+            pass  # a token pool - we authenticate each request with the token it picked
+        elif api_key:
             self.requests.headers.update(
                 {"Authorization": f"Bearer {api_key}"})
         else:
             raise ValueError(f"{self.__class__.__name__} requires an api_key! value: {api_key}")
 
-    def handle_ratelimit(self, response=None):
+    @classmethod
+    def options_from_config(cls, config) -> dict:
+        return dict(
+            topics_predicate=topics_predicate(min_stars=config["GITHUB_TOPICS_MIN_STARS"],
+                                              min_forks=config["GITHUB_TOPICS_MIN_FORKS"],
+                                              pushed_within_days=config["GITHUB_TOPICS_PUSHED_WITHIN_DAYS"]),
+            topics_budget_share=config["GITHUB_TOPICS_BUDGET_SHARE"],
+            upload_unchanged=config["GITHUB_UPLOAD_UNCHANGED"],
+        )
+
+    @staticmethod
+    def get_ratelimit(json: dict) -> Optional[Tuple[int, float]]:
         """
-        Adjust requests to API limits
+        Get ratelimit info from a query response.
 
         {
           "data": {
@@ -62,29 +161,50 @@ class GitHubV4Crawler(ICrawler):
               "remaining": 4984,
               "resetAt": "2020-11-29T14:26:15Z"
             },
+
+        :return: remaining points, reset timestamp - or None when not found
         """
+        rate_limit = (json.get("data") or {}).get('rateLimit', None)
+        if not rate_limit:
+            return None
+        reset_at = iso8601.parse_date(rate_limit['resetAt'])
+        # a bit longer, just to be sure
+        return rate_limit['remaining'], reset_at.timestamp() + 1
+
+    @staticmethod
+    def get_cost(json: dict, default: float = None) -> Optional[float]:
+        """ Ratelimit points a query cost, as reported in its response - default when not found. """
+        rate_limit = (json.get("data") or {}).get("rateLimit") or {}
+        return rate_limit.get("cost", default)
+
+    def get_response_ratelimit(self, response: Response) -> Optional[Tuple[int, float]]:
+        try:
+            return self.remember_ratelimit(self.get_ratelimit(response_json(response)))
+        except ValueError:
+            return None
+
+    def remember_ratelimit(self, rate_limit: Optional[Tuple[int, float]]) -> Optional[Tuple[int, float]]:
+        """ Keep the budget a response reported as last_rate_limit (see wants_topics) - :return: rate_limit """
+        if rate_limit:
+            with self.tuning_lock:
+                self.last_rate_limit = rate_limit
+        return rate_limit
+
+    def handle_ratelimit(self, response=None):
+        """ Adjust requests to API limits - our budget was updated with the response already (see ICrawler.send). """
+        if self.token_pool is not None:
+            return  # budgets are kept per token, as responses come in (see ICrawler.send)
         if response is not None:
-            rate_limit = response.json().get("data", {}).get('rateLimit', None)
+            rate_limit = self.get_ratelimit(response_json(response))
             if rate_limit:
-                ratelimit_remaining = rate_limit['remaining']
-                reset_at = iso8601.parse_date(rate_limit['resetAt'])
-                ratelimit_reset_timestamp = reset_at.timestamp()
-
+                ratelimit_remaining, ratelimit_reset_timestamp = rate_limit
                 reset_in = ratelimit_reset_timestamp - time.time()
-                # a bit longer, just to be sure
-                reset_in += 1
 
                 logger.info(
                     f'{self} {ratelimit_remaining} requests remaining, reset in {reset_in}s')
-                if ratelimit_remaining < 1:
-                    logger.warning(
-                        f'{self} rate limiting: {ratelimit_remaining} requests remaining, sleeping {reset_in}s')
-                    time.sleep(reset_in)
             else:
                 logger.warning("no ratelimit found in github response data")
-                super().handle_ratelimit()
-        else:
-            super().handle_ratelimit()
+        super().handle_ratelimit()
 
     @classmethod
     def set_state(cls, state: dict = None) -> dict:
@@ -110,34 +230,232 @@ class GitHubV4Crawler(ICrawler):
         return state
 
     @staticmethod
-    def get_graphql_variables(state: dict) -> dict:
-        """ Get a dict with keys representing variables used in a GraphQl query. """
-        return {
-            "ids": GitHubV4Crawler.get_ids(state)
-        }
+    def get_graphql_variables(ids_batches: List[list]) -> dict:
+        """ Get a dict with keys representing variables used in a GraphQl query (see build_batch_query). """
+        return {f"ids{a}": ids for a, ids in enumerate(ids_batches)}
 
-    @staticmethod
-    def get_ids(state: dict) -> list:
+    @classmethod
+    def get_nodes(cls, json: dict, aliases: int) -> List[List[dict]]:
+        """ Get the valid repositories of each batch in a query response. """
+        data = json['data']
+        return [cls.remove_invalid_nodes(data[f"a{a}"] or []) for a in range(aliases)]
+
+    def get_ids(self, state: dict) -> list:
         """ Produce a subset of repository IDs from a larger known set, or a exploratory range within query max."""
-        i = state['i'] * GITHUB_QUERY_MAX
         if len(state[BLOCK_KEY_IDS]) > 0:
             # we use known IDs when we have them
+            i = state['i'] * GITHUB_QUERY_MAX
             indexes = state[BLOCK_KEY_IDS][i:i + GITHUB_QUERY_MAX]
             if len(indexes) > 0:
                 state['current'] = indexes[-1]
         else:
-            # otherwise explore incrementally within from/to
-            i += state[BLOCK_KEY_FROM_ID]
-            indexes = range(i, i + GITHUB_QUERY_MAX)
-            state['current'] += GITHUB_QUERY_MAX
+            # otherwise explore incrementally within from/to, from where the last batch ended
+            indexes = self.explore_ids(state['current'], state[BLOCK_KEY_TO_ID])
+            state['current'] = indexes[-1] + 1 if indexes else state[BLOCK_KEY_TO_ID]
 
         return list(map(GitHubV4Crawler.encode_id, indexes))
 
+    def explore_ids(self, start: int, to_id: int) -> List[int]:
+        """ The next GITHUB_QUERY_MAX ids from start - skipping those we know don't exist (up to to_id). """
+        if self.dead_ids is None:
+            return list(range(start, start + GITHUB_QUERY_MAX))
+        return self.dead_ids.live_ids(start, GITHUB_QUERY_MAX, stop=None if to_id == -1 else to_id)
+
+    def skip_dead_ids(self, state: dict) -> None:
+        """ Drop known IDs we know don't exist (anymore), so batches are filled with ones that likely do. """
+        if self.dead_ids is None or not state[BLOCK_KEY_IDS] or state['i'] > 0:
+            return  # nothing to skip, or already started - batches are sliced by state['i']
+        live_ids = [index for index in state[BLOCK_KEY_IDS] if not self.dead_ids.contains(index)]
+        if len(live_ids) < len(state[BLOCK_KEY_IDS]):
+            logger.debug(f"{self} skipping {len(state[BLOCK_KEY_IDS]) - len(live_ids)} known ids that don't exist")
+            state[BLOCK_KEY_IDS] = live_ids
+            state['current'] = live_ids[0] if live_ids else state['current']
+
+    @staticmethod
+    def get_fingerprint(node: dict) -> str:
+        """
+        What changes when a repository does (from repository_check_fields).
+
+        The indexer can send these with known ids, as block "fingerprints": {"<id>": "<fingerprint>"}.
+        """
+        return f"{node['updatedAt']}|{node['pushedAt']}|{node['stargazerCount']}"
+
+    def check_ids(self, ids: List[int]) -> Optional[List[dict]]:
+        """ Minimal nodes (repository_check_fields) of existing ids, in a single query - None when it failed. """
+        ids_batches = [list(map(self.encode_id, ids[i:i + GITHUB_QUERY_MAX]))
+                       for i in range(0, len(ids), GITHUB_QUERY_MAX)]
+        try:
+            response = self.send(
+                "POST",
+                self.crawl_url,
+                cost=len(ids_batches),
+                retries=GITHUB_ABUSE_RETRY_MAX,
+                json=dict(query=build_batch_query(repository_check_fields, len(ids_batches)),
+                          variables=self.get_graphql_variables(ids_batches)),
+            )
+            if not response.ok:
+                logger.warning(f"checking known ids failed, status: {response.status_code}")
+                return None
+            json = response_json(response)
+        except Exception:
+            logger.exception(f"checking known ids crashed")
+            return None
+        error_types = self.get_query_error_types(json.get("errors", []), exclude="NOT_FOUND")
+        if len(error_types) > 0:
+            logger.warning(f"checking known ids failed, errors: {error_types}")
+            return None
+        self.record_dead_ids(ids_batches, json)
+        return [node for nodes in self.get_nodes(json, len(ids_batches)) for node in nodes]
+
+    def skip_unchanged_ids(self, state: dict) -> List[dict]:
+        """
+        Refresh known IDs in two phases - first check all of them with a minimal query,
+        then only fetch those in full, that changed against the fingerprints of the block or what we remember.
+
+        Unchanged repositories are left out of the results, unless we upload_unchanged - then they stay in,
+        so the indexer can tell them from those that are gone, as minimal repositories
+        (id, databaseId, updatedAt, pushedAt, stargazerCount) with REPOSITORY_KEY_UNCHANGED ("unchanged") set to True.
+        Only enable it for indexers that know these.
+
+        :return: unchanged repositories - known IDs left to fetch stay in state
+        """
+        block_fingerprints = state.get(BLOCK_KEY_FINGERPRINTS, None)
+        if not state[BLOCK_KEY_IDS] or state['i'] > 0 or (block_fingerprints is None and self.fingerprints is None):
+            return []
+        changed, unchanged = [], []
+        check_size = GITHUB_QUERY_MAX * GITHUB_CHECK_ALIASES
+        for i in range(0, len(state[BLOCK_KEY_IDS]), check_size):
+            ids = state[BLOCK_KEY_IDS][i:i + check_size]
+            nodes = self.check_ids(ids)
+            if nodes is None:
+                changed += ids  # can't tell, so we fetch them all
+                continue
+            for node in nodes:
+                index, fingerprint = node['databaseId'], self.get_fingerprint(node)
+                if block_fingerprints is not None:
+                    known_fingerprint = block_fingerprints.get(str(index), None)
+                else:
+                    known_fingerprint = self.fingerprints.get(index)
+                if fingerprint != known_fingerprint:
+                    changed.append(index)
+                    self.changed_fingerprints[index] = fingerprint
+                else:
+                    unchanged.append({**node, REPOSITORY_KEY_UNCHANGED: True})
+        logger.info(f"{self} {len(changed)} of {len(state[BLOCK_KEY_IDS])} known ids changed")
+        state[BLOCK_KEY_IDS] = changed
+        if changed:
+            state['current'] = changed[0]
+        return unchanged
+
+    def remember_fingerprints(self, state: dict) -> None:
+        """ Remember fingerprints of the known IDs of a batch we got (see skip_unchanged_ids). """
+        if self.fingerprints is None or not self.changed_fingerprints:
+            return
+        i = state['i'] * GITHUB_QUERY_MAX
+        for index in state[BLOCK_KEY_IDS][i:i + GITHUB_QUERY_MAX]:
+            fingerprint = self.changed_fingerprints.pop(index, None)
+            if fingerprint is not None:
+                self.fingerprints.set(index, fingerprint)
+
+    def wants_topics(self) -> bool:
+        """
+        If we can spend points on topics - keeping what they cost in the current ratelimit window
+        within topics_budget_share of the remaining points, as reported by the last query response.
+
+        With a token pool, that is the window and budget of the token the last response was for.
+        """
+        if self.topics_predicate is None or self.topics_budget_share <= 0 or self.fields != repository_fields:
+            return False  # not asked for, or we already get them
+        with self.tuning_lock:
+            if self.last_rate_limit is None:
+                return False  # we don't know our budget yet
+            remaining, reset_at = self.last_rate_limit
+            now = time.time()
+            self.topics_points_spent = {
+                window: spent for window, spent in self.topics_points_spent.items() if window > now}
+            spent = self.topics_points_spent.get(reset_at, 0)
+        return spent <= self.topics_budget_share * remaining and self.affordable_batches() > 0
+
+    def enrich_topics(self, batches_repos: List[List[dict]]) -> None:
+        """
+        Add repositoryTopics to the repositories selected by topics_predicate, with a follow-up query.
+
+        Selected repositories of all batches are packed into as few batches as possible.
+        When this fails or we can't afford it, repositories stay without topics.
+        """
+        if not self.wants_topics():
+            return
+        selected = [repo for repos in batches_repos for repo in repos if self.topics_predicate(repo)]
+        if not selected:
+            return
+        ids_batches = [[repo['id'] for repo in selected[i:i + GITHUB_QUERY_MAX]]
+                       for i in range(0, len(selected), GITHUB_QUERY_MAX)]
+        try:
+            response = self.send(
+                "POST",
+                self.crawl_url,
+                cost=len(ids_batches),
+                retries=GITHUB_ABUSE_RETRY_MAX,
+                json=dict(query=build_batch_query(repository_topics_fields, len(ids_batches)),
+                          variables=self.get_graphql_variables(ids_batches)),
+            )
+            if not response.ok:
+                logger.warning(f"(skipping topics) github response not ok, status: {response.status_code}")
+                return
+            json = response_json(response)
+        except Exception:
+            logger.exception(f"(skipping topics) github topics query crashed")
+            return
+        rate_limit = self.get_ratelimit(json)
+        with self.tuning_lock:
+            window = rate_limit[1] if rate_limit else self.last_rate_limit[1]
+            self.topics_points_spent[window] = (
+                self.topics_points_spent.get(window, 0) + self.get_cost(json, len(ids_batches)))
+        topics = {node['id']: node['repositoryTopics']
+                  for nodes in self.get_nodes(json, len(ids_batches)) for node in nodes}
+        for repo in selected:
+            if repo['id'] in topics:
+                repo['repositoryTopics'] = topics[repo['id']]
+        logger.debug(f"{self} topics for {len(topics)} of {sum(map(len, batches_repos))} repositories")
+
+    def record_dead_ids(self, ids_batches: List[list], json: dict) -> None:
+        """
+        Remember the ids GitHub answered with NOT_FOUND - they are dead once that happens again, later on
+        (see DeadIdIndex.add_range). The errors point to their batch and position:
+
+        {"type": "NOT_FOUND", "path": ["a0", 17], "message": "Could not resolve to a node with the global id of '...'"}
+        """
+        if self.dead_ids is None:
+            return
+        dead_ids = []
+        for error in json.get("errors", []):
+            path = error.get("path") or []
+            if error.get("type") != "NOT_FOUND" or len(path) != 2 or not isinstance(path[1], int):
+                continue
+            alias = path[0]
+            if not alias.startswith("a") or not alias[1:].isdigit() or int(alias[1:]) >= len(ids_batches):
+                continue
+            ids = ids_batches[int(alias[1:])]
+            if path[1] < len(ids):
+                dead_ids.append(self.decode_id(ids[path[1]]))
+        self.dead_ids.add_all(index for index in dead_ids if index is not None)
+
     @staticmethod
     def encode_id(index: int) -> str:
         """ Base64 encode a complete GitHub repository ID from it's decoded numerical part. """
         return str(base64.b64encode(f"010:Repository{index}".encode()), "utf-8")
 
+    @staticmethod
+    def decode_id(node_id: str) -> Optional[int]:
+        """ The numerical part of a GitHub repository ID - None for IDs not encoded like encode_id does. """
+        try:
+            decoded = base64.b64decode(node_id).decode()
+        except ValueError:
+            return None
+        if not decoded.startswith("010:Repository") or not decoded[len("010:Repository"):].isdigit():
+            return None
+        return int(decoded[len("010:Repository"):])
+
     @staticmethod
     def remove_invalid_nodes(nodes: list) -> list:
         """ Filter out potential null/None values for failed IDs. """
@@ -149,10 +467,93 @@ class GitHubV4Crawler(ICrawler):
 
     @classmethod
     def has_next_crawl(cls, state: dict) -> bool:
-        """ Decide if there are more repositories to crawl for, within current job. """
+        """
+        Decide if there are more repositories to crawl for, within current job.
+
+        Open ended, we stop GITHUB_FRONTIER_SLACK ids after the probed frontier (see get_frontier),
+        or after 10 empty batches - whatever comes first. Without a frontier, only the empty batches count.
+        """
+        before_frontier = state.get('frontier') is None or state['current'] <= state['frontier'] + GITHUB_FRONTIER_SLACK
         return (state[BLOCK_KEY_TO_ID] == -1 or state['current'] < state[BLOCK_KEY_TO_ID]) \
+               and before_frontier \
                and state['empty_page_cnt'] < 10
 
+    def probe_ids(self, start: int) -> Optional[int]:
+        """ The highest existing id of GITHUB_QUERY_MAX samples, every GITHUB_FRONTIER_SAMPLE_STRIDE-th from start. """
+        indexes = range(start, start + GITHUB_QUERY_MAX * GITHUB_FRONTIER_SAMPLE_STRIDE, GITHUB_FRONTIER_SAMPLE_STRIDE)
+        response = self.send(
+            "POST",
+            self.crawl_url,
+            retries=GITHUB_ABUSE_RETRY_MAX,
+            json=dict(query=build_batch_query(repository_probe_fields),
+                      variables=self.get_graphql_variables([list(map(self.encode_id, indexes))])),
+        )
+        if not response.ok:
+            raise RuntimeError(f"frontier probe failed, status: {response.status_code}")
+        json = response_json(response)
+        error_types = self.get_query_error_types(json.get("errors", []), exclude="NOT_FOUND")
+        if len(error_types) > 0:
+            raise RuntimeError(f"frontier probe failed, errors: {error_types}")
+        return max((node['databaseId'] for node in self.get_nodes(json, 1)[0]), default=None)
+
+    def probe_frontier(self, low: int = 0, step: int = GITHUB_FRONTIER_STEP) -> Optional[int]:
+        """
+        Find the highest existing repository id, at or above low - one small query per step.
+
+        Search exponentially from low (doubling step while there are repositories), then binary in between,
+        until the samples of the highest probe with repositories reach the lowest probe without.
+        Deleted ranges wider than the samples could make us stop early - new ids are dense enough not to.
+
+        :return: highest sampled id found, None if there are none from low on
+                 - the highest existing id can be a bit above, see GITHUB_FRONTIER_SLACK
+        """
+        span = GITHUB_QUERY_MAX * GITHUB_FRONTIER_SAMPLE_STRIDE
+        highest = self.probe_ids(low)
+        lo, hi = low, None
+        while hi is None:
+            found = self.probe_ids(lo + step)
+            if found is None:
+                hi = lo + step
+            else:
+                lo, highest = lo + step, found
+                step *= 2
+        while hi - lo > span:
+            mid = (lo + hi) // 2
+            found = self.probe_ids(mid)
+            if found is None:
+                hi = mid
+            else:
+                lo, highest = mid, found
+        logger.info(f"{self} frontier at repository id {highest}")
+        return highest
+
+    def get_frontier(self, low: int = 0) -> Optional[int]:
+        """
+        The highest existing repository id, for a block starting at low - probed again when ours is older than
+        GITHUB_FRONTIER_MAX_AGE, or when the block starts close to (or above) it.
+
+        :return: frontier, None when we don't know of one above low - then blocks end after empty batches
+        """
+        fresh = time.time() - self.frontier_probed_at < GITHUB_FRONTIER_MAX_AGE
+        if self.frontier is not None and fresh and low < self.frontier - GITHUB_FRONTIER_SLACK:
+            return self.frontier
+        try:
+            if self.frontier is not None and low < self.frontier:
+                # the frontier only grows, so we start from the last one - with small steps
+                frontier = self.probe_frontier(self.frontier, step=GITHUB_FRONTIER_SLACK)
+            else:
+                frontier = self.probe_frontier(low)
+        except Exception:
+            logger.exception(f"{self} probing the frontier failed")
+            frontier = None
+        if frontier is not None:
+            self.frontier = max(frontier, self.frontier or 0)
+            self.frontier_probed_at = time.time()
+            self.save_tuning()
+        if self.frontier is None or self.frontier + GITHUB_FRONTIER_SLACK < low:
+            return None  # nothing found above where the block starts - don't let a lower frontier end it
+        return self.frontier
+
     @classmethod
     def get_query_error_types(cls, errors, exclude: str = None) -> List:
         """
@@ -173,74 +574,190 @@ class GitHubV4Crawler(ICrawler):
             types = filter(lambda s: s != exclude, types)
         return list(types)
 
+    def send_query(self, query: str, variables: dict) -> Response:
+        return self.send(
+            "POST",
+            self.crawl_url,
+            cost=max(1, self.batch_cost * len(variables)),
+            retries=GITHUB_ABUSE_RETRY_MAX,
+            json=dict(query=query, variables=variables),
+        )
+
+    def query_batches(self, ids_batches: List[list]) -> Tuple[List[Tuple[bool, List[dict]]], Optional[Response]]:
+        """
+        Run a GraphQL query for one or more batches of ids (as aliased nodes selections),
+        retrying when we hit abuse detection or an exceeded ratelimit.
+
+        When GitHub struggles with a query of several batches (timeout, 502), we split it up and try again.
+
+        :return: (success, repos) for each batch, response
+        """
+        aliases = len(ids_batches)
+        query = build_batch_query(self.fields, aliases)
+        variables = self.get_graphql_variables(ids_batches)
+        failed = [(False, [])] * aliases
+        try:
+            # 403s are retried by send_query - they come from "hidden" abuse detection,
+            # telling us to wait a few minutes, but backing off a bit is enough to be allowed again
+            response = self.send_query(query, variables)
+
+            if response.ok:
+                json = response_json(response)
+                error_types = self.get_query_error_types(json.get("errors", []), exclude="NOT_FOUND")
+                if GITHUT_RATELIMIT_ERROR_TYPE in error_types:
+                    # if ratelimit has been exceeded, we don't get the ratelimit dict but only a error dict
+                    # so we cannot know exactly how long we sleep for, but assume it was just reached before retry
+                    logger.debug(
+                        f"{error_types} - ratelimit was reached elsewhere - retry in {GITHUB_RATELIMIT_SLEEP}s")
+                    time.sleep(GITHUB_RATELIMIT_SLEEP)
+                    logger.debug(f"long ratelimit sleep over, retry query")
+                    response = self.send_query(query, variables)
+                    json = response_json(response)
+                elif len(error_types) > 0:
+                    logger.warning(f"got unknown query errors - json:\n{json}")
+
+                with self.tuning_lock:
+                    self.adapt_aliases(aliases, response, json)
+                self.record_dead_ids(ids_batches, json)
+                batches_repos = self.get_nodes(json, aliases)
+                self.enrich_topics(batches_repos)
+                return [(True, repos) for repos in batches_repos], response
+            elif response.status_code in GITHUB_OVERLOAD_STATUSES and aliases > 1:
+                logger.warning(f"status {response.status_code} for a query of {aliases} batches - splitting it up")
+                return self.split_query(ids_batches)
+            else:
+                logger.warning(f"(skipping block chunk) github response not ok, status: {response.status_code}")
+                logger.warning(f"headers: {response.headers.__dict__}")
+                logger.warning(f"json: {response_json(response)}")
+                return failed, response
+        except requests.exceptions.Timeout as e:
+            if aliases > 1:
+                logger.warning(f"timeout for a query of {aliases} batches - splitting it up")
+                return self.split_query(ids_batches)
+            logger.exception(f"(skipping block chunk) github query timed out")
+            return failed, None
+        except Exception as e:
+            logger.exception(f"(skipping block chunk) github crawler crashed")
+            return failed, None
+
+    def split_query(self, ids_batches: List[list]) -> Tuple[List[Tuple[bool, List[dict]]], Optional[Response]]:
+        """ Query the halves of a query that was too much for GitHub. """
+        with self.tuning_lock:
+            self.alias_ceiling = max(1, len(ids_batches) - 1)
+            self.aliases = max(1, len(ids_batches) // 2)
+            self.alias_successes = 0
+        half = len(ids_batches) // 2
+        first_results, first_response = self.query_batches(ids_batches[:half])
+        second_results, second_response = self.query_batches(ids_batches[half:])
+        return first_results + second_results, second_response or first_response
+
+    def adapt_aliases(self, aliases: int, response: Response, json: dict):
+        """
+        Adapt how many batches we pack into a query.
+
+        Add one more batch while queries are answered quickly,
+        back off by one when they get slow (and by half when they fail, see split_query).
+        After a failure we stay below the failing size, until GITHUB_ALIAS_PROBE_AFTER queries went well.
+        Called with tuning_lock held.
+        """
+        cost = self.get_cost(json)
+        if cost is not None:
+            self.batch_cost = cost / aliases
+        if response.elapsed.total_seconds() > GITHUB_SLOW_QUERY_SECONDS:
+            self.aliases = max(1, aliases - 1)
+            logger.debug(f"{self} slow query ({response.elapsed}), down to {self.aliases} batches per query")
+            return
+        self.alias_successes += 1
+        if self.alias_successes >= GITHUB_ALIAS_PROBE_AFTER and self.alias_ceiling < self.max_aliases:
+            self.alias_ceiling += 1
+            self.alias_successes = 0
+        if aliases >= self.aliases:
+            self.aliases = min(self.alias_ceiling, aliases + 1)
+
+    def affordable_batches(self) -> int:
+        """ Batches we can have on the way, keeping GITHUB_BATCH_POINTS_HEADROOM batch costs of ratelimit for each. """
+        remaining = self.ratelimit.remaining if self.token_pool is None else self.token_pool.remaining
+        if remaining is None:
+            return 1  # find out about our budget first
+        return int(remaining // (max(self.batch_cost, 1) * GITHUB_BATCH_POINTS_HEADROOM))
+
+    def queries_in_flight(self, aliases: int) -> int:
+        """
+        How many queries (of `aliases` batches) to keep running at once.
+
+        As many as allowed while the ratelimit lasts, so we slow down to a single query as we get close to the limit.
+        """
+        return max(1, min(self.max_queries_in_flight, self.affordable_batches() // aliases))
+
     def crawl(self, state: dict = None) -> Tuple[bool, List[dict], dict]:
         """
-        Run a GraphQL query against GitHubs V4 API.
+        Run GraphQL queries against GitHubs V4 API.
+
+        Each query asks for up to `self.aliases` batches of ids, and up to queries_in_flight() queries run concurrently.
+        Results are yielded per batch, in batch order, so state (and empty_page_cnt) advance
+        just like with one batch at a time.
 
         :return: success, repos, state
         """
         state = state or self.state
-
-        def send_query() -> Response:
-            variables = self.get_graphql_variables(state)
-            return self.requests.post(
-                url=self.crawl_url,
-                json=dict(query=self.query, variables=variables),
-                timeout=DEFAULT_REQUEST_TIMEOUT
-            )
-
-        while self.has_next_crawl(state):
-            try:
-                response = send_query()
-                failed_count = 0
-                while response.status_code == 403 and failed_count < GITHUB_ABUSE_RETRY_MAX:
-                    # we sometimes run in to some "hidden" abuse detection on multiple crawlers
-                    # it tells use to wait a few minutes, but a few seconds is enough to be allowed again
-                    # thus, we repeatedly try again to avoid having holes in our data (skipped block chunks)
-                    # TODO don't see a way to avoid triggering this right now
-                    # TODO it triggers even though we have plenty of ratelimit to spare
-                    failed_count += 1
-                    logger.warning(f"status 403 - retry block chunk in {GITHUB_API_ABUSE_SLEEP}s"
-                                   f"- probably triggered abuse flag? json:\n{response.json()}")
-                    time.sleep(GITHUB_API_ABUSE_SLEEP)
-                    response = send_query()
-
-                if failed_count >= GITHUB_ABUSE_RETRY_MAX:
-                    logger.warning(f"retrying block chunk failed after {GITHUB_ABUSE_RETRY_MAX} retries")
-
-                if response.ok:
-                    json = response.json()
-                    error_types = self.get_query_error_types(json.get("errors", []), exclude="NOT_FOUND")
-                    if GITHUT_RATELIMIT_ERROR_TYPE in error_types:
-                        # if ratelimit has been exceeded, we don't get the ratelimit dict but only a error dict
-                        # so we cannot know exactly how long we sleep for, but assume it was just reached before retry
-                        logger.debug(
-                            f"{error_types} - ratelimit was reached elsewhere - retry in {GITHUB_RATELIMIT_SLEEP}s")
-                        time.sleep(GITHUB_RATELIMIT_SLEEP)
-                        logger.debug(f"long ratelimit sleep over, retry query")
-                        response = send_query()
-                        json = response.json()
-                    elif len(error_types) > 0:
-                        logger.warning(f"got unknown query errors - json:\n{json}")
-
-                    repos = json['data']['nodes']
-                    repos = self.remove_invalid_nodes(repos)
-                    if len(repos) == 0:
+        refresh = len(state[BLOCK_KEY_IDS]) > 0
+        self.skip_dead_ids(state)
+        unchanged = self.skip_unchanged_ids(state)
+        if unchanged and self.upload_unchanged:
+            yield True, unchanged, state
+        if refresh and not state[BLOCK_KEY_IDS]:
+            return  # none of the known ids left to fetch - don't explore from from_id instead
+        if state[BLOCK_KEY_TO_ID] == -1 and not state[BLOCK_KEY_IDS]:
+            # open ended exploration - stop at the highest existing id, not after 10 empty batches
+            state['frontier'] = self.get_frontier(state['current'])
+        next_state = dict(state)  # state of the next batch to send
+        pending = collections.deque()  # (batch states, future) in batch order
+
+        def has_next_batch():
+            # results are only counted when yielded, so empty pages of batches in flight are not known yet
+            return self.has_next_crawl({**next_state, 'empty_page_cnt': state['empty_page_cnt']})
+
+        executor = ThreadPoolExecutor(max_workers=self.max_queries_in_flight, thread_name_prefix="github-query")
+        try:
+            while True:
+                aliases = max(1, min(self.aliases, self.affordable_batches()))
+                while len(pending) < self.queries_in_flight(aliases) and has_next_batch():
+                    batch_states, ids_batches = [], []
+                    while len(batch_states) < aliases and has_next_batch():
+                        ids_batches.append(self.get_ids(next_state))
+                        batch_states.append(next_state)
+                        next_state = self.set_state(dict(next_state))
+                    pending.append((batch_states, executor.submit(self.query_batches, ids_batches)))
+                if not pending:
+                    break
+
+                batch_states, future = pending.popleft()
+                results, response = future.result()
+                for batch_state, (success, repos) in zip(batch_states, results):
+                    state.update(i=batch_state['i'], current=batch_state['current'])
+                    if success and len(repos) == 0:
                         state['empty_page_cnt'] += 1
-                    yield True, repos, state
+                    if success:
+                        self.remember_fingerprints(batch_state)
+                    yield success, repos, state
+                    if not self.has_next_crawl(state):
+                        break
+
+                if response is not None and response.ok:
+                    self.handle_ratelimit(response)
                 else:
-                    logger.warning(f"(skipping block chunk) github response not ok, status: {response.status_code}")
-                    logger.warning(f"headers: {response.headers.__dict__}")
-                    logger.warning(f"json: {response.json()}")
-                    yield False, [], state
-                self.handle_ratelimit(response)
-
-            except Exception as e:
-                logger.exception(f"(skipping block chunk) github crawler crashed")
-                yield False, [], state
-                self.handle_ratelimit()
+                    self.handle_ratelimit()
 
+                if not self.has_next_crawl(state):
+                    break  # reached the end while other batches were in flight - we don't want those results
             state = self.set_state(state)  # update state for next round
+        finally:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+            self.save_tuning()
+            if self.dead_ids is not None:
+                self.dead_ids.save()
 
         """ expected GraphQL response
         {
@@ -1,72 +1,186 @@
 import logging
-import time
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
 
-from crawlers.constants import GITLAB_PER_PAGE_MAX, DEFAULT_REQUEST_TIMEOUT
+from crawlers.constants import (
+    GITLAB_PER_PAGE_MAX, GITLAB_PAGINATION_KEYSET, GITLAB_PAGINATION_OFFSET, GITLAB_DEFAULT_PAGINATION,
+    BLOCK_KEY_FROM_ID, BLOCK_KEY_TO_ID, CRAWLER_PARTITION_MIN_PAGES
+)
 from crawlers.lib.platforms.i_crawler import ICrawler
+from crawlers.lib.util.json_codec import response_json
 
 logger = logging.getLogger(__name__)
 
 class GitLabCrawler(ICrawler):
     type: str = 'gitlab'
+    # the simple representation (when projecting, see get_request), without avatar and web urls of the namespace
+    response_fields = (
+        "id", "name", "name_with_namespace", "path", "path_with_namespace", "description", "created_at",
+        "last_activity_at", "default_branch", "tag_list", "topics", "ssh_url_to_repo", "http_url_to_repo",
+        "web_url", "readme_url", "avatar_url", "forks_count", "star_count",
+        "namespace.id", "namespace.name", "namespace.path", "namespace.kind", "namespace.full_path",
+        "namespace.parent_id",
+    )
+
+    tuned_attributes = ("pagination",)
 
     # https://docs.gitlab.com/ee/api/projects.html
 
-    def __init__(self, base_url, state=None, api_key=None, **kwargs):
+    def __init__(self, base_url, state=None, api_key=None, keyset_hosts: List[str] = (), **kwargs):
+        """ :param keyset_hosts: hosts we walk with keyset pagination (others by page numbers) """
         super().__init__(
             base_url=base_url,
             path='/api/v4/projects',
-            state=self.set_state(state),
+            state=state,
             api_key=api_key,
             **kwargs
         )
+        keyset = urlparse(base_url).hostname in keyset_hosts
+        self.pagination = GITLAB_PAGINATION_KEYSET if keyset else GITLAB_DEFAULT_PAGINATION
+        self.load_tuning()  # we might have found out the hoster doesn't support keyset pagination
+        self.state = self.set_state({"pagination": self.pagination, **(state or {})})
         if api_key:
             self.requests.headers.update({"PRIVATE-TOKEN": api_key})
 
+    @classmethod
+    def options_from_config(cls, config) -> dict:
+        return dict(keyset_hosts=config["GITLAB_KEYSET_HOSTS"])
+
     @classmethod
     def set_state(cls, state: dict = None) -> dict:
+        """
+        With keyset pagination, a block is walked by id range directly -
+        the state keeps the next page url GitLab links to, instead of a page number.
+        """
+        if not state:
+            state = {}
         state["per_page"] = state.get("per_page", GITLAB_PER_PAGE_MAX)
+        state["pagination"] = state.get("pagination", GITLAB_DEFAULT_PAGINATION)
+        if state["pagination"] == GITLAB_PAGINATION_KEYSET:
+            state['is_done'] = state.get('is_done', False)
+            state['next_url'] = state.get('next_url', None)
+            return state
         state = super().set_state(state)
         return state
 
+    @classmethod
+    def has_next_crawl(cls, state: dict) -> bool:
+        if state["pagination"] == GITLAB_PAGINATION_KEYSET:
+            return not state['is_done']
+        return super().has_next_crawl(state)
+
+    def partition_state(self, state: dict, parts: int) -> List[dict]:
+        """ With keyset pagination we split by ids instead of pages. """
+        if state["pagination"] != GITLAB_PAGINATION_KEYSET:
+            return super().partition_state(state, parts)
+        from_id, to_id = state.get(BLOCK_KEY_FROM_ID, False), state.get(BLOCK_KEY_TO_ID, False)
+        if parts < 2 or not from_id or not to_id or state['next_url'] or state['is_done']:
+            return [state]  # unbounded, or already started
+        min_ids = CRAWLER_PARTITION_MIN_PAGES * state['per_page']
+        return [
+            {**state, BLOCK_KEY_FROM_ID: first, BLOCK_KEY_TO_ID: last}
+            for first, last in self.split_range(from_id, to_id, parts, min_ids)
+        ]
+
+    def get_request(self, state: dict) -> Tuple[str, Optional[dict]]:
+        """ :return: url, params - for the next page of state """
+        # the simple representation leaves out links, permissions, settings and statistics we don't use
+        simple = dict(simple='true') if self.projection else {}
+        if state["pagination"] != GITLAB_PAGINATION_KEYSET:
+            return self.crawl_url, dict(
+                order_by="id",
+                page=state["page"],
+                per_page=state['per_page'],
+                sort='asc',
+                **simple
+            )
+        if state['next_url']:
+            return state['next_url'], None  # the link already has all params, and the cursor
+        params = dict(
+            pagination=GITLAB_PAGINATION_KEYSET,
+            order_by="id",
+            per_page=state['per_page'],
+            sort='asc',
+            **simple
+        )
+        # block ids are inclusive, id_after/id_before exclude the given id
+        if state.get(BLOCK_KEY_FROM_ID, False):
+            params["id_after"] = state[BLOCK_KEY_FROM_ID] - 1
+        if state.get(BLOCK_KEY_TO_ID, False):
+            params["id_before"] = state[BLOCK_KEY_TO_ID] + 1
+        return self.crawl_url, params
+
+    def is_keyset_response(self, state: dict, headers) -> bool:
+        """
+        If a response is paginated as we asked - GitLab versions without keyset pagination ignore it,
+        and answer with the first page of all projects (with X-Page headers of offset pagination).
+        """
+        return state["pagination"] != GITLAB_PAGINATION_KEYSET or "X-Page" not in headers
+
+    def fall_back_to_offset(self, state: dict) -> dict:
+        """ Continue a keyset state with page numbers - for this block, and (via our tuning) the next ones. """
+        logger.warning(f"{self} doesn't support keyset pagination - using page numbers")
+        self.pagination = GITLAB_PAGINATION_OFFSET
+        self.save_tuning()
+        state = {key: value for key, value in state.items() if key not in ("next_url", "is_done")}
+        return self.set_state({**state, "pagination": GITLAB_PAGINATION_OFFSET})
+
+    @staticmethod
+    def update_page_state(state: dict, repos: List[dict], next_url: Optional[str]) -> dict:
+        """ Record a received page in state, before it is yielded. """
+        if state["pagination"] == GITLAB_PAGINATION_KEYSET:
+            state['next_url'] = next_url
+            state['is_done'] = not next_url or len(repos) == 0
+        else:
+            state['is_done'] = len(repos) != state['per_page']  # finish early, we reached the end
+        return state
+
+    @staticmethod
+    def get_ratelimit(headers) -> Tuple[int, int]:
+        """ :return: remaining requests, reset timestamp - -1 when not found """
+        remaining = int(headers.get("RateLimit-Remaining", -1))
+        reset_ts = int(headers.get("RateLimit-Reset", -1))
+        return remaining, reset_ts
+
+    def get_response_ratelimit(self, response) -> Optional[Tuple[int, float]]:
+        """ (from the headers, so it works for async responses as well) """
+        remaining, reset_ts = self.get_ratelimit(response.headers)
+        if remaining == -1 or reset_ts == -1:
+            return None
+        return remaining, reset_ts
+
     def handle_ratelimit(self, response = None):
+        # our budget was updated with the response already (see ICrawler.send), we only wait when it's used up
         if response:
-            remaining = int(response.headers.get("RateLimit-Remaining", -1))
-            reset_ts = int(response.headers.get("RateLimit-Reset", -1))
-            if remaining == -1 or reset_ts == -1:
+            rate_limit = self.get_response_ratelimit(response)
+            if rate_limit is None:
                 logger.warning("no ratelimit found in gitlab response headers")
-                super().handle_ratelimit(response)
-            elif remaining == 0:
-                # otherwise spam&sleep
-                sleep_s = reset_ts - time.time()
-                logger.info(f"ratelimit exceeded for {self}, sleeping for {sleep_s} seconds...")
-                time.sleep(sleep_s)
-        else:
-            super().handle_ratelimit()
+            elif rate_limit[0] == 0:
+                logger.info(f"ratelimit exceeded for {self}, sleeping until {rate_limit[1]}...")
+        super().handle_ratelimit()
 
     def crawl(self, state: dict = None) -> Tuple[bool, List[dict], dict]:
         """ :return: success, repos, state """
         state = state or self.state
         while self.has_next_crawl(state):
-            params = dict(
-                order_by="id",
-                page=state["page"],
-                per_page=state['per_page'],
-                sort='asc'
-            )
+            url, params = self.get_request(state)
             try:
-                response = self.requests.get(self.crawl_url, params=params, timeout=DEFAULT_REQUEST_TIMEOUT)
+                response = self.send("GET", url, params=params)
                 if not response.ok:
                     logger.warning(f"(skipping block chunk) gitlab - {self.base_url} " +
                                    f"- response not ok, status: {response.status_code}")
                     logger.warning(response.headers.__dict__)
                     return False, [], state  # nr.1 - we skip rest of this block, hope we get it next time
-                repos = response.json()
+                repos = response_json(response)
             except Exception as e:
                 logger.exception(f"(skipping block chunk) gitlab crawler crashed")
                 return False, [], state  # nr.2 - we skip rest of this block, hope we get it next time
 
-            state['is_done'] = len(repos) != state['per_page']  # finish early, we reached the end
+            if not self.is_keyset_response(state, response.headers):
+                state = self.fall_back_to_offset(state)
+                continue
+
+            state = self.update_page_state(state, repos, response.links.get('next', {}).get('url'))
 
             yield True, repos, state
             self.handle_ratelimit(response)
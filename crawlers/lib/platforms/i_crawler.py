@@ -1,54 +1,261 @@
 """ All crawlers share this interface to work with our crawler API/CLI. """
 import logging
 import math
-import requests
-import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
-from typing import List, Tuple
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+from typing import Generator, List, Optional, Tuple
+import requests
 
-from crawlers.constants import CRAWLER_DEFAULT_THROTTLE, BLOCK_KEY_FROM_ID, BLOCK_KEY_TO_ID
+from crawlers.constants import (
+    BLOCK_KEY_FROM_ID, BLOCK_KEY_TO_ID, CRAWLER_RETRY_MAX, CRAWLER_THROTTLE_STATUSES, DEFAULT_REQUEST_TIMEOUT,
+    CRAWLER_PARTITION_MIN_PAGES, CRAWLER_PARTITION_BUFFER, CRAWLER_PARTITION_PUT_TIMEOUT
+)
+from crawlers.lib.aimd import AIMDController
+from crawlers.lib.hoster_context import HosterContext, new_session
+from crawlers.lib.projection import Record, project
+from crawlers.lib.ratelimit import RateLimit
+from crawlers.lib.token_pool import TokenPool
 
 logger = logging.getLogger(__name__)
 
 
+def get_retry_after(headers) -> Optional[float]:
+    """ Seconds a hoster asked us to wait, via Retry-After. """
+    retry_after = headers.get("Retry-After", "")
+    return float(retry_after) if retry_after.isdigit() else None
+
+
 class ICrawler:
     type: str = None
+    throttle_statuses: List[int] = CRAWLER_THROTTLE_STATUSES  # response statuses meaning "slow down"
+    tuned_attributes: Tuple[str, ...] = ()  # learned while crawling, carried over to the next block by our context
+    # repository fields we use (dotted for nested ones) - all we keep when projecting (see project),
+    # and request where we can
+    response_fields: Tuple[str, ...] = ()
 
-    def __init__(self, base_url, path, state, api_key=None, user_agent=None, extra_headers: dict = {}):
+    def __init__(self, base_url, path, state, api_key=None, user_agent=None, extra_headers: dict = {},
+                 context: HosterContext = None, partitions: int = 1, projection: bool = False):
+        """
+        :param partitions: sub-ranges to split a block into, see crawl_partitioned
+        :param projection: only keep (and ask hosters for) our response_fields, see project
+        """
         self.base_url = base_url
         self.path = path
         self.api_key = api_key
         self.state = state
         self.extra_headers = extra_headers
+        self.partitions = partitions
+        self.projection = projection
+        self.context = context
 
         self.crawl_url = urljoin(self.base_url, self.path)
 
-        self.requests = requests.session()
+        # with a context, session, rate-limit and controller are shared
+        # with the other crawlers of the same hoster/credential
+        if context is not None:
+            self.requests = context.session
+            self.ratelimit = context.ratelimit
+            self.controller = context.controller
+            self.token_pool = context.token_pool
+        else:
+            self.requests = new_session()
+            self.ratelimit = RateLimit(name=f"{self.type}@{self.base_url}")
+            self.controller = AIMDController(name=f"{self.type}@{self.base_url}")
+            self.token_pool = TokenPool(api_key) if isinstance(api_key, list) else None
         self.requests.headers.update(self.extra_headers)
-        retries = Retry(total=3,
-                        backoff_factor=10,
-                        status_forcelist=[429, 500, 502, 503, 504])
-        self.requests.mount("https://", HTTPAdapter(max_retries=retries))
         if user_agent is not None:
             self.requests.headers.update({"User-Agent": user_agent})
 
     def __str__(self):
         return f'<{self.type}@{self.base_url}>'
 
+    def load_tuning(self):
+        """ Continue with what the crawler of the last block learned (see tuned_attributes). """
+        if self.context is not None:
+            for attribute in self.tuned_attributes:
+                if attribute in self.context.tuning:
+                    setattr(self, attribute, self.context.tuning[attribute])
+
+    def save_tuning(self):
+        if self.context is not None:
+            self.context.tuning.update({attribute: getattr(self, attribute) for attribute in self.tuned_attributes})
+
+    def reserve_ratelimit(self, cost: float = 1) -> str:
+        """
+        Take our share of the rate-limit budget before sending a request, waiting for a reset if needed.
+
+        :return: reservation, see settle_ratelimit
+        """
+        return self.ratelimit.acquire(cost)
+
+    def settle_ratelimit(self, token, reservation: Optional[str], rate_limit: Optional[Tuple[int, float]]):
+        """
+        Done with a request sent with a reservation (of token, with a token_pool) -
+        record the budget its response reported (see get_response_ratelimit), or just drop the reservation.
+        """
+        if reservation is None:
+            return
+        if token is not None:
+            if rate_limit:
+                self.token_pool.update(token, *rate_limit, reservation=reservation)
+            else:
+                self.token_pool.release(token, reservation)
+        elif rate_limit:
+            self.ratelimit.update(*rate_limit, reservation=reservation)
+        else:
+            self.ratelimit.release(reservation)
+
+    def auth_headers(self, token) -> dict:
+        """ Headers to authenticate a request with one token of our token_pool. """
+        return {"Authorization": f"Bearer {token}"}
+
+    def get_response_ratelimit(self, response: requests.Response) -> Optional[Tuple[int, float]]:
+        """
+        :return: remaining, reset timestamp - as reported in a response, or None
+                 (our budget is updated with it in send, handle_ratelimit only waits when it's used up)
+        """
+        return None
+
+    def send(self, method: str, url: str, cost: float = 1, retries: int = CRAWLER_RETRY_MAX,
+             **kwargs) -> requests.Response:
+        """
+        Send a request within our rate-limit budget, at the pace of our AIMDController.
+
+        Throttled requests (see throttle_statuses) make the controller back off, and are retried.
+        With a token_pool, each attempt uses the token with the most budget left.
+
+        :param cost: rate-limit budget the request uses up - 0 for requests that don't count against our
+                     budget (e.g. of another API), they are neither reserved nor sent with a token of our token_pool
+        """
+        kwargs.setdefault("timeout", DEFAULT_REQUEST_TIMEOUT)
+        attempt = 0
+        while True:
+            token = reservation = None
+            if cost and self.token_pool is not None:
+                token, reservation = self.token_pool.acquire(cost)
+                kwargs["headers"] = {**kwargs.get("headers", {}), **self.auth_headers(token)}
+            elif cost:
+                reservation = self.reserve_ratelimit(cost)
+            self.controller.acquire()
+            try:
+                response = self.requests.request(method, url, **kwargs)
+            except Exception:
+                self.controller.release(throttled=True)
+                self.settle_ratelimit(token, reservation, None)
+                raise
+            # only here we know which reservation (and token) the reported budget belongs to
+            self.settle_ratelimit(token, reservation, self.get_response_ratelimit(response) if reservation else None)
+            throttled = response.status_code in self.throttle_statuses
+            self.controller.release(throttled=throttled, retry_after=get_retry_after(response.headers))
+            if not throttled:
+                return response
+            if attempt >= retries:
+                logger.warning(f"{self} status {response.status_code} - giving up after {retries} retries")
+                return response
+            attempt += 1
+            logger.warning(f"{self} status {response.status_code} - retry {attempt}/{retries}, {self.controller}")
+
     def handle_ratelimit(self, response=None):
-        logger.debug(f"default throttling - sleep for {CRAWLER_DEFAULT_THROTTLE}")
-        time.sleep(CRAWLER_DEFAULT_THROTTLE)
+        # requests are paced by our controller, we only need to wait when our budget is used up
+        # - others sharing our credential might have used it up
+        # (a token_pool waits when picking a token instead)
+        if self.token_pool is None:
+            self.ratelimit.wait()
 
     def crawl(self, state: dict = None) -> Tuple[bool, List[dict], dict]:
         """ :return: success, repos, state """
         raise NotImplementedError
 
+    @staticmethod
+    def split_range(start: int, end: int, parts: int, min_size: int = 1) -> List[Tuple[int, int]]:
+        """ Split the inclusive range start..end into up to parts inclusive sub-ranges, of at least min_size. """
+        parts = max(1, min(parts, (end - start + 1) // max(min_size, 1)))
+        size = math.ceil((end - start + 1) / parts)
+        return [(s, min(s + size - 1, end)) for s in range(start, end + 1, size)]
+
+    def partition_state(self, state: dict, parts: int) -> List[dict]:
+        """
+        Split the range of a block state into sub-range states, which can be crawled independently.
+
+        By default, page based states (see set_state) with a known last page are split by pages,
+        anything else stays in one piece.
+        """
+        if parts < 2 or state.get('page_end', -1) == -1 or 'page' not in state:
+            return [state]
+        return [
+            {**state, 'page': first, 'page_end': last}
+            for first, last in self.split_range(state['page'], state['page_end'], parts, CRAWLER_PARTITION_MIN_PAGES)
+        ]
+
+    def crawl_partitioned(self, state: dict = None) -> Generator[Tuple[bool, List[dict], dict], None, None]:
+        """
+        Like crawl, but with the block split into sub-ranges (see partition_state), crawled concurrently.
+
+        Results are yielded in the order of the block, as if crawled in one go. How many requests
+        actually run at once towards the hoster is still up to our AIMDController.
+        Sub-ranges ahead of the one being yielded hold up to CRAWLER_PARTITION_BUFFER results, and wait for it.
+
+        :return: success, repos, state (of the sub-range)
+        """
+        states = self.partition_state(state or self.state, self.partitions)
+        if len(states) == 1:
+            yield from self.crawl(states[0])
+            return
+
+        logger.debug(f"{self} crawling block in {len(states)} sub-ranges")
+        results = [queue.Queue(maxsize=CRAWLER_PARTITION_BUFFER) for _ in states]
+        done = object()
+        stopped = threading.Event()
+
+        def put(results: queue.Queue, result) -> bool:
+            """ :return: False when nobody is waiting for our results anymore """
+            while not stopped.is_set():
+                try:
+                    results.put(result, timeout=CRAWLER_PARTITION_PUT_TIMEOUT)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def crawl_range(sub_state: dict, results: queue.Queue):
+            try:
+                for result in self.crawl(sub_state):
+                    if not put(results, result):
+                        return
+            except Exception:
+                logger.exception(f"{self} crawling sub-range crashed - state: {sub_state}")
+                put(results, (False, [], sub_state))
+            finally:
+                put(results, done)
+
+        executor = ThreadPoolExecutor(max_workers=len(states), thread_name_prefix=f"{self.type}-range")
+        try:
+            for sub_state, sub_results in zip(states, results):
+                executor.submit(crawl_range, sub_state, sub_results)
+            for sub_results in results:
+                for result in iter(sub_results.get, done):
+                    yield result
+        finally:
+            stopped.set()
+            executor.shutdown(wait=False)
+
+    def project(self, repos: List[dict]) -> List[Record]:
+        """ Compact records of repos, with only our response_fields - or repos as they are, when not projecting. """
+        if not self.projection or not self.response_fields:
+            return repos
+        return project(repos, f"{self.__class__.__name__}Record", self.response_fields)
+
     @staticmethod
     def state_from_block_data(block_data: dict) -> dict:
         return block_data  # override this function for specific crawler pre-processing
 
+    @classmethod
+    def options_from_config(cls, config) -> dict:
+        """ Init arguments of this crawler type, from our (flask) config - override for crawler specific options. """
+        return {}
+
     @classmethod
     def set_state(cls, state: dict = None) -> dict:
         """
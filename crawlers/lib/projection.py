@@ -0,0 +1,71 @@
+"""
+Compact repository records, holding only the fields we pass on to the indexer.
+
+Hosters send far more than we use (links, nested owner objects, dozens of api urls). Crawlers declare the
+fields they use (ICrawler.response_fields, dotted for nested ones), and each raw repository is projected into a
+record of a class with __slots__ for just these - so the raw dicts can be freed as soon as a page is crawled.
+
+Records serialize to the same JSON shape as the raw repositories, without the fields we dropped (see json_default).
+"""
+import functools
+from typing import Iterable, List, Sequence, Tuple, Type
+
+_missing = object()
+
+
+def field_tree(fields: Iterable[str]) -> dict:
+    """
+    Nest dotted field names: ["id", "owner.login", "owner.id"] -> {"id": True, "owner": {"login": True, "id": True}}
+    """
+    tree = {}
+    for field in fields:
+        node = tree
+        *parents, leaf = field.split(".")
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = True
+    return tree
+
+
+def prune(value, tree):
+    """ Only the fields of tree in value - anything that isn't an object (lists, null) is kept as is. """
+    if tree is True or not isinstance(value, dict):
+        return value
+    return {key: prune(value[key], subtree) for key, subtree in tree.items() if key in value}
+
+
+class Record:
+    """ Base of the record classes made by record_type. """
+    __slots__ = ()
+    tree: dict = {}
+
+    def __init__(self, raw: dict):
+        for key in self.__slots__:
+            setattr(self, key, prune(raw[key], self.tree[key]) if key in raw else _missing)
+
+    def to_json(self) -> dict:
+        """ The projected repository as JSON-able data - fields missing in the raw repository are left out. """
+        values = ((key, getattr(self, key)) for key in self.__slots__)
+        return {key: value for key, value in values if value is not _missing}
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.to_json()})"
+
+
+@functools.lru_cache()
+def record_type(name: str, fields: Tuple[str, ...]) -> Type[Record]:
+    """ A record class with a slot per top level field. """
+    tree = field_tree(fields)
+    return type(name, (Record,), dict(__slots__=tuple(tree), tree=tree))
+
+
+def project(repos: List[dict], name: str, fields: Sequence[str]) -> List[Record]:
+    record_class = record_type(name, tuple(fields))
+    return [record_class(repo) for repo in repos]
+
+
+def json_default(obj):
+    """ For dumps(..., default=json_default) (see crawlers.lib.util.json_codec), to serialize records. """
+    if isinstance(obj, Record):
+        return obj.to_json()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
@@ -0,0 +1,237 @@
+"""
+Rate-limit bookkeeping shared between crawlers.
+
+Crawlers of the same hoster and credential (across blocks and worker threads) share one RateLimit,
+so when one of them sees the limit exhausted, the others wait for the reset as well.
+
+Crawlers reserve budget before sending a request, and update it with what the hoster reports in the response
+to that reservation - less what is still in flight, which the hoster didn't count yet.
+A FileRateLimit keeps this budget in a file, to share it between all crawler processes of a machine.
+
+With pacing, reservations are spread evenly over the time until the limit resets,
+instead of sending at full speed until nothing is left and then sleeping until reset.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+from crawlers.constants import DEFAULT_REQUEST_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimit:
+    """
+    Thread-safe budget of the remaining requests/points for one hoster and credential.
+
+    :param pacing: spread the remaining budget evenly until reset
+    :param pacing_margin: part of the remaining budget to leave unused when pacing, in case others use it as well
+    """
+    blocking = False  # whether its methods might block, for more than taking a thread lock
+
+
+    def __init__(self, name: str = "", pacing: bool = False, pacing_margin: float = 0):
+        self.name = name
+        self.pacing = pacing
+        self.pacing_margin = pacing_margin
+        self._budget = self._empty_budget()
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return f"<ratelimit {self.name}: {self.remaining} remaining, reset at {self.reset_at}>"
+
+    @staticmethod
+    def _empty_budget() -> dict:
+        return dict(
+            remaining=None,  # unknown until a response told us
+            reset_at=0,
+            next_at=0,  # when pacing, the earliest time for the next request
+            in_flight=[],  # [expires_at, cost, reservation] of requests without a response yet
+        )
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            yield
+
+    def _load(self) -> dict:
+        """ call while locked """
+        return dict(self._budget)
+
+    def _store(self, budget: dict) -> None:
+        """ call while locked """
+        self._budget = budget
+
+    def _current(self) -> dict:
+        """ Like _load, but a window that has been reset is unknown again. """
+        budget = self._load()
+        if budget["reset_at"] <= time.time():
+            return self._empty_budget()
+        return budget
+
+    @property
+    def remaining(self) -> Optional[float]:
+        with self._locked():
+            return self._current()["remaining"]
+
+    @property
+    def reset_at(self) -> float:
+        with self._locked():
+            return self._current()["reset_at"]
+
+    @staticmethod
+    def _in_flight(budget: dict, now: float) -> list:
+        """
+        Reservations still in flight - those older than a request can take, failed without a response
+        (and those stored by older versions, without a reservation to tell them apart).
+        """
+        return [entry for entry in budget["in_flight"] if len(entry) == 3 and entry[0] > now]
+
+    @staticmethod
+    def _without(in_flight: list, reservation: Optional[str]) -> list:
+        return [entry for entry in in_flight if entry[2] != reservation]
+
+    def update(self, remaining: int, reset_at: float, reservation: str = None) -> None:
+        """
+        Record what the hoster reported in the response to a reservation (see reserve).
+
+        Our other reservations are still in flight, and not counted by the hoster yet - so we trust the reported
+        count, less those. Without a reservation, all of them are still in flight.
+        """
+        with self._locked():
+            budget = self._current()
+            in_flight = self._without(self._in_flight(budget, time.time()), reservation)
+            budget.update(remaining=max(remaining - sum(entry[1] for entry in in_flight), 0), reset_at=reset_at,
+                          in_flight=in_flight)
+            self._store(budget)
+
+    def release(self, reservation: str) -> None:
+        """
+        Done with a reservation, without a reported budget - the request failed, or its response had none.
+
+        Its cost stays taken, we don't know if the hoster counted it. Reservations nobody releases or updates
+        (e.g. of a crashed thread) expire after a request timeout.
+        """
+        with self._locked():
+            budget = self._current()
+            in_flight = self._without(self._in_flight(budget, time.time()), reservation)
+            if len(in_flight) < len(budget["in_flight"]):
+                budget["in_flight"] = in_flight
+                self._store(budget)
+
+    def reserve(self, cost: float = 1) -> Tuple[Optional[str], float]:
+        """
+        Take cost from the budget, if there is enough of it.
+
+        :return: reservation, seconds to wait -
+                 with a reservation, wait before sending (pacing) - then update or release it with the response,
+                 without one (None), wait until there is budget again
+        """
+        reservation = uuid.uuid4().hex
+        with self._locked():
+            budget = self._current()
+            remaining, reset_at = budget["remaining"], budget["reset_at"]
+            now = time.time()
+            if remaining is None:
+                return reservation, 0  # no known limit
+            if remaining < cost:
+                return None, max(reset_at - now, 0)
+
+            send_at = now
+            if self.pacing:
+                send_at = max(now, budget["next_at"])
+                usable = max(remaining * (1 - self.pacing_margin), cost)
+                budget["next_at"] = send_at + (reset_at - send_at) * cost / usable
+            budget["remaining"] = remaining - cost
+            expires_at = send_at + DEFAULT_REQUEST_TIMEOUT
+            budget["in_flight"] = self._in_flight(budget, now) + [[expires_at, cost, reservation]]
+            self._store(budget)
+            return reservation, send_at - now
+
+    def acquire(self, cost: float = 1) -> str:
+        """
+        Reserve budget, sleeping until reset if needed - or until our turn, when pacing.
+
+        :return: reservation, to update or release with the response
+        """
+        while True:
+            reservation, sleep_s = self.reserve(cost)
+            if sleep_s > 0:
+                if reservation is not None:
+                    logger.debug(f"{self.name} pacing - sleeping {sleep_s}s")
+                else:
+                    logger.warning(f"{self.name} rate limiting: budget used up, sleeping {sleep_s}s")
+                time.sleep(sleep_s)
+            if reservation is not None:
+                return reservation
+
+    def is_exhausted(self) -> bool:
+        remaining = self.remaining
+        return remaining is not None and remaining < 1
+
+    def wait_seconds(self) -> float:
+        """ How long to wait before the next request - 0 unless the limit is used up. """
+        with self._locked():
+            budget = self._current()
+            if budget["remaining"] is None or budget["remaining"] >= 1:
+                return 0
+            return max(budget["reset_at"] - time.time(), 0)
+
+    def wait(self) -> None:
+        """ Sleep until reset, if the limit is used up. """
+        sleep_s = self.wait_seconds()
+        if sleep_s > 0:
+            logger.warning(f"{self.name} rate limiting: 0 requests remaining, sleeping {sleep_s}s")
+            time.sleep(sleep_s)
+
+
+class FileRateLimit(RateLimit):
+    """
+    RateLimit kept in a file, shared by every process using the same store directory.
+
+    The file is locked (flock) for each read-modify-write, so processes reserve from one budget.
+    """
+    blocking = True  # file I/O, waiting for the locks of other processes
+
+    def __init__(self, name: str, store_path: str, **kwargs):
+        super().__init__(name=name, **kwargs)
+        os.makedirs(store_path, exist_ok=True)
+        file_name = hashlib.sha256(name.encode()).hexdigest()[:32]
+        self.path = os.path.join(store_path, f"{file_name}.json")
+        self._file = None
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            with open(self.path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    self._file = f
+                    yield
+                finally:
+                    self._file = None
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self) -> dict:
+        self._file.seek(0)
+        content = self._file.read()
+        budget = self._empty_budget()
+        if content:
+            try:
+                budget.update(json.loads(content)["budget"])
+            except (ValueError, KeyError):
+                logger.warning(f"{self.name} - broken ratelimit file {self.path}, starting over")
+        return budget
+
+    def _store(self, budget: dict) -> None:
+        self._file.seek(0)
+        self._file.truncate()
+        json.dump(dict(name=self.name, budget=budget), self._file)
+        self._file.flush()
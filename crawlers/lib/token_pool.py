@@ -0,0 +1,127 @@
+"""
+Several credentials for one hoster, used side by side.
+
+Every credential has its own rate-limit budget. For each request, we pick the credential with the most
+budget left, and only sleep when all of them are used up - so one worker can saturate several tokens.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from crawlers.constants import TOKEN_POOL_LOG_EVERY
+from crawlers.lib.ratelimit import RateLimit
+
+logger = logging.getLogger(__name__)
+
+
+def token_key(token) -> str:
+    """ Short id to tell tokens apart in logs/stats, without showing them. """
+    return hashlib.sha256(json.dumps(token, sort_keys=True).encode()).hexdigest()[:8]
+
+
+class TokenPool:
+    """
+    Thread-safe choice between credentials, by their remaining rate-limit budget.
+
+    :param tokens: credentials, as the crawler takes them for its api_key
+    :param new_ratelimit: creates the RateLimit for a token (given its key) - e.g. shared with other processes
+    """
+
+    def __init__(self, tokens: list, new_ratelimit: Callable[[str], RateLimit] = None):
+        if not tokens:
+            raise ValueError("a TokenPool needs at least one token")
+        new_ratelimit = new_ratelimit or (lambda key: RateLimit(name=key))
+        self.tokens = list(tokens)
+        self.keys = [token_key(token) for token in self.tokens]
+        self.ratelimits: List[RateLimit] = [new_ratelimit(key) for key in self.keys]
+        self.usage: List[Dict[str, float]] = [dict(requests=0, cost=0) for _ in self.tokens]
+        self.acquired_count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __str__(self):
+        return f"<token pool of {len(self)}>"
+
+    @property
+    def blocking(self) -> bool:
+        """ see RateLimit.blocking """
+        return any(ratelimit.blocking for ratelimit in self.ratelimits)
+
+    def _index(self, token) -> int:
+        return self.tokens.index(token)
+
+    def _by_budget(self) -> List[int]:
+        """ Token indexes, most remaining budget first - unknown budget (not used yet) counts as the most. """
+        remaining = [ratelimit.remaining for ratelimit in self.ratelimits]
+        return sorted(range(len(self.tokens)),
+                      key=lambda i: (remaining[i] is not None, -(remaining[i] or 0), self.usage[i]["requests"]))
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """ Budget left over all tokens - None while any of them is unknown. """
+        remaining = [ratelimit.remaining for ratelimit in self.ratelimits]
+        if None in remaining:
+            return None
+        return sum(remaining)
+
+    def try_acquire(self, cost: float = 1) -> Tuple[Optional[object], Optional[str], float]:
+        """
+        Reserve cost on the token with the most budget left.
+
+        :return: token, reservation (see RateLimit.reserve), seconds to wait -
+                 with a token, wait before sending (pacing), without one, wait until a token resets
+        """
+        wait_s = []
+        for i in self._by_budget():
+            reservation, sleep_s = self.ratelimits[i].reserve(cost)
+            if reservation is not None:
+                with self._lock:
+                    self.usage[i]["requests"] += 1
+                    self.usage[i]["cost"] += cost
+                    self.acquired_count += 1
+                    log_stats = self.acquired_count % TOKEN_POOL_LOG_EVERY == 0
+                if log_stats:
+                    self.log_stats()
+                return self.tokens[i], reservation, sleep_s
+            wait_s.append(sleep_s)
+        return None, None, min(wait_s)
+
+    def acquire(self, cost: float = 1) -> Tuple[object, str]:
+        """
+        Reserve cost on a token, sleeping until one resets if all are used up.
+
+        :return: token, reservation
+        """
+        while True:
+            token, reservation, sleep_s = self.try_acquire(cost)
+            if sleep_s > 0:
+                if token is None:
+                    logger.warning(f"{self} rate limiting: all tokens used up, sleeping {sleep_s}s")
+                time.sleep(sleep_s)
+            if token is not None:
+                return token, reservation
+
+    def update(self, token, remaining: int, reset_at: float, reservation: str = None) -> None:
+        """ Record what the hoster reported in a response to a request made with token (see RateLimit.update). """
+        self.ratelimits[self._index(token)].update(remaining, reset_at, reservation)
+
+    def release(self, token, reservation: str) -> None:
+        """ Done with a reservation on token, without a reported budget (see RateLimit.release). """
+        self.ratelimits[self._index(token)].release(reservation)
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            usage = [dict(u) for u in self.usage]
+        return [
+            dict(token=key, remaining=ratelimit.remaining, reset_at=ratelimit.reset_at, **u)
+            for key, ratelimit, u in zip(self.keys, self.ratelimits, usage)
+        ]
+
+    def log_stats(self) -> None:
+        for token_stats in self.stats():
+            logger.info(f"{self} token usage: {token_stats}")
@@ -0,0 +1,59 @@
+"""
+Compressed request bodies for callback uploads.
+
+Encoded pieces are compressed as they come, so neither the uncompressed body nor its compressed form
+has to be built as a whole first. zstd needs the optional zstandard package, gzip is always available.
+"""
+import zlib
+from typing import Iterable, Iterator, List, Optional
+
+from crawlers.constants import (
+    CALLBACK_ENCODING_AUTO, CALLBACK_ENCODING_GZIP, CALLBACK_ENCODING_ZSTD, CALLBACK_GZIP_LEVEL
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def available_encodings() -> List[str]:
+    """ Content-Encodings we can produce, preferred first. """
+    if zstandard is not None:
+        return [CALLBACK_ENCODING_ZSTD, CALLBACK_ENCODING_GZIP]
+    return [CALLBACK_ENCODING_GZIP]
+
+
+def choose_encoding(configured: Optional[str], accepted: Optional[List[str]]) -> Optional[str]:
+    """
+    The Content-Encoding for an upload.
+
+    :param configured: encoding from our config - "auto" uses what the indexer accepts, empty/None means none
+    :param accepted: encodings the indexer announced for the block (None: we don't know)
+    :return: encoding, or None to upload uncompressed
+    """
+    if not configured:
+        return None
+    if configured == CALLBACK_ENCODING_AUTO:
+        return next((encoding for encoding in available_encodings() if encoding in (accepted or [])), None)
+    if configured == CALLBACK_ENCODING_ZSTD and zstandard is None:
+        return CALLBACK_ENCODING_GZIP  # zstandard isn't installed
+    return configured
+
+
+def _compressor(encoding: str):
+    if encoding == CALLBACK_ENCODING_GZIP:
+        return zlib.compressobj(CALLBACK_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # with gzip header
+    if encoding == CALLBACK_ENCODING_ZSTD:
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f"unknown content encoding: {encoding}")
+
+
+def iter_compressed(pieces: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """ Compress a body given in pieces, yielding compressed pieces as the compressor produces them. """
+    compressor = _compressor(encoding)
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
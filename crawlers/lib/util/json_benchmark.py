@@ -0,0 +1,68 @@
+"""
+Compare the JSON codecs we can use (see json_codec) on recorded hoster responses.
+
+    python -m crawlers.lib.util.json_benchmark [recorded_response.json ...]
+
+Without files, a synthetic page of GITHUB_QUERY_MAX repositories (shaped like a GitHub REST page) is used.
+"""
+import json
+import sys
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+from crawlers.constants import GITHUB_QUERY_MAX
+
+rounds = 50
+
+
+def synthetic_payload() -> bytes:
+    owner = {"login": "octocat", "id": 1, "node_id": "MDQ6VXNlcjE=", "type": "User", "site_admin": False,
+             **{f"{name}_url": f"https://api.github.com/users/octocat/{name}" for name in (
+                 "avatar", "html", "followers", "following", "gists", "starred", "subscriptions", "repos")}}
+    repos = [{"id": i, "node_id": "MDEwOlJlcG9zaXRvcnkxMjk2MjY5", "name": f"Hello-World-{i}",
+              "full_name": f"octocat/Hello-World-{i}", "owner": owner, "private": False, "fork": False,
+              "description": "This your first repo! ❤", "topics": ["octocat", "atom", "electron", "api"],
+              "stargazers_count": 80, "forks_count": 9, "pushed_at": "2011-01-26T19:06:43Z",
+              **{f"{name}_url": f"https://api.github.com/repos/octocat/Hello-World/{name}" for name in (
+                  "archive", "assignees", "blobs", "branches", "collaborators", "comments", "commits", "compare",
+                  "contents", "contributors", "deployments", "downloads", "events", "forks", "git_commits")}}
+             for i in range(GITHUB_QUERY_MAX)]
+    return json.dumps(repos).encode()
+
+
+def codecs() -> Dict[str, Tuple[Callable, Callable]]:
+    """ loads, dumps of every codec that is installed """
+    available = {"json": (json.loads, lambda obj: json.dumps(obj).encode())}
+    try:
+        import orjson
+        available["orjson"] = (orjson.loads, orjson.dumps)
+    except ImportError:
+        pass
+    try:
+        import ujson
+        available["ujson"] = (ujson.loads, lambda obj: ujson.dumps(obj).encode())
+    except ImportError:
+        pass
+    return available
+
+
+def run(payloads: List[bytes]) -> None:
+    size = sum(map(len, payloads))
+    print(f"{len(payloads)} payloads, {size / 1024:.0f} KiB, {rounds} rounds")
+    baseline = None
+    for name, (loads, dumps) in codecs().items():
+        parsed = [loads(payload) for payload in payloads]
+        load_s = timeit.timeit(lambda: [loads(payload) for payload in payloads], number=rounds) / rounds
+        dump_s = timeit.timeit(lambda: [dumps(obj) for obj in parsed], number=rounds) / rounds
+        baseline = baseline or (load_s, dump_s)
+        print(f"{name:>8}: loads {load_s * 1000:8.2f}ms ({baseline[0] / load_s:4.1f}x), "
+              f"dumps {dump_s * 1000:8.2f}ms ({baseline[1] / dump_s:4.1f}x), "
+              f"{size / load_s / 1024 / 1024:6.0f} MiB/s parsed")
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:]
+    if paths:
+        run([open(path, "rb").read() for path in paths])
+    else:
+        run([synthetic_payload()])
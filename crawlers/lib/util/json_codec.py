@@ -0,0 +1,63 @@
+"""
+JSON for the hot paths - parsing hoster responses and encoding callback bodies.
+
+Uses orjson or ujson when installed (pip install orjson), the standard library otherwise.
+Responses are parsed once: the parsed body is kept on the response, so the crawler and
+its rate-limit handling (which both look into it) share it.
+"""
+import json
+from typing import Any, Callable, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+_parsed_attribute = "_parsed_json"
+
+if orjson is not None:
+    name = "orjson"
+
+    def loads(data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+
+    def dumps(obj, default: Callable = None) -> bytes:
+        return orjson.dumps(obj, default=default)
+
+elif ujson is not None:
+    name = "ujson"
+
+    def loads(data: Union[bytes, str]) -> Any:
+        return ujson.loads(data)
+
+    def dumps(obj, default: Callable = None) -> bytes:
+        if default is None:
+            return ujson.dumps(obj, ensure_ascii=False).encode()
+        return ujson.dumps(obj, ensure_ascii=False, default=default).encode()  # ujson >= 5.2
+
+else:
+    name = "json"
+
+    def loads(data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+    def dumps(obj, default: Callable = None) -> bytes:
+        return json.dumps(obj, default=default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def response_json(response) -> Any:
+    """ The parsed body of a requests.Response - parsed on first use only. """
+    if not hasattr(response, _parsed_attribute):
+        setattr(response, _parsed_attribute, loads(response.content))
+    return getattr(response, _parsed_attribute)
+
+
+async def response_json_async(response) -> Any:
+    """ The parsed body of an aiohttp.ClientResponse - parsed on first use only. """
+    if not hasattr(response, _parsed_attribute):
+        setattr(response, _parsed_attribute, loads(await response.read()))
+    return getattr(response, _parsed_attribute)
@@ -1,4 +1,8 @@
 # https://stackoverflow.com/questions/36157634/how-to-incrementally-write-into-a-json-file
+from typing import Iterable, Iterator, List
+
+from crawlers.lib.projection import json_default
+from crawlers.lib.util.json_codec import dumps
 
 
 class StreamArray(list):
@@ -25,3 +29,25 @@ class StreamArray(list):
         be parsed
         """
         return self._len
+
+
+def iter_json_array(chunks: Iterable[List[dict]]) -> Iterator[bytes]:
+    """
+    Encode chunks of dicts (or records) as one JSON array, one encoded piece per chunk.
+
+    Suitable as a chunked-transfer request body - only the current chunk is held in memory.
+    """
+    separator = b"["
+    for chunk in chunks:
+        if not chunk:
+            continue
+        yield separator + b",".join(dumps(item, default=json_default) for item in chunk)
+        separator = b","
+    yield b"[]" if separator == b"[" else b"]"
+
+
+def iter_ndjson(chunks: Iterable[List[dict]]) -> Iterator[bytes]:
+    """ Encode chunks of dicts (or records) as newline delimited JSON, one encoded piece per chunk. """
+    for chunk in chunks:
+        if chunk:
+            yield b"".join(dumps(item, default=json_default) + b"\n" for item in chunk)
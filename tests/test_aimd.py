@@ -0,0 +1,62 @@
+from unittest import mock
+
+from crawlers.constants import AIMD_DECREASE_FACTOR, AIMD_RATE_INCREASE
+from crawlers.lib import aimd
+from crawlers.lib.aimd import AIMDController
+
+
+def test_success_increases_additively():
+    controller = AIMDController(rate=2, max_rate=100, max_concurrency=10)
+    controller.release()
+    assert controller.rate == 2 + AIMD_RATE_INCREASE / 2
+    assert controller.concurrency == 2
+    assert controller.successes == 1
+
+
+def test_increase_is_capped():
+    controller = AIMDController(rate=10, max_rate=10, max_concurrency=1)
+    controller.release()
+    assert controller.rate == 10
+    assert controller.concurrency == 1
+
+
+def test_throttle_decreases_multiplicatively():
+    controller = AIMDController(rate=10, min_rate=1)
+    controller.concurrency = 4
+    controller.release(throttled=True)
+    assert controller.rate == 10 * AIMD_DECREASE_FACTOR
+    assert controller.concurrency == 4 * AIMD_DECREASE_FACTOR
+    assert controller.throttles == 1
+
+
+def test_decrease_is_floored():
+    controller = AIMDController(rate=1, min_rate=1)
+    controller.release(throttled=True)
+    assert controller.rate == 1
+    assert controller.concurrency == 1
+
+
+def test_throttles_within_cooldown_count_once():
+    controller = AIMDController(rate=10, min_rate=0.1)
+    with mock.patch.object(aimd.time, "time", return_value=1000.0):
+        controller.release(throttled=True)
+        controller.release(throttled=True)
+    assert controller.rate == 10 * AIMD_DECREASE_FACTOR
+    assert controller.throttles == 2
+
+
+def test_retry_after_delays_next_request():
+    controller = AIMDController(rate=100)
+    controller.release(throttled=True, retry_after=30)
+    assert controller.try_acquire() > 25
+
+
+def test_concurrency_limits_requests_in_flight():
+    controller = AIMDController(rate=1000)
+    with mock.patch.object(aimd.time, "time", return_value=1000.0):
+        assert controller.try_acquire() == 0
+    with mock.patch.object(aimd.time, "time", return_value=2000.0):
+        assert controller.try_acquire() > 0  # concurrency 1, one in flight
+        controller.release()
+        assert controller.try_acquire() == 0
+    assert controller.in_flight == 1
@@ -0,0 +1,12 @@
+from crawlers.lib.platforms.bitbucket import BitBucketCrawler
+
+
+def test_partition_state_bitbucket_windows():
+    crawler = BitBucketCrawler("https://api.bitbucket.org/", state={}, api_key=dict(client_id=1, client_secret=2))
+    state = {}
+    windows = crawler.partition_state(state, 3)
+    assert len(windows) == 3
+    assert windows[0]['before'] is None and windows[-1]['after'] is None  # open ended, newest first
+    assert windows[0]['after'] == windows[1]['before']
+    windows[0]['is_done'] = True
+    assert crawler.partition_state(state, 3) == windows[1:]  # only windows left to crawl
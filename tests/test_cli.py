@@ -0,0 +1,48 @@
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from crawlers import cli_blueprint
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    with app.app_context():
+        yield app
+
+
+def test_failing_worker_stops_the_others(app, monkeypatch):
+    crawled = []
+    lock = threading.Lock()
+
+    def process_block_url(session, url):
+        if url == "failing":
+            time.sleep(0.1)
+            exit(1)  # like a hoster session that can't be set up
+        with lock:
+            crawled.append(url)
+        time.sleep(0.01)
+
+    monkeypatch.setattr(cli_blueprint, "process_block_url", process_block_url)
+    with pytest.raises(SystemExit):
+        cli_blueprint.run_block_urls(None, ["failing", "working"], workers=4)
+    assert not cli_blueprint.is_running()
+    crawled_count = len(crawled)
+    time.sleep(0.05)
+    assert len(crawled) == crawled_count  # nothing crawls anymore
+
+
+def test_workers_run_until_stopped(app, monkeypatch):
+    crawled = []
+
+    def process_block_url(session, url):
+        crawled.append(url)
+        if len(crawled) >= 10:
+            cli_blueprint.stop_running()
+
+    monkeypatch.setattr(cli_blueprint, "process_block_url", process_block_url)
+    cli_blueprint.run_block_urls(None, ["a", "b"], workers=2)
+    assert len(crawled) >= 10
@@ -0,0 +1,42 @@
+import gzip
+
+import pytest
+
+from crawlers.constants import CALLBACK_ENCODING_AUTO, CALLBACK_ENCODING_GZIP, CALLBACK_ENCODING_ZSTD
+from crawlers.lib.util import compression
+from crawlers.lib.util.compression import choose_encoding, iter_compressed
+
+pieces = [b'[', b'{"id":1}', b',', b'{"id":2}' * 1000, b']']
+
+
+def test_gzip_round_trip():
+    assert gzip.decompress(b"".join(iter_compressed(pieces, CALLBACK_ENCODING_GZIP))) == b"".join(pieces)
+
+
+def test_gzip_round_trip_empty():
+    assert gzip.decompress(b"".join(iter_compressed([], CALLBACK_ENCODING_GZIP))) == b""
+
+
+def test_zstd_round_trip():
+    zstandard = pytest.importorskip("zstandard")
+    compressed = b"".join(iter_compressed(pieces, CALLBACK_ENCODING_ZSTD))
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(compressed) == b"".join(pieces)
+
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError):
+        list(iter_compressed(pieces, "br"))
+
+
+def test_choose_encoding():
+    assert choose_encoding(None, [CALLBACK_ENCODING_GZIP]) is None
+    assert choose_encoding("", [CALLBACK_ENCODING_GZIP]) is None
+    assert choose_encoding(CALLBACK_ENCODING_AUTO, None) is None
+    assert choose_encoding(CALLBACK_ENCODING_AUTO, ["br", CALLBACK_ENCODING_GZIP]) == CALLBACK_ENCODING_GZIP
+    assert choose_encoding(CALLBACK_ENCODING_GZIP, None) == CALLBACK_ENCODING_GZIP
+
+
+def test_zstd_falls_back_to_gzip_without_zstandard(monkeypatch):
+    monkeypatch.setattr(compression, "zstandard", None)
+    assert choose_encoding(CALLBACK_ENCODING_ZSTD, None) == CALLBACK_ENCODING_GZIP
+    assert choose_encoding(CALLBACK_ENCODING_AUTO, [CALLBACK_ENCODING_ZSTD]) is None
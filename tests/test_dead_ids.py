@@ -0,0 +1,97 @@
+import json
+import time
+
+from crawlers.constants import DEAD_IDS_MISS_INTERVAL
+from crawlers.lib.dead_ids import DeadIdIndex
+
+long_ago = time.time() - 2 * DEAD_IDS_MISS_INTERVAL
+
+
+def dead_index(*ranges) -> DeadIdIndex:
+    """ An index with ranges missed twice, so they are dead. """
+    index = DeadIdIndex()
+    for start, end in ranges:
+        index.add_range(start, end, now=long_ago)
+        index.add_range(start, end)
+    return index
+
+
+def test_single_miss_is_not_dead():
+    index = DeadIdIndex()
+    index.add_range(10, 20)
+    assert not index.contains(15)
+    assert index.ranges() == []
+
+
+def test_miss_again_soon_is_not_dead():
+    index = DeadIdIndex()
+    index.add_range(10, 20)
+    index.add_range(10, 20)
+    assert not index.contains(15)
+
+
+def test_miss_again_later_is_dead():
+    index = dead_index((10, 20))
+    assert index.ranges() == [[10, 20]]
+    assert index.contains(10) and index.contains(19)
+    assert not index.contains(9) and not index.contains(20)
+    assert len(index) == 10
+
+
+def test_only_ids_missed_before_are_dead():
+    index = DeadIdIndex()
+    index.add_range(10, 20, now=long_ago)
+    index.add_range(15, 30)
+    assert index.ranges() == [[15, 20]]
+
+
+def test_add_range_merges_touching_and_overlapping():
+    index = dead_index((10, 20), (20, 25), (30, 40), (35, 50), (1, 2))
+    assert index.ranges() == [[1, 2], [10, 25], [30, 50]]
+    index = dead_index((10, 20), (30, 40), (5, 45))
+    assert index.ranges() == [[5, 45]]
+
+
+def test_add_all_and_empty_range():
+    index = dead_index((5, 5))
+    assert index.ranges() == []
+    index.add_all([3, 1, 2], now=long_ago)
+    index.add_all([1, 2, 3])
+    assert index.ranges() == [[1, 4]]
+
+
+def test_live_ids_skips_dead_ranges():
+    index = dead_index((3, 5), (7, 10))
+    assert index.live_ids(0, 6) == [0, 1, 2, 5, 6, 10]
+    assert index.live_ids(3, 3) == [5, 6, 10]  # starting inside a dead range
+    assert index.live_ids(0, 10, stop=8) == [0, 1, 2, 5, 6]
+    assert index.live_ids(0, 3, stop=0) == []
+
+
+def test_live_ids_without_dead_ranges():
+    assert DeadIdIndex().live_ids(100, 3) == [100, 101, 102]
+
+
+def test_dead_ids_expire():
+    index = DeadIdIndex(max_age=60)
+    index.add_range(10, 20, now=time.time() - 3 * DEAD_IDS_MISS_INTERVAL)
+    index.add_range(10, 20, now=time.time() - 2 * DEAD_IDS_MISS_INTERVAL)
+    assert not index.contains(15)
+    assert index.live_ids(10, 2) == [10, 11]
+
+
+def test_save_merges_with_other_processes(tmp_path):
+    path = str(tmp_path / "dead_ids.json")
+    first, second = DeadIdIndex(path), DeadIdIndex(path)
+    for index, (start, end) in ((first, (1, 5)), (second, (10, 15))):
+        index.add_range(start, end, now=long_ago)
+        index.add_range(start, end)
+    first.save()
+    second.save()
+    assert DeadIdIndex(path).ranges() == [[1, 5], [10, 15]]
+
+
+def test_load_ranges_without_timestamps(tmp_path):
+    path = tmp_path / "dead_ids.json"
+    path.write_text(json.dumps(dict(ranges=[[1, 5]])))
+    assert DeadIdIndex(str(path), max_age=60).ranges() == [[1, 5]]
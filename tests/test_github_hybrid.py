@@ -0,0 +1,91 @@
+import json
+import queue
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from crawlers.constants import BLOCK_KEY_FROM_ID, BLOCK_KEY_TO_ID
+from crawlers.lib.platforms.github.github_hybrid import GitHubHybridCrawler
+
+api_url = "https://api.github.com/"
+listing = [3, 5, 8, 13, 21, 34]  # existing repository ids
+page_size = 4
+
+
+def listing_response(request_method: str, url: str, **kwargs) -> requests.Response:
+    """ GitHub's /repositories?since= - page_size repositories after since, with a next link. """
+    since = int(url.split("since=")[1])
+    ids = [index for index in listing if index > since][:page_size]
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps([dict(id=index, node_id=f"node{index}") for index in ids]).encode()
+    response.headers = CaseInsensitiveDict({
+        "X-Ratelimit-Remaining": "4999", "X-Ratelimit-Reset": str(int(time.time()) + 3600),
+        "Authorization-Used": kwargs.get("headers", {}).get("Authorization", ""),
+    })
+    if ids:
+        response.headers["Link"] = f'<{api_url}repositories?since={ids[-1]}>; rel="next"'
+    response.request = requests.Request(request_method, url).prepare()
+    return response
+
+
+def new_crawler(api_key="token") -> GitHubHybridCrawler:
+    crawler = GitHubHybridCrawler(api_url, api_key=api_key)
+    crawler.requests.request = listing_response
+    return crawler
+
+
+def list_ids(crawler: GitHubHybridCrawler, state: dict) -> list:
+    ids = queue.Queue()
+    crawler.list_repository_ids(crawler.set_state(state), ids, threading.Event())
+    return list(iter(ids.get, None))
+
+
+def test_listing_pages_through_block():
+    crawler = new_crawler()
+    assert list_ids(crawler, {BLOCK_KEY_FROM_ID: 4, BLOCK_KEY_TO_ID: 30}) == [
+        (5, "node5"), (8, "node8"), (13, "node13"), (21, "node21")]
+    assert list_ids(crawler, {BLOCK_KEY_FROM_ID: 0, BLOCK_KEY_TO_ID: -1}) == [
+        (index, f"node{index}") for index in listing]
+    assert crawler.rest_ratelimit.remaining == 4999
+
+
+def test_listing_does_not_wait_for_graphql_budget():
+    crawler = new_crawler()
+    crawler.ratelimit.update(0, time.time() + 3600)  # GraphQL points used up
+    started = time.time()
+    assert len(list_ids(crawler, {BLOCK_KEY_FROM_ID: 0, BLOCK_KEY_TO_ID: -1})) == len(listing)
+    assert time.time() - started < 5
+    assert crawler.ratelimit._budget["in_flight"] == []
+
+
+def test_listing_uses_first_token_of_pool_without_its_graphql_budget():
+    crawler = new_crawler(api_key=["first", "second"])
+    authorizations = []
+
+    def request(request_method, url, **kwargs):
+        response = listing_response(request_method, url, **kwargs)
+        authorizations.append(response.headers["Authorization-Used"])
+        return response
+
+    crawler.requests.request = request
+    list_ids(crawler, {BLOCK_KEY_FROM_ID: 0, BLOCK_KEY_TO_ID: -1})
+    assert set(authorizations) == {"Bearer first"}
+    assert all(usage["requests"] == 0 for usage in crawler.token_pool.usage)
+
+
+def test_crawl_queries_listed_ids_in_order():
+    crawler = new_crawler()
+    queried = []
+
+    def query_batches(ids_batches):
+        queried.extend(ids_batches)
+        return [(True, [dict(id=node_id) for node_id in ids]) for ids in ids_batches], None
+
+    crawler.query_batches = query_batches
+    state = crawler.set_state({BLOCK_KEY_FROM_ID: 0, BLOCK_KEY_TO_ID: -1})
+    repos = [repo['id'] for success, repos, _ in crawler.crawl(state) for repo in repos]
+    assert repos == [f"node{index}" for index in listing]
+    assert state['current'] == listing[-1]
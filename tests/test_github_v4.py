@@ -0,0 +1,168 @@
+import json
+import time
+
+import pytest
+import requests
+
+from crawlers.constants import (
+    BLOCK_KEY_FINGERPRINTS, BLOCK_KEY_FROM_ID, BLOCK_KEY_IDS, BLOCK_KEY_TO_ID, GITHUB_FRONTIER_MAX_AGE,
+    GITHUB_FRONTIER_SAMPLE_STRIDE, GITHUB_FRONTIER_SLACK, GITHUB_QUERY_MAX, REPOSITORY_KEY_UNCHANGED
+)
+from crawlers.lib.platforms.github.github_v4 import GitHubV4Crawler
+
+highest_id = 20000  # repositories exist up to here
+
+
+class FakeGitHubV4Crawler(GitHubV4Crawler):
+    """ Answers probes and queries as if every id up to highest_id existed. """
+
+    def __init__(self, **kwargs):
+        super().__init__("https://api.github.com/", api_key="token", **kwargs)
+        self.probes = []
+
+    def probe_ids(self, start: int):
+        self.probes.append(start)
+        samples = range(start, start + GITHUB_QUERY_MAX * GITHUB_FRONTIER_SAMPLE_STRIDE, GITHUB_FRONTIER_SAMPLE_STRIDE)
+        return max((index for index in samples if index <= highest_id), default=None)
+
+    def query_batches(self, ids_batches):
+        results = [(True, [dict(id=node_id, databaseId=self.decode_id(node_id)) for node_id in ids
+                           if self.decode_id(node_id) <= highest_id])
+                   for ids in ids_batches]
+        return results, None
+
+    def check_ids(self, ids):
+        return [dict(id=self.encode_id(index), databaseId=index, updatedAt="2021-01-01T00:00:00Z",
+                     pushedAt="2021-01-01T00:00:00Z", stargazerCount=index % 3) for index in ids]
+
+
+def crawled_ids(crawler: GitHubV4Crawler, state: dict) -> list:
+    return [repo['databaseId'] for _, repos, _ in crawler.crawl(crawler.set_state(state)) for repo in repos]
+
+
+def test_probe_frontier():
+    crawler = FakeGitHubV4Crawler()
+    assert highest_id - GITHUB_FRONTIER_SLACK < crawler.get_frontier(0) <= highest_id
+
+
+def test_fresh_frontier_is_not_probed_again():
+    crawler = FakeGitHubV4Crawler()
+    crawler.frontier, crawler.frontier_probed_at = highest_id, time.time()
+    assert crawler.get_frontier(100) == highest_id
+    assert crawler.probes == []
+
+
+def test_old_frontier_is_probed_again():
+    crawler = FakeGitHubV4Crawler()
+    crawler.frontier, crawler.frontier_probed_at = 2493, time.time() - GITHUB_FRONTIER_MAX_AGE - 1
+    assert crawler.get_frontier(100) > highest_id - GITHUB_FRONTIER_SLACK
+    assert crawler.probes[0] == 2493  # from where we were
+
+
+@pytest.mark.parametrize("low", [2493 - GITHUB_FRONTIER_SLACK // 2, 5000])
+def test_fresh_frontier_below_block_is_probed_again(low):
+    crawler = FakeGitHubV4Crawler()
+    crawler.frontier, crawler.frontier_probed_at = 2493, time.time()
+    assert crawler.get_frontier(low) > highest_id - GITHUB_FRONTIER_SLACK
+
+
+def test_frontier_below_block_does_not_end_it():
+    crawler = FakeGitHubV4Crawler()
+    crawler.frontier, crawler.frontier_probed_at = 2493, time.time()
+    crawler.probe_ids = lambda start: None  # nothing sampled above the block start
+    assert crawler.get_frontier(5000) is None
+    ids = crawled_ids(crawler, {BLOCK_KEY_FROM_ID: 19000, BLOCK_KEY_TO_ID: -1})
+    assert ids == list(range(19000, highest_id + 1))  # until 10 empty batches
+
+
+def test_open_ended_block_above_cached_frontier():
+    crawler = FakeGitHubV4Crawler()
+    crawler.frontier, crawler.frontier_probed_at = 2493, time.time()
+    ids = crawled_ids(crawler, {BLOCK_KEY_FROM_ID: 5000, BLOCK_KEY_TO_ID: -1})
+    assert ids == list(range(5000, highest_id + 1))
+
+
+def test_open_ended_block_stops_after_frontier():
+    crawler = FakeGitHubV4Crawler()
+    crawled_ids(crawler, {BLOCK_KEY_FROM_ID: 19000, BLOCK_KEY_TO_ID: -1})
+    crawler.probes = []
+    state = crawler.set_state({BLOCK_KEY_FROM_ID: 0, BLOCK_KEY_TO_ID: -1})
+    for _ in crawler.crawl(state):
+        pass
+    assert state['current'] <= crawler.frontier + GITHUB_FRONTIER_SLACK + GITHUB_QUERY_MAX
+    assert crawler.probes == []  # the frontier of the last block was fresh enough
+
+
+def refresh_results(crawler: GitHubV4Crawler) -> list:
+    known = {str(index): crawler.get_fingerprint(node) for index, node in zip([1, 2], crawler.check_ids([1, 2]))}
+    state = crawler.set_state({BLOCK_KEY_IDS: [1, 2, 3], BLOCK_KEY_FINGERPRINTS: known})
+    return [repo for _, repos, _ in crawler.crawl(state) for repo in repos]
+
+
+def test_refresh_leaves_out_unchanged():
+    repos = refresh_results(FakeGitHubV4Crawler())
+    assert [repo['databaseId'] for repo in repos] == [3]
+    assert REPOSITORY_KEY_UNCHANGED not in repos[0]
+
+
+def test_refresh_uploads_unchanged_when_asked():
+    repos = refresh_results(FakeGitHubV4Crawler(upload_unchanged=True))
+    assert [repo['databaseId'] for repo in repos] == [1, 2, 3]
+    assert [repo.get(REPOSITORY_KEY_UNCHANGED, False) for repo in repos] == [True, True, False]
+    assert set(repos[0]) == {"id", "databaseId", "updatedAt", "pushedAt", "stargazerCount", REPOSITORY_KEY_UNCHANGED}
+
+
+def graphql_response(json_data: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps(json_data).encode()
+    return response
+
+
+def topics_crawler(share: float = 0.1) -> GitHubV4Crawler:
+    return GitHubV4Crawler("https://api.github.com/", api_key="token", topics_predicate=lambda repo: repo['stars'] > 1,
+                           topics_budget_share=share)
+
+
+def test_query_cost_without_ratelimit():
+    # GitHub answers with "rateLimit": null on partial errors
+    assert GitHubV4Crawler.get_cost({"data": {"rateLimit": None}}, 3) == 3
+    assert GitHubV4Crawler.get_cost({"data": None}) is None
+    assert GitHubV4Crawler.get_cost({"data": {"rateLimit": {"cost": 2}}}) == 2
+    assert GitHubV4Crawler.get_ratelimit({"data": {"rateLimit": None}}) is None
+
+
+def test_topics_need_known_budget():
+    crawler = topics_crawler()
+    assert not crawler.wants_topics()
+    crawler.remember_ratelimit((1000, time.time() + 3600))
+    assert crawler.wants_topics()
+    assert not topics_crawler(share=0).wants_topics()
+
+
+def test_topics_share_of_remaining_budget():
+    crawler = topics_crawler()
+    reset_at = time.time() + 3600
+    crawler.remember_ratelimit((1000, reset_at))
+    crawler.topics_points_spent[reset_at] = 100
+    assert crawler.wants_topics()
+    crawler.remember_ratelimit((900, reset_at))  # less remaining - the same points are too much now
+    assert not crawler.wants_topics()
+    crawler.remember_ratelimit((5000, reset_at + 3600))  # a new window
+    assert crawler.wants_topics()
+
+
+def test_enrich_topics_with_partial_errors():
+    crawler = topics_crawler()
+    reset_at = time.time() + 3600
+    crawler.remember_ratelimit((1000, reset_at))
+    topics = {"nodes": [{"topic": {"name": "graphql"}}]}
+    crawler.send = lambda *args, **kwargs: graphql_response({
+        "data": {"rateLimit": None, "a0": [{"id": "b", "repositoryTopics": topics}, None]},
+        "errors": [{"type": "NOT_FOUND", "path": ["a0", 1]}],
+    })
+    repos = [dict(id="a", stars=1), dict(id="b", stars=10)]
+    crawler.enrich_topics([repos])
+    assert "repositoryTopics" not in repos[0]  # not selected
+    assert repos[1]["repositoryTopics"] == topics
+    assert crawler.topics_points_spent == {reset_at: 1}
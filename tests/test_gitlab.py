@@ -0,0 +1,89 @@
+import json
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from crawlers.constants import (
+    BLOCK_KEY_FROM_ID, BLOCK_KEY_TO_ID, GITLAB_PAGINATION_KEYSET, GITLAB_PAGINATION_OFFSET
+)
+from crawlers.lib.hoster_context import HosterContext
+from crawlers.lib.platforms.gitlab import GitLabCrawler
+
+api_url = "https://gitlab.example.org/"
+projects = list(range(1, 26))  # existing project ids
+
+
+class FakeGitLab:
+    """ GitLab's /projects - with keyset pagination, unless it is too old and answers with page numbers. """
+
+    def __init__(self, keyset: bool = True):
+        self.keyset = keyset
+        self.requests = []
+
+    def request(self, method: str, url: str, params: dict = None, **kwargs) -> requests.Response:
+        params = {**dict(parse_qsl(urlparse(url).query)), **(params or {})}
+        self.requests.append(params)
+        per_page = int(params["per_page"])
+        response = requests.Response()
+        response.status_code = 200
+        response.headers = CaseInsensitiveDict()
+        if self.keyset and params.get("pagination") == GITLAB_PAGINATION_KEYSET:
+            after, before = int(params.get("id_after", 0)), int(params.get("id_before", 1000))
+            ids = [index for index in projects if after < index < before][:per_page]
+            if len(ids) == per_page:
+                next_params = {**params, "id_after": ids[-1]}
+                response.headers["Link"] = f'<{api_url}api/v4/projects?{urlencode(next_params)}>; rel="next"'
+        else:
+            page = int(params.get("page", 1))
+            ids = projects[(page - 1) * per_page:page * per_page]
+            response.headers["X-Page"] = str(page)
+        response._content = json.dumps([dict(id=index) for index in ids]).encode()
+        return response
+
+
+def new_crawler(hoster: FakeGitLab, state: dict, **kwargs) -> GitLabCrawler:
+    crawler = GitLabCrawler(api_url, state={"per_page": 10, **state}, **kwargs)
+    crawler.requests.request = hoster.request
+    return crawler
+
+
+def crawled_ids(crawler: GitLabCrawler) -> list:
+    return [repo['id'] for _, repos, _ in crawler.crawl() for repo in repos]
+
+
+def test_offset_pagination_by_default():
+    crawler = new_crawler(FakeGitLab(), {BLOCK_KEY_FROM_ID: 11, BLOCK_KEY_TO_ID: 20})
+    assert crawler.pagination == GITLAB_PAGINATION_OFFSET
+    url, params = crawler.get_request(crawler.state)
+    assert params["page"] == 2 and "pagination" not in params
+
+
+def test_keyset_request_by_block_ids():
+    state = {BLOCK_KEY_FROM_ID: 5, BLOCK_KEY_TO_ID: 17}
+    crawler = new_crawler(FakeGitLab(), state, keyset_hosts=["gitlab.example.org"])
+    url, params = crawler.get_request(crawler.state)
+    assert params["pagination"] == GITLAB_PAGINATION_KEYSET
+    assert (params["id_after"], params["id_before"]) == (4, 18)  # block ids are inclusive
+    crawler.state['next_url'] = "https://gitlab.example.org/api/v4/projects?id_after=14"
+    assert crawler.get_request(crawler.state) == (crawler.state['next_url'], None)
+
+
+def test_keyset_crawl_follows_links():
+    hoster = FakeGitLab()
+    crawler = new_crawler(hoster, {BLOCK_KEY_FROM_ID: 5, BLOCK_KEY_TO_ID: 23}, keyset_hosts=["gitlab.example.org"])
+    assert crawled_ids(crawler) == list(range(5, 24))
+    assert [params.get("id_after") for params in hoster.requests] == [4, "14"]
+
+
+def test_keyset_falls_back_to_offset():
+    hoster, context = FakeGitLab(keyset=False), HosterContext("gitlab", api_url, None)
+    state = {BLOCK_KEY_FROM_ID: 11, BLOCK_KEY_TO_ID: 20}
+    crawler = new_crawler(hoster, state, keyset_hosts=["gitlab.example.org"], context=context)
+    assert crawler.pagination == GITLAB_PAGINATION_KEYSET
+    assert crawled_ids(crawler) == list(range(11, 21))
+    assert hoster.requests[0]["pagination"] == GITLAB_PAGINATION_KEYSET
+    assert hoster.requests[1]["page"] == 2
+    # the next block of this hoster doesn't try keyset pagination again
+    next_crawler = new_crawler(hoster, state, keyset_hosts=["gitlab.example.org"], context=context)
+    assert next_crawler.pagination == GITLAB_PAGINATION_OFFSET
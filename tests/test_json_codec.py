@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+import requests
+
+from crawlers.lib.projection import json_default, project
+from crawlers.lib.util import json_codec
+from crawlers.lib.util.stream_array import iter_json_array, iter_ndjson
+
+
+class CountingResponse(requests.Response):
+    """ Counts how often its body is read. """
+
+    def __init__(self, body: bytes):
+        super().__init__()
+        self.status_code = 200
+        self._content = body
+        self.reads = 0
+
+    @property
+    def content(self):
+        self.reads += 1
+        return self._content
+
+
+class FakeAsyncResponse:
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.reads = 0
+
+    async def read(self) -> bytes:
+        self.reads += 1
+        return self.body
+
+
+def test_dumps_roundtrip():
+    data = dict(id=1, name="ünïcode", topics=["a", "b"], fork=None, stars=1.5)
+    encoded = json_codec.dumps(data)
+    assert isinstance(encoded, bytes)
+    assert json_codec.loads(encoded) == json.loads(encoded) == data
+    assert json_codec.loads(encoded.decode()) == data
+
+
+def test_dumps_records():
+    records = project([dict(id=1, owner=dict(login="me", id=2), extra=True)], "Record", ("id", "owner.login"))
+    assert json.loads(json_codec.dumps(records[0], default=json_default)) == dict(id=1, owner=dict(login="me"))
+
+
+def test_streamed_arrays_are_valid_json():
+    chunks = [[dict(id=1), dict(id=2)], [], [dict(id=3)]]
+    assert json.loads(b"".join(iter_json_array(chunks))) == [dict(id=1), dict(id=2), dict(id=3)]
+    lines = b"".join(iter_ndjson(chunks)).splitlines()
+    assert [json.loads(line) for line in lines] == [dict(id=1), dict(id=2), dict(id=3)]
+
+
+def test_response_json_parses_once():
+    response = CountingResponse(b'{"data": {"id": 1}}')
+    assert json_codec.response_json(response) == {"data": {"id": 1}}
+    assert json_codec.response_json(response) is json_codec.response_json(response)
+    assert response.reads == 1
+
+
+def test_response_json_async_parses_once():
+    response = FakeAsyncResponse(b'[1, 2]')
+
+    async def parse_twice():
+        return await json_codec.response_json_async(response), await json_codec.response_json_async(response)
+
+    first, second = asyncio.run(parse_twice())
+    assert first == [1, 2] and first is second
+    assert response.reads == 1
@@ -0,0 +1,77 @@
+import json
+
+import requests
+
+from crawlers.lib.oauth_token_cache import OAuthTokenCache
+from crawlers.lib.platforms import bitbucket
+from crawlers.lib.platforms.bitbucket import BitBucketCrawler
+
+
+def json_response(status: int, json_data: dict = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(json_data or {}).encode()
+    return response
+
+
+class FakeTokenSession:
+    """ Hands out numbered tokens, recording the grants asked for. """
+
+    def __init__(self, expires_in: int = 3600):
+        self.expires_in = expires_in
+        self.grants = []
+
+    def post(self, url, data, **kwargs):
+        self.grants.append(data["grant_type"])
+        return json_response(200, dict(access_token=f"token{len(self.grants)}", refresh_token="refresh",
+                                       expires_in=self.expires_in))
+
+
+def test_token_is_cached():
+    cache, session = OAuthTokenCache("https://example.com/token", refresh_margin=60), FakeTokenSession()
+    assert cache.get_token(session, "client", "secret") == "token1"
+    assert cache.get_token(session, "client", "secret") == "token1"
+    assert session.grants == ["client_credentials"]
+
+
+def test_token_is_refreshed_before_it_expires():
+    cache, session = OAuthTokenCache("https://example.com/token", refresh_margin=60), FakeTokenSession(expires_in=30)
+    assert cache.get_token(session, "client", "secret") == "token1"
+    assert cache.get_token(session, "client", "secret") == "token2"
+    assert session.grants == ["client_credentials", "refresh_token"]
+
+
+def test_invalidate_keeps_a_newer_token():
+    cache, session = OAuthTokenCache("https://example.com/token", refresh_margin=60), FakeTokenSession()
+    cache.get_token(session, "client", "secret")
+    cache.invalidate("client", "token1")
+    assert cache.get_token(session, "client", "secret") == "token2"
+    cache.invalidate("client", "token1")  # another thread got token2 since
+    assert cache.get_token(session, "client", "secret") == "token2"
+
+
+def test_rejected_token_is_replaced_and_retried(monkeypatch):
+    cache, session = OAuthTokenCache("https://example.com/token", refresh_margin=60), FakeTokenSession()
+    monkeypatch.setattr(bitbucket, "token_cache", cache)
+    crawler = BitBucketCrawler("https://api.bitbucket.org/", state={}, api_key=dict(client_id=1, client_secret=2))
+    crawler.get_access_token = lambda: cache.get_token(session, crawler.client_id, crawler.client_secret)
+    sent = []
+
+    def send(method, url, headers=None, **kwargs):
+        sent.append(headers["Authorization"])
+        return json_response(401 if len(sent) == 1 else 200)
+
+    crawler.send = send
+    assert crawler.request("https://api.bitbucket.org/2.0/repositories").status_code == 200
+    assert sent == ["Bearer token1", "Bearer token2"]
+
+
+def test_rejected_token_is_retried_only_once(monkeypatch):
+    cache, session = OAuthTokenCache("https://example.com/token", refresh_margin=60), FakeTokenSession()
+    monkeypatch.setattr(bitbucket, "token_cache", cache)
+    crawler = BitBucketCrawler("https://api.bitbucket.org/", state={}, api_key=dict(client_id=1, client_secret=2))
+    crawler.get_access_token = lambda: cache.get_token(session, crawler.client_id, crawler.client_secret)
+    sent = []
+    crawler.send = lambda method, url, headers=None, **kwargs: sent.append(headers) or json_response(401)
+    assert crawler.request("https://api.bitbucket.org/2.0/repositories").status_code == 401
+    assert len(sent) == 2
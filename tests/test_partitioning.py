@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from crawlers.constants import CRAWLER_PARTITION_BUFFER, CRAWLER_PARTITION_MIN_PAGES
+from crawlers.lib.platforms.gitlab import GitLabCrawler
+from crawlers.lib.platforms.i_crawler import ICrawler
+
+
+class PageCrawler(ICrawler):
+    """ Yields the page numbers of its state as repos. """
+    type = "pages"
+
+    def __init__(self, state: dict, partitions: int = 1):
+        super().__init__("https://example.org/", "", state, partitions=partitions)
+        self.crawled = []
+        self._lock = threading.Lock()
+
+    def crawl(self, state: dict = None):
+        state = state or self.state
+        for page in range(state['page'], state['page_end'] + 1):
+            with self._lock:
+                self.crawled.append(page)
+            yield True, [page], state
+
+
+@pytest.mark.parametrize("start, end, parts, min_size, expected", [
+    (1, 10, 1, 1, [(1, 10)]),
+    (1, 10, 2, 1, [(1, 5), (6, 10)]),
+    (1, 10, 3, 1, [(1, 4), (5, 8), (9, 10)]),
+    (1, 10, 4, 5, [(1, 5), (6, 10)]),  # not smaller than min_size
+    (1, 4, 4, 5, [(1, 4)]),
+    (5, 5, 3, 1, [(5, 5)]),
+    (1, 3, 10, 1, [(1, 1), (2, 2), (3, 3)]),
+    (1, 10, 0, 1, [(1, 10)]),
+])
+def test_split_range(start, end, parts, min_size, expected):
+    assert ICrawler.split_range(start, end, parts, min_size) == expected
+
+
+def test_split_range_covers_range_without_gaps():
+    for end in range(1, 60):
+        for parts in range(1, 8):
+            ranges = ICrawler.split_range(1, end, parts)
+            assert ranges[0][0] == 1 and ranges[-1][1] == end
+            assert all(previous[1] + 1 == current[0] for previous, current in zip(ranges, ranges[1:]))
+
+
+def test_partition_state_by_pages():
+    crawler = PageCrawler({})
+    state = dict(page=1, page_end=4 * CRAWLER_PARTITION_MIN_PAGES, per_page=100, is_done=False)
+    states = crawler.partition_state(state, 4)
+    assert [(s['page'], s['page_end']) for s in states] == [(1, 5), (6, 10), (11, 15), (16, 20)]
+    assert all(s['per_page'] == 100 for s in states)
+
+
+@pytest.mark.parametrize("state, parts", [
+    (dict(page=1, page_end=100), 1),
+    (dict(page=1, page_end=-1), 4),  # no known end
+    (dict(page_end=100), 4),
+])
+def test_partition_state_keeps_one_piece(state, parts):
+    assert PageCrawler({}).partition_state(state, parts) == [state]
+
+
+def test_partition_state_gitlab_keyset_by_ids():
+    crawler = GitLabCrawler("https://gitlab.example.org/", keyset_hosts=["gitlab.example.org"],
+                            state=dict(from_id=1, to_id=2000))
+    states = crawler.partition_state(crawler.state, 2)
+    assert [(s['from_id'], s['to_id']) for s in states] == [(1, 1000), (1001, 2000)]
+    started = dict(crawler.state, next_url="https://gitlab.example.org/api/v4/projects?id_after=5")
+    assert crawler.partition_state(started, 2) == [started]
+
+
+def test_crawl_partitioned_keeps_block_order():
+    crawler = PageCrawler(dict(page=1, page_end=40), partitions=4)
+    assert [repos[0] for _, repos, _ in crawler.crawl_partitioned()] == list(range(1, 41))
+
+
+def test_crawl_partitioned_buffers_few_pages_ahead():
+    crawler = PageCrawler(dict(page=1, page_end=400), partitions=4)
+    results = crawler.crawl_partitioned()
+    next(results)
+    time.sleep(0.2)
+    # each sub-range holds its buffer, and one more result waiting to be put
+    assert len(crawler.crawled) <= 4 * (CRAWLER_PARTITION_BUFFER + 2)
+    results.close()
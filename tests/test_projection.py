@@ -0,0 +1,27 @@
+from crawlers.lib.projection import field_tree, json_default, project, prune, record_type
+from crawlers.lib.util.json_codec import dumps, loads
+
+
+def test_field_tree():
+    assert field_tree(["id", "owner.login", "owner.id", "links.html.href"]) == {
+        "id": True, "owner": {"login": True, "id": True}, "links": {"html": {"href": True}}}
+
+
+def test_prune_keeps_only_tree_fields():
+    value = {"login": "octocat", "id": 1, "avatar_url": "https://example.org/a.png"}
+    assert prune(value, {"login": True}) == {"login": "octocat"}
+    assert prune(None, {"login": True}) is None
+    assert prune([1, 2], {"login": True}) == [1, 2]
+
+
+def test_project_and_serialize():
+    repos = [{"id": 1, "name": "a", "owner": {"login": "o", "url": "u"}, "noise": "x"},
+             {"id": 2, "owner": None}]
+    records = project(repos, "TestRecord", ("id", "name", "owner.login"))
+    assert loads(dumps(records, default=json_default)) == [
+        {"id": 1, "name": "a", "owner": {"login": "o"}}, {"id": 2, "owner": None}]
+
+
+def test_record_types_are_reused():
+    assert record_type("TestRecord", ("id",)) is record_type("TestRecord", ("id",))
+    assert record_type("TestRecord", ("id",)).__slots__ == ("id",)
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+
+import requests
+
+from crawlers.lib.platforms.aio.i_async_crawler import IAsyncCrawler
+from crawlers.lib.platforms.i_crawler import ICrawler
+from crawlers.lib.ratelimit import FileRateLimit, RateLimit
+
+
+def test_reserve_without_known_limit():
+    reservation, sleep_s = RateLimit().reserve()
+    assert reservation is not None and sleep_s == 0
+
+
+def test_reserve_until_used_up():
+    ratelimit = RateLimit()
+    ratelimit.update(2, time.time() + 60)
+    assert ratelimit.reserve()[0] and ratelimit.reserve()[0]
+    reservation, sleep_s = ratelimit.reserve()
+    assert reservation is None and 55 < sleep_s <= 60
+
+
+def test_update_counts_requests_in_flight():
+    ratelimit = RateLimit()
+    reset_at = time.time() + 3600
+    ratelimit.update(100, reset_at)
+    reservations = [ratelimit.acquire() for _ in range(10)]
+    ratelimit.update(99, reset_at, reservation=reservations[3])  # answered, 9 are still in flight
+    assert ratelimit.remaining == 90
+    ratelimit.update(98, reset_at, reservation=reservations[0])
+    assert ratelimit.remaining == 90
+
+
+def test_update_without_reservation_counts_all_in_flight():
+    ratelimit = RateLimit()
+    reset_at = time.time() + 3600
+    ratelimit.update(100, reset_at)
+    ratelimit.acquire(cost=5)
+    ratelimit.update(100, reset_at)
+    assert ratelimit.remaining == 95
+
+
+def test_released_reservations_are_not_in_flight():
+    ratelimit = RateLimit()
+    reset_at = time.time() + 3600
+    ratelimit.update(100, reset_at)
+    for _ in range(5):
+        ratelimit.release(ratelimit.acquire())  # e.g. checked without an update of the budget
+    answered = ratelimit.acquire()
+    ratelimit.update(94, reset_at, reservation=answered)
+    assert ratelimit.remaining == 94
+
+
+def test_update_recovers_from_overshooting_reservations():
+    ratelimit = RateLimit()
+    reset_at = time.time() + 3600
+    ratelimit.update(10, reset_at)
+    for _ in range(10):
+        ratelimit.reserve()
+    ratelimit._budget["in_flight"] = []  # as if they all failed, and expired
+    ratelimit.update(8, reset_at)
+    assert ratelimit.remaining == 8
+
+
+def test_reset_window_is_unknown_again():
+    ratelimit = RateLimit()
+    ratelimit.update(0, time.time() - 1)
+    assert ratelimit.remaining is None
+    assert ratelimit.wait_seconds() == 0
+
+
+def test_pacing_spreads_budget_until_reset():
+    ratelimit = RateLimit(pacing=True)
+    ratelimit.update(10, time.time() + 100)
+    sleeps = [ratelimit.reserve()[1] for _ in range(3)]
+    assert sleeps[0] == 0
+    assert 9 < sleeps[1] <= 10 and 19 < sleeps[2] <= 20
+
+
+def test_file_ratelimit_is_shared(tmp_path):
+    first = FileRateLimit("hoster", store_path=str(tmp_path))
+    second = FileRateLimit("hoster", store_path=str(tmp_path))
+    reset_at = time.time() + 3600
+    first.update(10, reset_at)
+    reservation = second.acquire(cost=3)
+    assert first.remaining == 7
+    first.update(9, reset_at, reservation=reservation)
+    assert second.remaining == 9
+
+
+def test_file_ratelimit_drops_reservations_of_older_versions(tmp_path):
+    ratelimit = FileRateLimit("hoster", store_path=str(tmp_path))
+    ratelimit.update(10, time.time() + 3600)
+    with ratelimit._locked():
+        budget = ratelimit._load()
+        budget["in_flight"] = [[time.time() + 60, 1]]
+        ratelimit._store(budget)
+    ratelimit.update(10, time.time() + 3600)
+    assert ratelimit.remaining == 10
+
+
+class ReportingCrawler(ICrawler):
+    """ Each response reports one less remaining - only for requests to /reporting. """
+    type = "reporting"
+
+    def __init__(self):
+        super().__init__("https://example.org/", "", {})
+        self.reported = 100
+        self.requests.request = self.respond
+
+    def respond(self, method, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        return response
+
+    def get_response_ratelimit(self, response):
+        if not response.url.endswith("/reporting"):
+            return None
+        self.reported -= 1
+        return self.reported, time.time() + 3600
+
+
+def test_send_settles_its_reservation():
+    crawler = ReportingCrawler()
+    crawler.ratelimit.update(100, time.time() + 3600)
+    for _ in range(5):
+        crawler.send("GET", "https://example.org/silent")  # e.g. a query we don't read the budget of
+    crawler.send("GET", "https://example.org/reporting")
+    assert crawler.ratelimit._budget["in_flight"] == []
+    assert crawler.ratelimit.remaining == 99
+
+
+class AsyncReportingCrawler(IAsyncCrawler, ReportingCrawler):
+
+    def crawl(self, state: dict = None):
+        raise NotImplementedError
+
+
+def test_async_crawlers_keep_file_ratelimits_off_the_event_loop(tmp_path):
+    crawler = AsyncReportingCrawler(session=None)
+    threads = []
+    with_thread = lambda *args: threads.append(threading.current_thread()) or args
+
+    crawler.ratelimit = FileRateLimit("shared", store_path=str(tmp_path))
+    asyncio.run(crawler.reserve_ratelimit_async())
+    assert asyncio.run(crawler.run_ratelimit(with_thread, 1)) == (1,)
+    crawler.ratelimit = RateLimit()
+    asyncio.run(crawler.run_ratelimit(with_thread))
+    assert threads[0] is not threading.main_thread()
+    assert threads[1] is threading.main_thread()  # in memory, not worth a thread
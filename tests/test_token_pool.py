@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from crawlers.lib.token_pool import TokenPool
+
+
+def test_needs_tokens():
+    with pytest.raises(ValueError):
+        TokenPool([])
+
+
+def test_unknown_budgets_are_used_first():
+    pool = TokenPool(["a", "b"])
+    pool.update("a", 100, time.time() + 3600)
+    token, _, sleep_s = pool.try_acquire()
+    assert token == "b" and sleep_s == 0
+
+
+def test_most_remaining_budget_is_used():
+    pool = TokenPool(["a", "b", "c"])
+    reset_at = time.time() + 3600
+    for token, remaining in (("a", 10), ("b", 500), ("c", 50)):
+        pool.update(token, remaining, reset_at)
+    assert pool.try_acquire()[0] == "b"
+    assert pool.remaining == 10 + 499 + 50
+
+
+def test_least_used_token_breaks_ties():
+    pool = TokenPool(["a", "b"])
+    assert [pool.try_acquire()[0] for _ in range(4)] == ["a", "b", "a", "b"]
+
+
+def test_used_up_tokens_wait_for_earliest_reset():
+    pool = TokenPool(["a", "b"])
+    now = time.time()
+    pool.update("a", 0, now + 100)
+    pool.update("b", 0, now + 50)
+    token, _, sleep_s = pool.try_acquire()
+    assert token is None
+    assert 40 < sleep_s <= 50
+
+
+def test_update_settles_reservation_of_token():
+    pool = TokenPool(["a", "b"])
+    reset_at = time.time() + 3600
+    pool.update("a", 100, reset_at)
+    pool.update("b", 10, reset_at)
+    token, first, _ = pool.try_acquire()
+    _, second, _ = pool.try_acquire()
+    pool.update(token, 99, reset_at, reservation=first)
+    assert pool.ratelimits[0].remaining == 98  # the second one is still in flight
+    pool.release(token, second)
+    pool.update(token, 98, reset_at)
+    assert pool.ratelimits[0].remaining == 98
+
+
+def test_used_up_token_is_skipped():
+    pool = TokenPool(["a", "b"])
+    reset_at = time.time() + 3600
+    pool.update("a", 0, reset_at)
+    pool.update("b", 1, reset_at)
+    assert pool.try_acquire(cost=1)[0] == "b"
+    assert pool.try_acquire(cost=1)[0] is None
@@ -0,0 +1,70 @@
+import json
+import logging
+
+import pytest
+import requests
+from flask import Flask
+
+from crawlers.config import TestingConfig
+from crawlers.constants import BLOCK_KEY_CALLBACK_URL, CALLBACK_FORMAT_JSON
+from crawlers.lib import crawl
+
+block_data = {BLOCK_KEY_CALLBACK_URL: "https://indexer.example.org/callback"}
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.from_object(TestingConfig)
+    app.config.update(CALLBACK_STREAM_FORMAT=CALLBACK_FORMAT_JSON, CALLBACK_ENCODING="")
+    with app.app_context():
+        yield app
+
+
+def indexer_response(status: int) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = b"nope" if status >= 400 else b""
+    return response
+
+
+class Uploads(list):
+    """ Sessions and bodies streamed to the indexer, which answers with status. """
+    status = 200
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    uploads = Uploads()
+
+    def put(session, url, data=None, **kwargs):
+        uploads.append((session, b"".join(chunk.encode() if isinstance(chunk, str) else chunk for chunk in data)))
+        return indexer_response(uploads.status)
+
+    monkeypatch.setattr(requests.Session, "put", put)
+    monkeypatch.setattr(crawl, "iter_block", lambda block_data: iter([[dict(id=1)], [dict(id=2)]]))
+    return uploads
+
+
+def test_upload_response_check():
+    assert crawl.log_upload_response(indexer_response(200), block_data)
+    assert not crawl.log_upload_response(indexer_response(500), block_data)
+
+
+def test_stream_block(app, uploads, caplog):
+    indexer_session = requests.Session()
+    indexer_session.headers["Authorization"] = "Basic key"
+    crawl.stream_block(indexer_session, block_data)
+    (upload_session, body), = uploads
+    assert json.loads(body) == [dict(id=1), dict(id=2)]
+    assert upload_session is not indexer_session  # without its retrying adapters
+    assert upload_session.headers["Authorization"] == "Basic key"
+    assert "failed" not in caplog.text
+
+
+def test_stream_block_upload_refused(app, uploads, caplog):
+    uploads.status = 500
+    with caplog.at_level(logging.WARNING):
+        crawl.stream_block(requests.Session(), block_data)
+    assert len(uploads) == 1  # not sent again - the indexer hands out the block again
+    assert "status: 500" in caplog.text and "skipping block" in caplog.text